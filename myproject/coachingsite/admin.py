@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Article, Message, Response, RoundResult, Profile
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from myproject.timing import slow_requests
+
+from .models import Article, CourseStats, Job, Message, Response, RoundResult, Profile, VideoBlob
 
 
 @admin.register(Article)
@@ -30,3 +35,48 @@ class RoundResultAdmin(admin.ModelAdmin):
 	list_filter = ('played_on', 'athlete')
 	search_fields = ('course_name', 'athlete__username', 'athlete__first_name', 'athlete__last_name')
 	readonly_fields = ('created_at',)
+
+
+@admin.register(CourseStats)
+class CourseStatsAdmin(admin.ModelAdmin):
+	list_display = ('athlete', 'course_name', 'is_total', 'rounds', 'best', 'worst', 'updated_at')
+	list_filter = ('is_total',)
+	search_fields = ('course_name', 'athlete__username')
+	readonly_fields = ('updated_at',)
+
+
+@admin.register(VideoBlob)
+class VideoBlobAdmin(admin.ModelAdmin):
+	list_display = ('name', 'size', 'refcount', 'replaced_by', 'created_at')
+	search_fields = ('name',)
+	readonly_fields = ('name', 'size', 'refcount', 'replaced_by', 'created_at')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+	list_display = ('id', 'task', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'finished_at')
+	list_filter = ('status', 'task')
+	readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_until', 'last_error')
+	actions = ['retry_now']
+
+	@admin.action(description='Retry selected jobs now')
+	def retry_now(self, request, queryset):
+		updated = queryset.exclude(status=Job.RUNNING).update(
+			status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None, last_error='',
+		)
+		self.message_user(request, f'{updated} jobs queued.')
+
+
+def slow_requests_view(request):
+	"""List the slowest requests this process has served, with their SQL."""
+	if request.method == 'POST':
+		slow_requests.clear()
+		return redirect('slow_requests')
+	context = {
+		**admin.site.each_context(request),
+		'title': 'Slow requests',
+		'entries': slow_requests.entries(),
+		'capacity': slow_requests.size,
+		'enabled': settings.REQUEST_TIMING_ENABLED,
+	}
+	return render(request, 'admin/slow_requests.html', context)
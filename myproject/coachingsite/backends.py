@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import DEFAULT_CACHE_ALIAS
+
+from myproject.caches import shared_cache
+
+from .usercache import cached_user
+
+UserModel = get_user_model()
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that loads the session's user and profile from the cache.
+
+    On a miss the user is read together with its profile in one query, so
+    ``request.user.profile`` never needs a second one.
+    """
+
+    def __init__(self):
+        super().__init__()
+        shared_cache(DEFAULT_CACHE_ALIAS)
+
+    def get_user(self, user_id):
+        user = cached_user(user_id, self._load_user)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    @staticmethod
+    def _load_user(user_id):
+        try:
+            return UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
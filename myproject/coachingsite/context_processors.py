@@ -0,0 +1,13 @@
+from .unread import unread_total
+
+
+def unread_messages(request):
+    """Expose the current user's unread message total to templates.
+
+    The value is a callable, so the (cached) count is only looked up when a
+    template actually renders it.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_message_count': lambda: unread_total(user)}
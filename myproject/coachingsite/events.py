@@ -0,0 +1,165 @@
+"""In-process publish/subscribe for live conversation updates.
+
+Views publish an event after a Message or Response is committed. The
+``conversation_events`` Server-Sent Events view subscribes to the
+conversation's channel and forwards events to the browser. Every open stream
+is one coroutine waiting on an ``asyncio.Queue``, so a single ASGI worker can
+hold thousands of idle connections without a thread each.
+
+The hub lives in process memory, so no broker is needed. Events published in
+one worker are not seen by streams held by another worker. The page also
+polls ``conversation_updates`` now and then to cover that case.
+
+Run it locally under any ASGI server, e.g.::
+
+    uvicorn myproject.asgi:application
+"""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Message
+
+
+class Subscription:
+    """A bounded queue of events for one open stream."""
+
+    def __init__(self, hub, channel, loop, maxsize):
+        self.hub = hub
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        """Queue ``event`` from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The subscriber's event loop has gone away.
+            self.hub.unsubscribe(self)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow client can drop events safely: each one only tells the
+            # page to fetch everything newer than what it already shows.
+            pass
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class EventHub:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to ``channel``."""
+        subscription = Subscription(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+hub = EventHub()
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+def publish_message(message):
+    """Announce a saved Message to its conversation once the transaction commits."""
+    if message.conversation_id is None:
+        return
+    event = {
+        'type': 'message',
+        'id': message.pk,
+        'sender_id': message.sender_id,
+        'created_at': message.created_at.isoformat(),
+    }
+    channel = conversation_channel(message.conversation_id)
+    transaction.on_commit(lambda: hub.publish(channel, event))
+
+
+def publish_response(response, conversation_id):
+    """Announce a saved Response to the conversation of the message it answers."""
+    if conversation_id is None:
+        return
+    event = {
+        'type': 'response',
+        'id': response.pk,
+        'message_id': response.message_id,
+        'created_at': response.created_at.isoformat(),
+    }
+    channel = conversation_channel(conversation_id)
+    transaction.on_commit(lambda: hub.publish(channel, event))
+
+
+def format_event(event):
+    """Serialise ``event`` in the text/event-stream wire format."""
+    lines = []
+    if event['type'] == 'message':
+        # Message ids double as SSE ids so reconnects can resume via Last-Event-ID.
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def conversation_stream(conversation_id, last_event_id=None):
+    """Yield SSE frames for ``conversation_id`` until the client disconnects.
+
+    With ``last_event_id`` (a message id) the stream first replays the ids of
+    messages the client missed while it was disconnected.
+    """
+    subscription = hub.subscribe(conversation_channel(conversation_id))
+    heartbeat = settings.CONVERSATION_EVENTS_HEARTBEAT
+    try:
+        yield f'retry: {settings.CONVERSATION_EVENTS_RETRY_MS}\n\n'
+        if last_event_id is not None:
+            # Subscribed first, so nothing published from here on is lost.
+            missed = (
+                Message.objects
+                .filter(conversation_id=conversation_id, has_content=True, id__gt=last_event_id)
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+            async for message_id in missed:
+                yield format_event({'type': 'message', 'id': message_id})
+        while True:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except TimeoutError:
+                # Comment frames keep proxies from closing idle streams.
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscription)
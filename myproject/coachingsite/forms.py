@@ -4,6 +4,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import Profile
 from django.contrib.auth.forms import AuthenticationForm
+from .thumbnails import delete_thumbnails, generate_thumbnails
 
 
 class MessageForm(forms.ModelForm):
@@ -77,6 +78,16 @@ class ProfileForm(forms.ModelForm):
         model = Profile
         fields = ('full_name', 'bio', 'profile_picture')
 
+    def save(self, commit=True):
+        previous = self.initial.get('profile_picture')
+        profile = super().save(commit)
+        if commit and 'profile_picture' in self.changed_data:
+            if previous:
+                delete_thumbnails(previous.name)
+            if profile.profile_picture:
+                generate_thumbnails.enqueue(source_name=profile.profile_picture.name)
+        return profile
+
 
 class RoundResultForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,242 @@
+"""A small job queue stored in the database.
+
+Work that should not hold up a request is written as a Job row and run later
+by ``manage.py run_jobs``::
+
+    @task()
+    def faststart_video(name):
+        ...
+
+    faststart_video.enqueue(name=message.video.name)
+
+``enqueue`` only inserts a row, so it takes part in the caller's
+transaction. A job whose transaction rolls back never runs, and a worker
+never sees a job before the data it refers to is committed.
+
+Workers claim jobs with a compare-and-swap UPDATE, which works on SQLite
+without row locks. A claimed job is leased until ``locked_until``. The
+worker renews the lease while the job runs, and if the worker dies the job
+becomes claimable again once the lease expires (the visibility timeout).
+Failed jobs are retried with exponential backoff and jitter until they run
+out of attempts.
+"""
+
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def task(func=None, *, max_attempts=None):
+    """Mark ``func`` as runnable by workers and give it an ``enqueue(**kwargs)`` method.
+
+    Tasks take keyword arguments that survive a JSON round trip.
+    """
+    def decorate(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        func.enqueue = lambda **kwargs: enqueue(func, kwargs)
+        return func
+
+    return decorate(func) if func is not None else decorate
+
+
+def enqueue(func, kwargs=None, *, delay=None, max_attempts=None):
+    """Queue ``func(**kwargs)`` to run in a worker, after ``delay`` seconds if given."""
+    if not hasattr(func, 'task_name'):
+        raise ValueError(f'{func!r} is not decorated with @task')
+    return Job.objects.create(
+        task=func.task_name,
+        kwargs=kwargs or {},
+        run_at=timezone.now() + timedelta(seconds=delay or 0),
+        max_attempts=max_attempts or func.max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def retry_delay(attempts):
+    """Seconds to wait before retrying a job that has failed ``attempts`` times."""
+    delay = min(settings.JOBS_RETRY_BASE * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX)
+    # Jitter keeps jobs that failed together from retrying together.
+    return delay * random.uniform(0.5, 1.0)
+
+
+def resolve(task_name):
+    """Return the task function registered as ``task_name``."""
+    func = import_string(task_name)
+    if not hasattr(func, 'task_name'):
+        raise ValueError(f'{task_name} is not a task')
+    return func
+
+
+def execute(task_name, kwargs):
+    """Run one job's task on a pool thread or in a pool process."""
+    close_old_connections()
+    try:
+        resolve(task_name)(**kwargs)
+    finally:
+        close_old_connections()
+
+
+def _forget_inherited_connections():
+    # Forked pool processes inherit the parent's database connections.
+    # Closing them would close them for the parent too, so drop them instead.
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+class Worker:
+    """Claims due jobs and runs them on a thread or process pool.
+
+    With ``concurrency=0`` jobs run one at a time in the calling thread,
+    which is how tests and ``run_jobs --burst`` on small installs use it.
+    """
+
+    def __init__(self, concurrency=4, processes=False, worker_id=None):
+        self.concurrency = concurrency
+        self.processes = processes
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = threading.Event()
+        self.processed = 0
+
+    def stop(self):
+        self.stopping.set()
+
+    def claim(self, limit):
+        """Lease up to ``limit`` due jobs to this worker and return them."""
+        now = timezone.now()
+        expired = Q(status=Job.RUNNING, locked_until__lt=now)
+        # Jobs whose worker died on the final attempt are not retried forever.
+        Job.objects.filter(expired, attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED,
+            last_error='Visibility timeout expired on the final attempt',
+            finished_at=now,
+            locked_by='',
+        )
+        candidates = (
+            Job.objects
+            .filter(Q(status=Job.QUEUED, run_at__lte=now) | expired)
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        lease = now + timedelta(seconds=settings.JOBS_VISIBILITY_TIMEOUT)
+        claimed = []
+        for job_id in candidates:
+            won = Job.objects.filter(Q(status=Job.QUEUED, run_at__lte=now) | expired, pk=job_id).update(
+                status=Job.RUNNING,
+                locked_by=self.worker_id,
+                locked_until=lease,
+                attempts=F('attempts') + 1,
+            )
+            if won:
+                claimed.append(job_id)
+        return list(Job.objects.filter(pk__in=claimed).order_by('run_at', 'id'))
+
+    def extend_leases(self, jobs):
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs], locked_by=self.worker_id).update(
+                locked_until=timezone.now() + timedelta(seconds=settings.JOBS_VISIBILITY_TIMEOUT),
+            )
+
+    def finish(self, job, error=None):
+        """Record the outcome of ``job``, scheduling a retry if it failed and may run again."""
+        self.processed += 1
+        now = timezone.now()
+        mine = Job.objects.filter(pk=job.pk, locked_by=self.worker_id, status=Job.RUNNING)
+        if error is None:
+            mine.update(status=Job.DONE, finished_at=now, locked_by='', locked_until=None, last_error='')
+            return
+        message = ''.join(traceback.format_exception(error))
+        logger.warning('Job %s (%s) failed on attempt %s: %s', job.pk, job.task, job.attempts, error)
+        if job.attempts < job.max_attempts:
+            mine.update(
+                status=Job.QUEUED,
+                run_at=now + timedelta(seconds=retry_delay(job.attempts)),
+                locked_by='',
+                locked_until=None,
+                last_error=message,
+            )
+        else:
+            mine.update(status=Job.FAILED, finished_at=now, locked_by='', locked_until=None, last_error=message)
+
+    def run_inline(self, burst=False):
+        while not self.stopping.is_set():
+            jobs = self.claim(1)
+            if not jobs:
+                if burst:
+                    return
+                self.stopping.wait(settings.JOBS_POLL_INTERVAL)
+                continue
+            job = jobs[0]
+            try:
+                resolve(job.task)(**job.kwargs)
+            except Exception as exc:
+                self.finish(job, exc)
+            else:
+                self.finish(job)
+
+    def run(self, burst=False):
+        """Process jobs until stopped, or with ``burst`` until the queue is empty."""
+        if not self.concurrency:
+            return self.run_inline(burst)
+        if self.processes:
+            pool = ProcessPoolExecutor(
+                max_workers=self.concurrency,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_forget_inherited_connections,
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job')
+
+        in_flight = {}
+        renew_every = settings.JOBS_VISIBILITY_TIMEOUT / 3
+        renewed_at = time.monotonic()
+        with pool:
+            while True:
+                if not self.stopping.is_set() and len(in_flight) < self.concurrency:
+                    for job in self.claim(self.concurrency - len(in_flight)):
+                        in_flight[pool.submit(execute, job.task, job.kwargs)] = job
+                if not in_flight:
+                    if burst or self.stopping.is_set():
+                        return
+                    self.stopping.wait(settings.JOBS_POLL_INTERVAL)
+                    continue
+
+                done, _ = wait(in_flight, timeout=settings.JOBS_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    error = future.exception()
+                    self.finish(job, error)
+                if time.monotonic() - renewed_at >= renew_every:
+                    self.extend_leases(in_flight.values())
+                    renewed_at = time.monotonic()
+
+
+def run_pending():
+    """Run every due job in the calling thread; returns how many ran."""
+    worker = Worker(concurrency=0)
+    worker.run(burst=True)
+    return worker.processed
+
+
+def prune_finished(older_than):
+    """Delete finished jobs that completed before ``older_than`` ago."""
+    cutoff = timezone.now() - older_than
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()
+    return deleted
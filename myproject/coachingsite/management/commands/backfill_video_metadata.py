@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from coachingsite.models import VIDEO_METADATA_FIELDS, Message, Response
+from coachingsite.mp4 import probe_path
+from coachingsite.storage import video_storage
+
+
+class Command(BaseCommand):
+    help = 'Read fps, duration and resolution for stored Message and Response videos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes parsing files (default: one per CPU).',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-read videos that already have metadata.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        try:
+            video_storage().path('')
+        except NotImplementedError:
+            raise CommandError('The backfill reads files directly and needs a local filesystem storage.')
+
+        # Workers only parse files, but never hand them an inherited connection.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for model in (Message, Response):
+                updated, unreadable = self.backfill(model, pool, options)
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: {updated} updated, {unreadable} without readable metadata'
+                )
+
+    def backfill(self, model, pool, options):
+        queryset = model.objects.exclude(video='').exclude(video__isnull=True)
+        if not options['all']:
+            queryset = queryset.filter(video_duration__isnull=True)
+        rows = list(queryset.order_by('pk').values_list('pk', 'video'))
+        paths = [video_storage().path(name) for _, name in rows]
+
+        updated = unreadable = 0
+        batch = []
+        chunksize = max(1, len(paths) // (options['workers'] * 4))
+        for (pk, _), metadata in zip(rows, pool.map(probe_path, paths, chunksize=chunksize)):
+            if metadata is None:
+                unreadable += 1
+                continue
+            instance = model(pk=pk)
+            for key, value in metadata.items():
+                setattr(instance, f'video_{key}', value)
+            batch.append(instance)
+            if len(batch) >= options['batch_size']:
+                updated += model.objects.bulk_update(batch, VIDEO_METADATA_FIELDS)
+                batch = []
+        if batch:
+            updated += model.objects.bulk_update(batch, VIDEO_METADATA_FIELDS)
+        return updated, unreadable
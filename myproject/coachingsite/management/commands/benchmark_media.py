@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve
+
+from coachingsite.views import serve_media
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare media throughput of django.views.static.serve (the old /media/ route) '
+        'with the Range-aware serve_media view, for full downloads and seeks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64, help='Size of the generated test video.')
+        parser.add_argument('--range-kb', type=int, default=1024, help='Size of each seek (Range) request.')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per scenario.')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        range_size = options['range_kb'] * 1024
+        count = options['requests']
+
+        with tempfile.TemporaryDirectory() as media_root:
+            name = 'uploads/bench/throw.mp4'
+            path = os.path.join(media_root, name)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as handle:
+                block = os.urandom(1024 * 1024)
+                for _ in range(options['size_mb']):
+                    handle.write(block)
+
+            factory = RequestFactory()
+            # An unsaved superuser skips the ownership lookup, so only the
+            # file transfer itself is measured.
+            user = User(username='benchmark', is_superuser=True)
+
+            def old_path(headers):
+                request = factory.get(f'/media/{name}', headers=headers)
+                return serve(request, name, document_root=media_root)
+
+            def new_path(headers):
+                request = factory.get(f'/media/{name}', headers=headers)
+                request.user = user
+                return serve_media(request, name)
+
+            def seek_headers(index):
+                start = (index * 7919 * range_size) % (size - range_size)
+                return {'Range': f'bytes={start}-{start + range_size - 1}'}
+
+            with override_settings(MEDIA_ROOT=media_root, MEDIA_OFFLOAD=None):
+                results = [
+                    self.measure('static.serve full file', old_path, lambda i: {}, count, size),
+                    self.measure('serve_media full file', new_path, lambda i: {}, count, size),
+                    self.measure('serve_media full file (sendfile)', new_path, lambda i: {}, count, size, sendfile=True),
+                    self.measure('static.serve seek', old_path, seek_headers, count, range_size),
+                    self.measure('serve_media seek', new_path, seek_headers, count, range_size),
+                    self.measure('serve_media seek (sendfile)', new_path, seek_headers, count, range_size, sendfile=True),
+                ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'scenario':<36} {'status':>6} {'MB sent':>10} {'req/s':>10} {'useful MB/s':>12}")
+        for result in results:
+            self.stdout.write(
+                f"{result['scenario']:<36} {result['status']:>6} {result['mb_sent']:>10.1f} "
+                f"{result['requests_per_second']:>10.1f} {result['useful_mb_per_second']:>12.1f}"
+            )
+
+    def measure(self, scenario, view, headers_for, count, wanted_bytes, sendfile=False):
+        """Time ``count`` requests, consuming each body as a server would."""
+        sent = 0
+        status = None
+        with open(os.devnull, 'wb') as sink:
+            started = time.perf_counter()
+            for index in range(count):
+                response = view(headers_for(index))
+                status = response.status_code
+                if sendfile:
+                    # What a WSGI file_wrapper such as gunicorn's does: send
+                    # Content-Length bytes from the current file position.
+                    filelike = response.file_to_stream
+                    offset = filelike.tell()
+                    remaining = int(response['Content-Length'])
+                    while remaining:
+                        written = os.sendfile(sink.fileno(), filelike.fileno(), offset, remaining)
+                        if not written:
+                            break
+                        offset += written
+                        remaining -= written
+                        sent += written
+                else:
+                    for chunk in response.streaming_content:
+                        sink.write(chunk)
+                        sent += len(chunk)
+                response.close()
+            elapsed = time.perf_counter() - started
+        mb = 1024 * 1024
+        return {
+            'scenario': scenario,
+            'status': status,
+            'requests': count,
+            'seconds': round(elapsed, 4),
+            'mb_sent': sent / mb,
+            'requests_per_second': count / elapsed,
+            'useful_mb_per_second': count * wanted_bytes / mb / elapsed,
+        }
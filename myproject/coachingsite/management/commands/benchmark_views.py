@@ -0,0 +1,138 @@
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from coachingsite.models import Conversation, Message, RoundResult
+from coachingsite.sitewalk import iter_site_requests, seeded_conversation
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def current_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every coachingsite URL through the test client as a seeded coach and athlete, '
+        'and report p50/p95/p99 latency, queries and peak memory per view. Run seed_data first. '
+        'Views run for real, so read cursors and sessions are written to the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed', help='Username prefix used by seed_data.')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per view and role.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests before timing starts.')
+        parser.add_argument('--only', nargs='+', metavar='URL_NAME', help='Only benchmark these URL names.')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        prefix = options['prefix']
+        conversation = seeded_conversation(prefix)
+        if conversation is None:
+            raise CommandError(f'No conversation for {prefix}-coach-0; run "manage.py seed_data --prefix {prefix}" first.')
+        if not conversation.messages.exists():
+            raise CommandError('The seeded conversation has no messages; seed with --messages 1 or more.')
+
+        results = []
+        skipped = {}
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, role, client, url in iter_site_requests(conversation, options['only'], skipped):
+                results.append(self.measure(client, name, role, url, options))
+
+        report = {
+            'commit': current_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'data': {
+                'conversations': Conversation.objects.count(),
+                'messages': Message.objects.count(),
+                'rounds': RoundResult.objects.count(),
+            },
+            'requests': options['requests'],
+            'results': results,
+            'skipped': skipped,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{'view':<24} {'role':<8} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'peak KiB':>9}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['view']:<24} {result['role']:<8} {result['status']:>6} {result['p50_ms']:>8.2f} "
+                f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['queries']:>8} "
+                f"{result['peak_memory_kib']:>9.1f}"
+            )
+        for name, reason in skipped.items():
+            self.stdout.write(f'skipped {name}: {reason}')
+
+    def measure(self, client, name, role, url, options):
+        """Time ``options['requests']`` GETs of ``url``, then profile one more."""
+        for _ in range(options['warmup']):
+            self.consume(client.get(url))
+        timings = []
+        for _ in range(options['requests']):
+            started = time.perf_counter()
+            self.consume(client.get(url))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Queries and memory are counted on a separate request, so neither
+        # the query log nor tracemalloc slows the timed ones down.
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+                self.consume(response)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        result = {'view': name, 'role': role, 'url': url, 'status': response.status_code}
+        result.update({f'p{pct}_ms': round(percentile(timings, pct), 3) for pct in PERCENTILES})
+        result.update({
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': len(queries),
+            'peak_memory_kib': round(peak / 1024, 1),
+        })
+        return result
+
+    def consume(self, response):
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from coachingsite.queryplans import (
+    BASELINE_PATH, SEED, collect_problems, compare, describe, load_baseline, write_baseline,
+)
+from coachingsite.seeding import seed_site
+from coachingsite.sitewalk import seeded_conversation
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database, request every page and EXPLAIN QUERY PLAN each statement. '
+        'Fails when a page scans a whole table or sorts without an index in a way the checked-in '
+        'baseline does not list.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline JSON file.')
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Write the current problems to the baseline instead of comparing.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plans are only checked on SQLite.')
+
+        # Plans are taken from a fresh database, so ANALYZE statistics or data
+        # in the development database cannot change them.
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed_site(**SEED)
+            problems = collect_problems(seeded_conversation(SEED['prefix']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['update']:
+            write_baseline(problems, options['baseline'])
+            self.stdout.write(f"Wrote {len(problems)} accepted plan steps to {options['baseline']}")
+            return
+
+        new, fixed = compare(problems, load_baseline(options['baseline']))
+        if fixed:
+            self.stdout.write(
+                f'{len(fixed)} baseline entries no longer occur; run with --update to drop them:\n{describe(fixed)}'
+            )
+        if new:
+            raise CommandError(
+                f'{len(new)} statements scan a whole table or sort without an index:\n{describe(new)}\n'
+                'Add an index, or run with --update to accept them.'
+            )
+        self.stdout.write(f'{len(problems)} known plan steps, no new ones.')
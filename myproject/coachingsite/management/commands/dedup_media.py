@@ -0,0 +1,76 @@
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from coachingsite.models import Message, Response
+from coachingsite.storage import LocalFile, blob_digest, hash_file, video_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move videos stored under their upload names into the content-addressed blob store, '
+        'pointing every Message and Response at one shared copy of each distinct file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Hash the files and report what would be saved without changing anything.',
+        )
+
+    def handle(self, *args, **options):
+        storage = video_storage()
+        try:
+            storage.path('')
+        except NotImplementedError:
+            raise CommandError('Deduplication moves files on disk and needs a local filesystem storage.')
+
+        references = Counter()
+        for model in (Message, Response):
+            for name in model.objects.exclude(video='').exclude(video__isnull=True).values_list('video', flat=True):
+                if blob_digest(name) is None:
+                    references[name] += 1
+
+        moved = duplicates = missing = saved = 0
+        seen = set()
+        for name in sorted(references):
+            path = storage.path(name)
+            if not os.path.isfile(path):
+                missing += 1
+                continue
+            size = os.path.getsize(path)
+
+            if options['dry_run']:
+                blob = storage.blob_name(hash_file(path), os.path.splitext(name)[1])
+                if blob in seen or storage.exists(blob):
+                    duplicates += 1
+                    saved += size
+                seen.add(blob)
+                moved += 1
+                continue
+
+            with open(path, 'rb') as file:
+                blob = storage.save(name, LocalFile(file))
+            if os.path.exists(path):
+                # The blob already existed, so the upload was left where it was.
+                os.remove(path)
+                duplicates += 1
+                saved += size
+            with transaction.atomic():
+                updated = Message.objects.filter(video=name).update(video=blob)
+                updated += Response.objects.filter(video=name).update(video=blob)
+                # save() counted one reference already.
+                if updated:
+                    storage.retain(blob, updated - 1)
+                else:
+                    storage.release(blob)
+            moved += 1
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(
+            f'{verb} {moved} files into the blob store; {duplicates} were duplicates '
+            f'({saved / (1024 * 1024):.1f} MiB saved). {missing} referenced files were missing.'
+        )
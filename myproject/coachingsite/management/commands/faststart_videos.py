@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from coachingsite.models import Message, Response
+from coachingsite.mp4 import MP4Error, faststart, faststart_to
+from coachingsite.storage import blob_digest, replace_blob, video_storage
+
+
+def _faststart_path(path, staging_dir):
+    """Rewrite one file; returns ``(outcome, staged_path)``.
+
+    Blobs are immutable, so for them the copy is left in ``staging_dir`` for
+    the parent process to store as a new blob.
+    """
+    try:
+        if staging_dir is None:
+            return ('rewritten' if faststart(path) else 'unchanged'), None
+        staged = faststart_to(path, staging_dir)
+        return ('rewritten' if staged else 'unchanged'), staged
+    except (OSError, MP4Error):
+        return 'failed', None
+
+
+class Command(BaseCommand):
+    help = 'Move the moov box to the front of stored MP4 videos. Files already in that layout are left alone.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes rewriting files (default: one per CPU).',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        storage = video_storage()
+        try:
+            storage.path('')
+        except NotImplementedError:
+            raise CommandError('Videos are rewritten on disk and need a local filesystem storage.')
+
+        names = set()
+        for model in (Message, Response):
+            names.update(model.objects.exclude(video='').exclude(video__isnull=True).values_list('video', flat=True))
+        names = sorted(names)
+        staging_dir = storage.staging_dir()
+        paths = [storage.path(name) for name in names]
+        staging = [staging_dir if blob_digest(name) else None for name in names]
+
+        connections.close_all()
+        counts = {'rewritten': 0, 'unchanged': 0, 'failed': 0}
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for name, (outcome, staged) in zip(names, pool.map(_faststart_path, paths, staging)):
+                if staged:
+                    replace_blob(storage, name, staged)
+                counts[outcome] += 1
+        self.stdout.write(
+            f"{counts['rewritten']} rewritten, {counts['unchanged']} already faststart, {counts['failed']} not readable as MP4"
+        )
@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from myproject.profiling import PROFILE_SUFFIX, leaf_counts, merge_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        'Merge the collapsed-stack profiles written by ProfilingMiddleware into one file per view, '
+        'ready for flamegraph.pl or speedscope, and print where each view spends its time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Profile directory (default: PROFILING_DIR).')
+        parser.add_argument(
+            '--output',
+            help='Directory to write <view>.folded files to. Without it only the summary is printed.',
+        )
+        parser.add_argument('--view', action='append', help='Only merge this URL name; repeatable.')
+        parser.add_argument('--top', type=int, default=10, help='Innermost frames to list per view.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILING_DIR
+        if not os.path.isdir(directory):
+            raise CommandError(f'No profile directory at {directory}.')
+        merged = merge_profiles(directory, options['view'])
+        if not merged:
+            self.stdout.write('No profiles to merge.')
+            return
+
+        if options['output']:
+            os.makedirs(options['output'], exist_ok=True)
+        for view, (files, samples) in sorted(merged.items(), key=lambda item: -item[1][1].total()):
+            total = samples.total()
+            self.stdout.write(f'{view}: {total} samples from {files} requests')
+            for frame, count in leaf_counts(samples).most_common(options['top']):
+                self.stdout.write(f'  {count / total:6.1%}  {frame}')
+            if options['output']:
+                path = os.path.join(options['output'], f'{view}{PROFILE_SUFFIX}')
+                with open(path, 'w') as handle:
+                    for stack, count in sorted(samples.items()):
+                        handle.write(f'{stack} {count}\n')
+                self.stdout.write(f'  wrote {path}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myproject.sessions import PRUNE_BATCH_SIZE, SessionStore
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired sessions from the database in small batches, so other writers to the '
+        'database are not blocked behind one long delete.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE, help='Rows deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        deleted = SessionStore.clear_expired(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(f'Deleted {deleted} expired sessions.')
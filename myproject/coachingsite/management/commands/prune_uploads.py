@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from coachingsite.uploads import prune_expired
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete resumable uploads that have received no chunk for CHUNKED_UPLOAD_EXPIRY seconds, '
+        'with their partial files.'
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_expired()
+        self.stdout.write(f'Deleted {deleted} expired uploads.')
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coachingsite.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-course round statistics table from RoundResult rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--athlete',
+            action='append',
+            dest='athletes',
+            metavar='USERNAME',
+            help='Only rebuild stats for this athlete (may be given more than once).',
+        )
+        parser.add_argument(
+            '--defer',
+            action='store_true',
+            help='Queue the rebuild as a background job instead of running it now.',
+        )
+
+    def handle(self, *args, **options):
+        athletes = None
+        usernames = options.get('athletes')
+        if usernames:
+            athletes = list(User.objects.filter(username__in=usernames))
+            missing = set(usernames) - {user.username for user in athletes}
+            if missing:
+                raise CommandError(f"Unknown athlete(s): {', '.join(sorted(missing))}")
+
+        if options['defer']:
+            ids = None if athletes is None else [user.pk for user in athletes]
+            job = rebuild_stats.enqueue(athletes=ids)
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk}.'))
+            return
+        written = rebuild_stats(athletes)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} course stats rows.'))
@@ -0,0 +1,41 @@
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from coachingsite.jobs import Worker, prune_finished
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs. SIGTERM or Ctrl-C stops claiming new jobs and waits for running ones.'
+
+    def add_arguments(self, parser):
+        pool = parser.add_mutually_exclusive_group()
+        pool.add_argument('--threads', type=int, help='Run jobs on this many threads (default: 4).')
+        pool.add_argument('--processes', type=int, help='Run jobs in this many forked processes instead.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no due jobs are left.')
+        parser.add_argument(
+            '--keep-days',
+            type=float,
+            default=7,
+            help='Delete finished jobs older than this many days on start-up (default: 7).',
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes'] is not None
+        concurrency = options['processes'] if processes else options['threads']
+        if concurrency is None:
+            concurrency = 4
+        if concurrency < 0:
+            raise CommandError('Pool size cannot be negative')
+
+        pruned = prune_finished(timedelta(days=options['keep_days']))
+        if pruned:
+            self.stdout.write(f'Deleted {pruned} finished jobs.')
+
+        worker = Worker(concurrency=concurrency, processes=processes)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(f'Worker {worker.worker_id} started with {concurrency or "no"} pool workers.')
+        worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS(f'Worker stopped after {worker.processed} jobs.'))
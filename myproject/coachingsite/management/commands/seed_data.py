@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from coachingsite.models import Message
+from coachingsite.seeding import SEED_PASSWORD, seed_site
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with deterministic synthetic coaches, athletes, conversations, messages, '
+        'responses and rounds for profiling and benchmark_views.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=200)
+        parser.add_argument('--coaches', type=int, default=5)
+        parser.add_argument('--rounds', type=int, default=20, help='Rounds logged per athlete.')
+        parser.add_argument('--messages', type=int, default=10, help='Messages per conversation.')
+        parser.add_argument('--responses', type=int, default=2, help='Coach responses per conversation.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+        parser.add_argument('--prefix', default='seed', help='Username prefix of the generated users.')
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Delete users from an earlier run with the same prefix, and everything they own, first.',
+        )
+
+    def handle(self, *args, **options):
+        if options['coaches'] < 1 and options['athletes']:
+            raise CommandError('Athletes need at least one coach to talk to.')
+        if min(options[key] for key in ('athletes', 'rounds', 'messages', 'responses')) < 0:
+            raise CommandError('Counts cannot be negative.')
+
+        prefix = options['prefix']
+        existing = User.objects.filter(username__startswith=f'{prefix}-')
+        with transaction.atomic():
+            if existing.exists():
+                if not options['replace']:
+                    raise CommandError(f'Users named {prefix}-* already exist; pass --replace or another --prefix.')
+                # Messages outlive their sender and conversation, so they go first.
+                Message.objects.filter(sender__in=existing).delete()
+                existing.delete()
+            site = seed_site(
+                athletes=options['athletes'],
+                coaches=options['coaches'],
+                rounds_per_athlete=options['rounds'],
+                messages_per_conversation=options['messages'],
+                responses_per_conversation=options['responses'],
+                prefix=prefix,
+                seed=options['seed'],
+            )
+
+        self.stdout.write(', '.join(f'{count} {name}' for name, count in site.counts.items()))
+        self.stdout.write(f'Users are named {prefix}-coach-N and {prefix}-athlete-N, password {SEED_PASSWORD!r}.')
@@ -0,0 +1,143 @@
+"""Helpers for serving uploaded media with HTTP Range support.
+
+``serve_media`` in views.py uses these to answer single-range requests with
+``206 Partial Content``. Video players need that to seek, and so does the
+frame-step control. The body is a FileResponse over a bounded view of the
+file. Under a WSGI server that provides ``wsgi.file_wrapper`` (gunicorn,
+uWSGI) the file is sent with ``sendfile(2)`` from the range start for exactly
+``Content-Length`` bytes, so no copy passes through Python.
+
+Deduplicated video blobs (see storage.py) never change, so they are served
+with their digest as the ETag and an immutable Cache-Control.
+
+With ``MEDIA_OFFLOAD`` set, permission checks still run here but the bytes
+are sent by the fronting proxy through ``X-Accel-Redirect`` (nginx) or
+``X-Sendfile`` (Apache, lighttpd), and the proxy handles Range itself.
+"""
+
+import io
+import re
+
+from .models import Message, Response, VideoBlob
+from .storage import blob_digest
+from .thumbnails import THUMBNAIL_DIR
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Return ``(start, length)`` for a single-range ``Range`` header.
+
+    Returns None when the header is absent, malformed or asks for several
+    ranges; the caller then serves the whole file, which RFC 9110 allows.
+    Raises UnsatisfiableRange when the range lies outside the file.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes.
+        suffix = int(last)
+        if suffix == 0:
+            raise UnsatisfiableRange
+        start = max(size - suffix, 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    if start >= size:
+        raise UnsatisfiableRange
+    return start, end - start + 1
+
+
+class FileRange(io.RawIOBase):
+    """A read-only window onto ``length`` bytes of ``file`` from ``start``.
+
+    ``fileno()`` exposes the real descriptor, positioned at the window start,
+    so sendfile-based file wrappers can send the window without reading it.
+    """
+
+    def __init__(self, file, start, length):
+        super().__init__()
+        self.file = file
+        self.name = file.name
+        self.start = start
+        self.end = start + length
+        file.seek(start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            return self.file.seek(self.end + offset)
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        remaining = self.end - self.file.tell()
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.file.read(size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def can_view_media(user, name):
+    """Return True if ``user`` may download the media file stored as ``name``."""
+    if user.is_superuser:
+        return True
+    if name.startswith('profiles/') or name.startswith(f'{THUMBNAIL_DIR}/profiles/'):
+        return True
+
+    message_rows = Message.objects.filter(video=name).values_list(
+        'sender_id', 'conversation__athlete_id', 'conversation__coach_id',
+    )
+    response_rows = Response.objects.filter(video=name).values_list(
+        'message__sender_id', 'message__conversation__athlete_id', 'message__conversation__coach_id',
+    )
+    if blob_digest(name):
+        # A shared blob may back Messages and Responses alike.
+        rows = message_rows.union(response_rows, all=True)
+    elif name.startswith('uploads/'):
+        rows = message_rows
+    elif name.startswith('responses/'):
+        rows = response_rows
+    else:
+        return False
+    return any(user.pk in row for row in rows)
+
+
+def replacement_for(name):
+    """Return the blob that took over every reference to ``name``, if there is one."""
+    if not blob_digest(name):
+        return None
+    return VideoBlob.objects.filter(name=name).exclude(replaced_by='').values_list('replaced_by', flat=True).first()
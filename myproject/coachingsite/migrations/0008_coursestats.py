@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_course_stats(apps, schema_editor):
+    RoundResult = apps.get_model('coachingsite', 'RoundResult')
+    CourseStats = apps.get_model('coachingsite', 'CourseStats')
+    aggregates = {
+        'rounds': Count('id'),
+        'score_total': Sum('score_relative'),
+        'best': Min('score_relative'),
+        'worst': Max('score_relative'),
+    }
+    rounds = RoundResult.objects.order_by()
+    rows = [
+        CourseStats(is_total=False, **group)
+        for group in rounds.values('athlete_id', 'course_name').annotate(**aggregates)
+    ]
+    rows += [
+        CourseStats(is_total=True, course_name='', **group)
+        for group in rounds.values('athlete_id').annotate(**aggregates)
+    ]
+    CourseStats.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0007_roundresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_name', models.CharField(blank=True, max_length=255)),
+                ('is_total', models.BooleanField(default=False)),
+                ('rounds', models.PositiveIntegerField(default=0)),
+                ('score_total', models.IntegerField(default=0)),
+                ('best', models.IntegerField(blank=True, null=True)),
+                ('worst', models.IntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'course stats',
+                'ordering': ['course_name'],
+                'constraints': [models.UniqueConstraint(fields=('athlete', 'is_total', 'course_name'), name='unique_course_stats_per_athlete')],
+            },
+        ),
+        migrations.RunPython(populate_course_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:44
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def populate_has_content(apps, schema_editor):
+    Message = apps.get_model('coachingsite', 'Message')
+    with_video = Q(video__isnull=False) & ~Q(video='')
+    Message.objects.filter(with_video).update(has_content=True)
+    # Whitespace-only text is detected in Python, like Message.save() does.
+    text_ids = [
+        pk
+        for pk, text in Message.objects.exclude(with_video).exclude(text='').values_list('pk', 'text').iterator()
+        if text.strip()
+    ]
+    for start in range(0, len(text_ids), 500):
+        Message.objects.filter(pk__in=text_ids[start:start + 500]).update(has_content=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0009_readcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='has_content',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(populate_has_content, migrations.RunPython.noop),
+    ]
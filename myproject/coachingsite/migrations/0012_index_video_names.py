@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0011_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, upload_to='uploads/%Y/%m/%d'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, upload_to='responses/%Y/%m/%d'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+import coachingsite.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0013_video_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('replaced_by', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=coachingsite.storage.video_storage, upload_to='uploads/%Y/%m/%d'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=coachingsite.storage.video_storage, upload_to='responses/%Y/%m/%d'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_conversations(apps, schema_editor):
+    """Fold every extra conversation between the same pair into the oldest one."""
+    Conversation = apps.get_model('coachingsite', 'Conversation')
+    Message = apps.get_model('coachingsite', 'Message')
+    ReadCursor = apps.get_model('coachingsite', 'ReadCursor')
+
+    pairs = (
+        Conversation.objects
+        .values('athlete', 'coach')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for pair in pairs:
+        group = Conversation.objects.filter(athlete=pair['athlete'], coach=pair['coach']).order_by('id')
+        keep = group.first()
+        duplicates = list(group.exclude(pk=keep.pk).values_list('pk', flat=True))
+        Message.objects.filter(conversation__in=duplicates).update(conversation=keep)
+        cursors = (
+            ReadCursor.objects
+            .filter(conversation__in=[keep.pk, *duplicates])
+            .values('user')
+            .annotate(last_read=Max('last_read_message_id'))
+        )
+        for cursor in cursors:
+            ReadCursor.objects.update_or_create(
+                conversation=keep,
+                user_id=cursor['user'],
+                defaults={'last_read_message_id': cursor['last_read']},
+            )
+        latest = group.aggregate(latest=Max('updated_at'))['latest']
+        Conversation.objects.filter(pk__in=duplicates).delete()
+        Conversation.objects.filter(pk=keep.pk).update(updated_at=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0015_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_conversations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['coach', '-updated_at', '-id'], name='conversation_coach_inbox'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['athlete', '-updated_at', '-id'], name='conversation_athlete_inbox'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conversation_created'),
+        ),
+        migrations.AddIndex(
+            model_name='roundresult',
+            index=models.Index(fields=['athlete', 'course_name', 'played_on', 'created_at'], name='round_athlete_course_played'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('athlete', 'coach'), name='unique_conversation_per_pair'),
+        ),
+    ]
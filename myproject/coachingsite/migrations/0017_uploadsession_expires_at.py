@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:32
+
+import coachingsite.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0016_conversation_pair_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=coachingsite.models.upload_expiry),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:33
+
+from django.db import migrations, models
+
+# Records the removal of the 'admin' role choice from Profile.role, which
+# predates the migrations around it. Choices are not stored in the database,
+# so this runs no SQL. It used to be bundled into 0008_coursestats.
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coachingsite', '0017_uploadsession_expires_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='role',
+            field=models.CharField(choices=[('athlete', 'Athlete'), ('coach', 'Coach')], default='athlete', max_length=20),
+        ),
+    ]
@@ -1,9 +1,18 @@
-from django.db import models
-from django.db.models.signals import post_save
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from django.utils import timezone
 
+from .storage import blob_digest, video_storage
+from .usercache import invalidate_cached_user
+
 
 class Article(models.Model):
     title = models.CharField(max_length=200)
@@ -19,29 +28,154 @@ class Message(models.Model):
     sender_name = models.CharField(max_length=100, blank=True)
     sender_email = models.EmailField(blank=True)
     text = models.TextField(blank=True)
-    video = models.FileField(upload_to='uploads/%Y/%m/%d', blank=True, null=True)
+    # indexed so the media view can find the owner of a file by its name
+    video = models.FileField(upload_to='uploads/%Y/%m/%d', storage=video_storage, blank=True, null=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     responded = models.BooleanField(default=False)
     # link to a conversation if this message is part of one
     conversation = models.ForeignKey('Conversation', related_name='messages', on_delete=models.SET_NULL, null=True, blank=True)
     # optional sender user
     sender = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='sent_messages')
+    # precomputed on save: the message has non-whitespace text or a video
+    has_content = models.BooleanField(default=False, editable=False)
+    # read from the MP4 container when the video is saved; see mp4.py
+    video_duration = models.FloatField(null=True, blank=True, editable=False, help_text='Seconds')
+    video_fps = models.FloatField(null=True, blank=True, editable=False)
+    video_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    video_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # conversation threads are read newest first
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_created'),
+        ]
 
     def __str__(self):
         name = self.sender_name or 'Anonymous'
         return f"{name} — {self.created_at:%Y-%m-%d %H:%M}"
 
+    def save(self, *args, **kwargs):
+        self.has_content = bool((self.text or '').strip() or self.video)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('text' in update_fields or 'video' in update_fields):
+            kwargs['update_fields'] = {*update_fields, 'has_content'}
+        # Storing a video adds a blob reference; it must roll back with the row.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Response(models.Model):
     """A response from the coach to a Message; may include text and/or a video."""
     message = models.ForeignKey(Message, related_name='responses', on_delete=models.CASCADE)
     text = models.TextField(blank=True)
-    video = models.FileField(upload_to='responses/%Y/%m/%d', blank=True, null=True)
+    video = models.FileField(upload_to='responses/%Y/%m/%d', storage=video_storage, blank=True, null=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # read from the MP4 container when the video is saved; see mp4.py
+    video_duration = models.FloatField(null=True, blank=True, editable=False, help_text='Seconds')
+    video_fps = models.FloatField(null=True, blank=True, editable=False)
+    video_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    video_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Response to {self.message.id} at {self.created_at:%Y-%m-%d %H:%M}"
 
+    def save(self, *args, **kwargs):
+        # Storing a video adds a blob reference; it must roll back with the row.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+VIDEO_METADATA_FIELDS = ('video_duration', 'video_fps', 'video_width', 'video_height')
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=Response)
+def read_video_metadata(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Fill in the video metadata fields for a new or not yet probed video.
+
+    Fresh uploads are probed from the uploaded file before it is stored;
+    files already in storage are opened from there.
+    """
+    if raw or update_fields is not None:
+        return
+    from .mp4 import MP4Error, VideoMetadata, read_metadata
+
+    video = instance.video
+    if not video:
+        metadata = VideoMetadata()
+    elif video._committed and instance.video_duration is not None:
+        return
+    else:
+        try:
+            if video._committed:
+                with video.storage.open(video.name, 'rb') as stored:
+                    metadata = read_metadata(stored)
+            else:
+                metadata = read_metadata(video.file)
+            # Readable MP4s go through the post-upload pipeline once saved.
+            instance._process_video = True
+        except (OSError, MP4Error):
+            metadata = VideoMetadata()
+    for key, value in metadata.as_dict().items():
+        setattr(instance, f'video_{key}', value)
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=Response)
+def remember_previous_video(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_video = None
+    if raw or instance._state.adding or (update_fields is not None and 'video' not in update_fields):
+        return
+    instance._previous_video = sender.objects.filter(pk=instance.pk).values_list('video', flat=True).first()
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Response)
+def release_replaced_video(sender, instance, raw=False, **kwargs):
+    """Drop the reference to a blob the saved row no longer points at."""
+    previous = getattr(instance, '_previous_video', None)
+    instance._previous_video = None
+    if raw or not previous or previous == instance.video.name or not blob_digest(previous):
+        return
+    storage = instance.video.storage
+    transaction.on_commit(lambda: storage.release(previous))
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Response)
+def process_uploaded_video(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_process_video', False):
+        return
+    from .pipeline import schedule_faststart
+
+    instance._process_video = False
+    schedule_faststart(instance.video)
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Response)
+def release_video(sender, instance, **kwargs):
+    """Drop the deleted row's reference to its shared video blob."""
+    video = instance.video
+    if video and blob_digest(video.name):
+        storage, name = video.storage, video.name
+        transaction.on_commit(lambda: storage.release(name))
+
+
+class VideoBlob(models.Model):
+    """Reference count for one content-addressed video file; see storage.py."""
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    # set when a processed version took over every reference; the media view
+    # redirects requests for this name there
+    replaced_by = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
 
 class Profile(models.Model):
     ATHLETE = 'athlete'
@@ -72,6 +206,17 @@ def ensure_profile(sender, instance, created, **kwargs):
         instance.profile.save()
 
 
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=User)
+def uncache_user(sender, instance, **kwargs):
+    """Invalidate the cached signed-in user when its profile changes.
+
+    User saves reach here through the profile save in ensure_profile.
+    """
+    invalidate_cached_user(instance.pk if sender is User else instance.user_id)
+
+
 class RoundResult(models.Model):
     """Stores a disc golf round result for progress tracking."""
 
@@ -88,6 +233,12 @@ class RoundResult(models.Model):
 
     class Meta:
         ordering = ['-played_on', '-created_at']
+        indexes = [
+            models.Index(
+                fields=['athlete', 'course_name', 'played_on', 'created_at'],
+                name='round_athlete_course_played',
+            ),
+        ]
 
     def __str__(self):
         label = self.course_name or 'Round'
@@ -98,6 +249,133 @@ class RoundResult(models.Model):
         return f"{self.score_relative:+d}"
 
 
+class CourseStats(models.Model):
+    """Running round statistics for one athlete on one course.
+
+    Rows are maintained incrementally whenever a RoundResult is written, so
+    the progress page can read summaries without aggregating the athlete's
+    full history. The row with ``is_total`` set covers all courses.
+    """
+
+    athlete = models.ForeignKey(
+        'auth.User',
+        on_delete=models.CASCADE,
+        related_name='course_stats',
+    )
+    course_name = models.CharField(max_length=255, blank=True)
+    is_total = models.BooleanField(default=False)
+    rounds = models.PositiveIntegerField(default=0)
+    score_total = models.IntegerField(default=0)
+    best = models.IntegerField(null=True, blank=True)
+    worst = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['course_name']
+        verbose_name_plural = 'course stats'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['athlete', 'is_total', 'course_name'],
+                name='unique_course_stats_per_athlete',
+            ),
+        ]
+
+    def __str__(self):
+        label = 'All courses' if self.is_total else (self.course_name or 'Unspecified course')
+        return f"{self.athlete_id} — {label} ({self.rounds} rounds)"
+
+    @property
+    def avg_score(self):
+        if not self.rounds:
+            return None
+        return self.score_total / self.rounds
+
+
+@receiver(pre_save, sender=RoundResult)
+def remember_round_stats_key(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        instance._previous_stats_key = None
+        return
+    instance._previous_stats_key = (
+        RoundResult.objects
+        .filter(pk=instance.pk)
+        .values_list('athlete_id', 'course_name', 'score_relative')
+        .first()
+    )
+
+
+@receiver(post_save, sender=RoundResult)
+def update_round_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .stats import record_round, forget_round, touch_rounds
+
+    current = (instance.athlete_id, instance.course_name, instance.score_relative)
+    previous = getattr(instance, '_previous_stats_key', None)
+    if previous == current:
+        # Statistics are unchanged, but the chart still shows the new date
+        # or notes, so its ETag must change.
+        touch_rounds(instance.athlete_id)
+        return
+    if previous is not None:
+        forget_round(*previous)
+    record_round(*current)
+
+
+@receiver(post_delete, sender=RoundResult)
+def remove_round_stats(sender, instance, **kwargs):
+    from .stats import forget_round
+
+    forget_round(instance.athlete_id, instance.course_name, instance.score_relative)
+
+
+class ConversationQuerySet(models.QuerySet):
+    def for_participant(self, user):
+        """Conversations where ``user`` is the coach (for coaches) or the athlete."""
+        if user.profile.role == Profile.COACH:
+            return self.filter(coach=user)
+        return self.filter(athlete=user)
+
+    def between(self, athlete, coach):
+        """Return the conversation between ``athlete`` and ``coach``, starting it if needed.
+
+        Safe under concurrent requests: the unique constraint on the pair
+        rejects a second insert, and get_or_create then returns the row the
+        other request created.
+        """
+        conversation, _ = self.get_or_create(athlete=athlete, coach=coach, defaults={'subject': ''})
+        return conversation
+
+    def with_inbox_summary(self, user):
+        """Annotate everything the inbox shows so it renders from one statement.
+
+        Adds ``last_message_text``, ``last_message_at`` and ``unread_count``,
+        and joins both participants. ``unread_count`` is the number of
+        messages from others past ``user``'s read cursor.
+        """
+        thread = Message.objects.filter(conversation=OuterRef('pk'))
+        latest = thread.order_by('-created_at', '-id')
+        last_read_id = (
+            ReadCursor.objects
+            .filter(conversation=OuterRef(OuterRef('pk')), user=user)
+            .values('last_read_message_id')[:1]
+        )
+        unread = (
+            thread
+            .exclude(sender=user)
+            .filter(id__gt=Coalesce(Subquery(last_read_id), 0))
+            .order_by()
+            .values('conversation')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        return self.select_related('athlete', 'coach').annotate(
+            last_message_text=Subquery(latest.values('text')[:1]),
+            last_message_at=Subquery(latest.values('created_at')[:1]),
+            unread_count=Coalesce(Subquery(unread, output_field=models.IntegerField()), 0),
+        )
+
+
 class Conversation(models.Model):
     """A conversation thread between an athlete and a coach."""
     athlete = models.ForeignKey('auth.User', related_name='conversations_as_athlete', on_delete=models.CASCADE)
@@ -106,5 +384,114 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['athlete', 'coach'], name='unique_conversation_per_pair'),
+        ]
+        indexes = [
+            # inbox pages, see views.INBOX_ORDERING
+            models.Index(fields=['coach', '-updated_at', '-id'], name='conversation_coach_inbox'),
+            models.Index(fields=['athlete', '-updated_at', '-id'], name='conversation_athlete_inbox'),
+        ]
+
+    def __str__(self):
+        return f"Conversation: {self.athlete.username} -> {self.coach.username} ({self.created_at:%Y-%m-%d})"
+
+
+class ReadCursor(models.Model):
+    """The newest message a participant has seen in a conversation.
+
+    Messages with a larger id that were sent by someone else are unread.
+    """
+    conversation = models.ForeignKey(Conversation, related_name='read_cursors', on_delete=models.CASCADE)
+    user = models.ForeignKey('auth.User', related_name='read_cursors', on_delete=models.CASCADE)
+    last_read_message_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_read_cursor_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} read {self.conversation_id} up to {self.last_read_message_id}"
+
+
+@receiver(post_save, sender=Message)
+def invalidate_unread_counts(sender, instance, created, raw=False, **kwargs):
+    if raw or not created or instance.conversation_id is None:
+        return
+    from .unread import invalidate_unread_total
+
+    participants = (
+        Conversation.objects
+        .filter(pk=instance.conversation_id)
+        .values_list('athlete_id', 'coach_id')
+        .first()
+    )
+    for user_id in participants or ():
+        if user_id != instance.sender_id:
+            invalidate_unread_total(user_id)
+
+
+def upload_expiry():
+    """When an upload session that receives no more chunks may be pruned."""
+    return timezone.now() + timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+
+
+class UploadSession(models.Model):
+    """An in-progress resumable video upload; see coachingsite.uploads."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('auth.User', related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # moved forward by every chunk; see uploads.prune_expired
+    expires_at = models.DateTimeField(default=upload_expiry, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes)"
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.size
+
+
+class Job(models.Model):
+    """A unit of deferred work; see jobs.py."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # not picked up before this time; pushed back by retries
+    run_at = models.DateTimeField(default=timezone.now)
+    # lease held by the worker running the job (the visibility timeout)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at'),
+        ]
+
     def __str__(self):
-        return f"Conversation: {self.athlete.username} -> {self.coach.username} ({self.created_at:%Y-%m-%d})"
\ No newline at end of file
+        return f"{self.task} #{self.pk} ({self.status})"
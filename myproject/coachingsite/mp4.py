@@ -0,0 +1,389 @@
+"""Read duration, frame rate and resolution from MP4/MOV files.
+
+Only box headers are read on the way to the ``moov`` box. ``mdat``, which
+holds the media samples and is nearly the whole file, is skipped with a seek,
+so probing a multi-GB clip reads a few kilobytes. That holds whether ``moov``
+comes before ``mdat`` (faststart) or after it (the usual phone layout).
+
+``faststart`` rewrites a file so ``moov`` comes before ``mdat``, which lets
+a browser start playback after fetching the first few kilobytes. The media
+data is copied in fixed-size blocks, so memory use does not depend on the
+size of the file.
+
+The module has no Django imports, so the backfill command can run it in
+worker processes.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+from dataclasses import asdict, dataclass
+
+# moov holds sample tables, so it grows with clip length: a few hundred KB
+# for a typical throw clip. Anything far beyond this is not a sane file.
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Largest chunk offset a 32-bit stco table can hold; past it, co64 is used.
+STCO_MAX_OFFSET = 0xFFFFFFFF
+
+# Boxes on the path from moov to the chunk offset tables.
+_CHUNK_OFFSET_CONTAINERS = {b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class MP4Error(ValueError):
+    """The file is not an MP4/MOV we can read metadata from."""
+
+
+@dataclass
+class VideoMetadata:
+    duration: float | None = None
+    fps: float | None = None
+    width: int | None = None
+    height: int | None = None
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def read_box_header(file):
+    """Read one box header at the current position.
+
+    Returns ``(box_type, header_size, box_size)``, or None at end of file.
+    ``box_size`` is None for a box that runs to the end of the file.
+    """
+    header = file.read(8)
+    if not header:
+        return None
+    if len(header) < 8:
+        raise MP4Error('Truncated box header')
+    size, box_type = struct.unpack('>I4s', header)
+    header_size = 8
+    if size == 1:
+        extended = file.read(8)
+        if len(extended) < 8:
+            raise MP4Error('Truncated box header')
+        size = struct.unpack('>Q', extended)[0]
+        header_size = 16
+    elif size == 0:
+        size = None
+    if size is not None and size < header_size:
+        raise MP4Error(f'Invalid size for {box_type!r} box')
+    return box_type, header_size, size
+
+
+def iter_top_level_boxes(file):
+    """Yield ``(box_type, offset, header_size, box_size)`` for each top-level box.
+
+    The file position after each yield is unspecified; iteration seeks to the
+    next box itself.
+    """
+    file.seek(0)
+    offset = 0
+    while True:
+        file.seek(offset)
+        header = read_box_header(file)
+        if header is None:
+            return
+        box_type, header_size, size = header
+        yield box_type, offset, header_size, size
+        if size is None:
+            return
+        offset += size
+
+
+def read_moov(file):
+    """Return the payload of the top-level ``moov`` box as bytes."""
+    for box_type, offset, header_size, size in iter_top_level_boxes(file):
+        if box_type != b'moov':
+            continue
+        if size is None:
+            file.seek(offset + header_size)
+            payload = file.read(MAX_MOOV_SIZE + 1)
+        else:
+            if size - header_size > MAX_MOOV_SIZE:
+                raise MP4Error('moov box is too large')
+            file.seek(offset + header_size)
+            payload = file.read(size - header_size)
+            if len(payload) < size - header_size:
+                raise MP4Error('Truncated moov box')
+        if len(payload) > MAX_MOOV_SIZE:
+            raise MP4Error('moov box is too large')
+        return payload
+    raise MP4Error('No moov box found')
+
+
+def iter_boxes(data, start=0, end=None):
+    """Yield ``(box_type, payload_start, payload_end)`` for boxes in ``data[start:end]``."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise MP4Error('Truncated box header')
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f'Invalid size for {box_type!r} box')
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find(data, start, end, box_type):
+    for child_type, child_start, child_end in iter_boxes(data, start, end):
+        if child_type == box_type:
+            return child_start, child_end
+    return None
+
+
+def _timescale_and_duration(data, start):
+    """Parse the version-dependent layout shared by ``mvhd`` and ``mdhd``."""
+    if data[start] == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def _track_size(data, start):
+    """Return the displayed ``(width, height)`` from a ``tkhd`` payload."""
+    body = start + (36 if data[start] == 1 else 24)
+    # reserved(8), layer, alternate group, volume, reserved, then the matrix
+    a, b, _, c, d = struct.unpack_from('>5i', data, body + 16)
+    width, height = struct.unpack_from('>II', data, body + 52)
+    width, height = width >> 16, height >> 16
+    if a == 0 and d == 0 and b and c:
+        # Rotated by 90 or 270 degrees, as phones record portrait video.
+        width, height = height, width
+    return width, height
+
+
+def _frame_rate(data, stbl, timescale):
+    """Average frame rate from the ``stts`` (decoding time-to-sample) table."""
+    stts = _find(data, *stbl, b'stts')
+    if stts is None or not timescale:
+        return None
+    start, end = stts
+    (entry_count,) = struct.unpack_from('>I', data, start + 4)
+    if start + 8 + entry_count * 8 > end:
+        raise MP4Error('Truncated stts box')
+    samples = ticks = 0
+    for count, delta in struct.iter_unpack('>II', data[start + 8:start + 8 + entry_count * 8]):
+        samples += count
+        ticks += count * delta
+    if not ticks:
+        return None
+    return round(samples * timescale / ticks, 3)
+
+
+def parse_moov(data):
+    """Extract VideoMetadata from the payload of a ``moov`` box."""
+    try:
+        metadata = VideoMetadata()
+        mvhd = _find(data, 0, len(data), b'mvhd')
+        if mvhd is not None:
+            timescale, duration = _timescale_and_duration(data, mvhd[0])
+            if timescale:
+                metadata.duration = round(duration / timescale, 3)
+
+        for box_type, start, end in iter_boxes(data):
+            if box_type != b'trak':
+                continue
+            mdia = _find(data, start, end, b'mdia')
+            if mdia is None:
+                continue
+            hdlr = _find(data, *mdia, b'hdlr')
+            if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+                continue
+
+            tkhd = _find(data, start, end, b'tkhd')
+            if tkhd is not None:
+                metadata.width, metadata.height = _track_size(data, tkhd[0])
+            mdhd = _find(data, *mdia, b'mdhd')
+            minf = _find(data, *mdia, b'minf')
+            stbl = _find(data, *minf, b'stbl') if minf else None
+            if mdhd is not None:
+                timescale, duration = _timescale_and_duration(data, mdhd[0])
+                if metadata.duration is None and timescale:
+                    metadata.duration = round(duration / timescale, 3)
+                if stbl is not None:
+                    metadata.fps = _frame_rate(data, stbl, timescale)
+            break
+        return metadata
+    except (struct.error, IndexError) as exc:
+        raise MP4Error('Malformed moov box') from exc
+
+
+def read_metadata(file):
+    """Read VideoMetadata from a seekable binary file object.
+
+    The file position is restored afterwards so an upload can still be saved
+    from the same object.
+    """
+    position = file.tell()
+    try:
+        return parse_moov(read_moov(file))
+    finally:
+        file.seek(position)
+
+
+def probe_path(path):
+    """Return the metadata of the file at ``path`` as a dict, or None if unreadable.
+
+    Picklable in both directions, for use with a process pool.
+    """
+    try:
+        with open(path, 'rb') as file:
+            return read_metadata(file).as_dict()
+    except (OSError, MP4Error):
+        return None
+
+
+class _OffsetOverflow(Exception):
+    pass
+
+
+def _box(box_type, payload):
+    size = 8 + len(payload)
+    if size > 0xFFFFFFFF:
+        return struct.pack('>I4sQ', 1, box_type, size + 8) + payload
+    return struct.pack('>I4s', size, box_type) + payload
+
+
+def _relocate_chunk_offsets(data, start, end, relocate, use_co64):
+    """Return ``data[start:end]`` with every ``stco``/``co64`` entry passed through ``relocate``.
+
+    Containers on the way are rebuilt because their sizes change when
+    ``use_co64`` widens ``stco`` tables to 64-bit ``co64`` ones.
+    """
+    parts = []
+    box_start = start
+    for box_type, payload_start, payload_end in iter_boxes(data, start, end):
+        version_flags = data[payload_start:payload_start + 4]
+        if box_type in _CHUNK_OFFSET_CONTAINERS:
+            parts.append(_box(box_type, _relocate_chunk_offsets(data, payload_start, payload_end, relocate, use_co64)))
+        elif box_type in (b'stco', b'co64'):
+            (count,) = struct.unpack_from('>I', data, payload_start + 4)
+            width = 'I' if box_type == b'stco' else 'Q'
+            if payload_start + 8 + count * struct.calcsize(width) > payload_end:
+                raise MP4Error(f'Truncated {box_type.decode()} box')
+            offsets = [relocate(offset) for offset in struct.unpack_from(f'>{count}{width}', data, payload_start + 8)]
+            if box_type == b'co64' or use_co64:
+                parts.append(_box(b'co64', version_flags + struct.pack(f'>I{count}Q', count, *offsets)))
+            elif offsets and max(offsets) > STCO_MAX_OFFSET:
+                raise _OffsetOverflow
+            else:
+                parts.append(_box(b'stco', version_flags + struct.pack(f'>I{count}I', count, *offsets)))
+        else:
+            parts.append(data[box_start:payload_end])
+        box_start = payload_end
+    return b''.join(parts)
+
+
+def _copy_range(source, target, start, length):
+    source.seek(start)
+    while length:
+        block = source.read(min(COPY_BLOCK_SIZE, length))
+        if not block:
+            raise MP4Error('File ended early')
+        target.write(block)
+        length -= len(block)
+
+
+def faststart_copy(path, target):
+    """Write a faststart copy of the MP4 at ``path`` to the open file ``target``.
+
+    Returns False, writing nothing, when the file already has ``moov``
+    before its media data or is fragmented.
+    """
+    with open(path, 'rb') as source:
+        file_size = os.fstat(source.fileno()).st_size
+        boxes = [
+            (box_type, offset, file_size - offset if size is None else size)
+            for box_type, offset, _, size in iter_top_level_boxes(source)
+        ]
+        types = [box[0] for box in boxes]
+        if b'moov' not in types:
+            raise MP4Error('No moov box found')
+        moov_index = types.index(b'moov')
+        if b'mdat' not in types or moov_index < types.index(b'mdat'):
+            return False
+        if b'moof' in types:
+            # Fragmented files locate their samples relative to each moof.
+            return False
+
+        insert_at = boxes[types.index(b'mdat')][1]
+        _, moov_offset, moov_size = boxes[moov_index]
+        moov_end = moov_offset + moov_size
+        payload = read_moov(source)
+
+        # Everything between the insertion point and the old moov moves down
+        # by the size of the new moov box. Everything after the old moov
+        # moves by the difference between the new and old moov sizes, which
+        # is not zero when co64 tables are wider than the stco ones they
+        # replace or the old moov had a 64-bit size header.
+        shift = moov_size
+
+        def relocate(offset):
+            if insert_at <= offset < moov_offset:
+                return offset + shift
+            if offset >= moov_end:
+                return offset + shift - moov_size
+            return offset
+
+        for use_co64 in (False, True):
+            try:
+                while True:
+                    moov = _box(b'moov', _relocate_chunk_offsets(payload, 0, len(payload), relocate, use_co64))
+                    if len(moov) == shift:
+                        break
+                    shift = len(moov)
+                break
+            except _OffsetOverflow:
+                continue
+
+        _copy_range(source, target, 0, insert_at)
+        target.write(moov)
+        _copy_range(source, target, insert_at, moov_offset - insert_at)
+        _copy_range(source, target, moov_end, file_size - moov_end)
+    return True
+
+
+def faststart_to(path, directory):
+    """Write a faststart copy of ``path`` to a new file in ``directory``.
+
+    Returns the new file's path, or None when ``path`` needs no rewrite.
+    """
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.faststart.', delete=False) as target:
+        try:
+            rewritten = faststart_copy(path, target)
+            if rewritten:
+                target.flush()
+                os.fsync(target.fileno())
+        except BaseException:
+            os.remove(target.name)
+            raise
+    if not rewritten:
+        os.remove(target.name)
+        return None
+    return target.name
+
+
+def faststart(path):
+    """Rewrite the MP4 at ``path`` in place so ``moov`` precedes the media data.
+
+    Returns False without touching the file when it is already laid out that
+    way, so running it twice is harmless. The new file is written next to
+    the old one and swapped in with ``os.replace``, so readers always see a
+    complete file.
+    """
+    rewritten = faststart_to(path, os.path.dirname(path))
+    if rewritten is None:
+        return False
+    shutil.copymode(path, rewritten)
+    os.replace(rewritten, path)
+    return True
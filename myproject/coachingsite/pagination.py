@@ -0,0 +1,114 @@
+"""Keyset (cursor) pagination for querysets.
+
+Pages are selected with a ``WHERE`` clause on the ordering columns of the
+last row already shown instead of ``OFFSET``, so fetching page 100 costs the
+same as fetching page 1 when an index covers the ordering.
+
+Cursors are opaque URL-safe strings holding the ordering values of the last
+row on a page.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def _field_name(ordering_term):
+    return ordering_term.lstrip('-')
+
+
+def _encode_value(value):
+    # Keep full microsecond precision; DjangoJSONEncoder truncates datetimes
+    # to milliseconds, which would make the keyset comparison skip rows.
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values):
+    payload = json.dumps(list(values), default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """Decode ``cursor`` into Python values for ``ordering`` on ``model``."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise InvalidCursor('Malformed cursor') from exc
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Cursor does not match the ordering')
+    try:
+        # to_python() expects form input; crafted JSON such as a list where a
+        # datetime belongs raises TypeError instead of ValidationError.
+        decoded = [
+            model._meta.get_field(_field_name(term)).to_python(value)
+            for term, value in zip(ordering, values)
+        ]
+    except (ValidationError, TypeError, ValueError) as exc:
+        raise InvalidCursor('Cursor contains invalid values') from exc
+    if None in decoded:
+        raise InvalidCursor('Cursor contains empty values')
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """Return a Q selecting rows that sort strictly after ``values``.
+
+    For ordering ``(-a, b)`` this is ``a < va OR (a = va AND b > vb)``.
+    """
+    condition = Q()
+    for index, term in enumerate(ordering):
+        lookup = 'lt' if term.startswith('-') else 'gt'
+        clause = Q(**{f'{_field_name(term)}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values[:index]):
+            clause &= Q(**{_field_name(previous): value})
+        condition |= clause
+    return condition
+
+
+def _row_value(row, name):
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
+
+@dataclass
+class KeysetPage:
+    items: list = field(default_factory=list)
+    next_cursor: str | None = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=25):
+    """Return the page of ``queryset`` following ``cursor``.
+
+    ``ordering`` must make rows unique (end it with the primary key). The
+    queryset may yield model instances or ``values()`` dicts that include the
+    ordering fields. Raises ``InvalidCursor`` for a bad cursor.
+    """
+    ordering = tuple(ordering)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    items = list(queryset[:page_size + 1])
+    page = KeysetPage(items=items[:page_size])
+    if len(items) > page_size:
+        last = page.items[-1]
+        page.next_cursor = encode_cursor(_row_value(last, _field_name(term)) for term in ordering)
+    return page
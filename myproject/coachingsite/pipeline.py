@@ -0,0 +1,50 @@
+"""Post-upload processing of stored videos.
+
+Stages run as background jobs (see jobs.py), queued in the same transaction
+that saves the video, so the upload request returns as soon as the file is
+stored. The current stage rewrites MP4s to faststart layout (see
+``mp4.faststart``). Content-addressed blobs are never changed in place: the
+rewritten file is stored as a new blob and the rows are moved onto it
+(``storage.replace_blob``).
+"""
+
+import logging
+
+from .jobs import task
+from .mp4 import MP4Error, faststart, faststart_to
+from .storage import blob_digest, replace_blob, video_storage
+
+logger = logging.getLogger(__name__)
+
+
+def make_faststart(storage, name):
+    """Rewrite the stored video ``name`` to faststart layout; True if it changed."""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Remote storages have no local path to rewrite in place.
+        return False
+    try:
+        if blob_digest(name) is None:
+            return faststart(path)
+        rewritten = faststart_to(path, storage.staging_dir())
+        if rewritten is None:
+            return False
+        replace_blob(storage, name, rewritten)
+        return True
+    except MP4Error as exc:
+        # Not something a retry can fix.
+        logger.warning('Could not make %s faststart: %s', name, exc)
+        return False
+
+
+@task()
+def faststart_video(name):
+    storage = video_storage()
+    if storage.exists(name):
+        make_faststart(storage, name)
+
+
+def schedule_faststart(video):
+    """Queue ``video`` (a FieldFile) for the faststart stage."""
+    faststart_video.enqueue(name=video.name)
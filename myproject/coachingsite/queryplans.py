@@ -0,0 +1,112 @@
+"""Find statements whose SQLite query plan scans a whole table.
+
+Every statement the site's pages run (see sitewalk.py) is passed through
+``EXPLAIN QUERY PLAN``. Two kinds of plan step are reported:
+
+- ``SCAN <table>`` without an index: every row of the table is read.
+- ``USE TEMP B-TREE FOR ...``: rows are sorted or grouped after they are
+  read, because no index delivers them in order.
+
+Some of these are fine, for example listing every coach on the dashboard.
+The accepted ones are listed in BASELINE_PATH. QueryPlanTests and
+``manage.py check_query_plans`` fail when a page runs a plan that is not in
+the baseline.
+"""
+
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .sitewalk import iter_site_requests
+
+BASELINE_PATH = Path(__file__).with_name('query_plan_baseline.json')
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+# The data plans are taken on. Without ANALYZE statistics SQLite plans do
+# not depend on table sizes, so a small site gives the same plans as a big one.
+SEED = {
+    'athletes': 20,
+    'coaches': 2,
+    'rounds_per_athlete': 10,
+    'messages_per_conversation': 6,
+    'responses_per_conversation': 1,
+    'prefix': 'plans',
+}
+
+
+def normalize_sql(sql):
+    """Replace literals in ``sql``, so the same statement for different rows compares equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'"s\w+_x\d+"', '"savepoint"', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(?:, \?)*\)', '(...)', sql)
+
+
+def explain(sql):
+    """Return the plan steps SQLite chooses for ``sql``."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[3] for row in cursor.fetchall()]
+
+
+def plan_problems(details):
+    """Return the plan steps that read a whole table or sort without an index."""
+    return [
+        detail for detail in details
+        if FULL_SCAN_RE.match(detail) or detail.startswith('USE TEMP B-TREE')
+    ]
+
+
+def collect_problems(conversation, only=None):
+    """Request every page as the participants of ``conversation`` and explain what it ran.
+
+    Returns sorted ``{'view', 'role', 'plan', 'sql'}`` dicts, one per
+    problem plan step, with the SQL normalised.
+    """
+    if connection.vendor != 'sqlite':
+        raise ImproperlyConfigured('Query plans are only checked on SQLite.')
+    problems = set()
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for name, role, client, url in iter_site_requests(conversation, only):
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url).close()
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                    continue
+                for detail in plan_problems(explain(sql)):
+                    problems.add((name, role, detail, normalize_sql(sql)))
+    return [dict(zip(('view', 'role', 'plan', 'sql'), problem)) for problem in sorted(problems)]
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return []
+
+
+def write_baseline(problems, path=BASELINE_PATH):
+    with open(path, 'w') as handle:
+        json.dump(problems, handle, indent=2)
+        handle.write('\n')
+
+
+def compare(problems, baseline):
+    """Return ``(new, fixed)``: problems missing from ``baseline``, and baseline entries no longer seen."""
+    key = lambda problem: (problem['view'], problem['role'], problem['plan'], problem['sql'])
+    current, accepted = {key(p): p for p in problems}, {key(p): p for p in baseline}
+    new = [current[k] for k in sorted(current.keys() - accepted.keys())]
+    fixed = [accepted[k] for k in sorted(accepted.keys() - current.keys())]
+    return new, fixed
+
+
+def describe(problems):
+    return '\n'.join(f"{p['view']} ({p['role']}): {p['plan']}\n    {p['sql']}" for p in problems)
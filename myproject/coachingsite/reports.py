@@ -0,0 +1,217 @@
+"""Single-pass progress reports built from an athlete's round history.
+
+``build_progress_report`` reads the athlete's rounds once as plain tuples and
+derives everything the progress tracker shows from that one stream: per-course
+groups, the filtered summary, the distinct course list, the round history and
+the chart series. The result is a plain dataclass, meant for a JSON API or
+export that needs the whole report at once. Its summaries always agree with
+the CourseStats table (stats.py), which the progress pages read instead so
+they do not load the full history on every view.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from django.db.models import Q
+
+from .models import RoundResult
+
+NO_COURSE = '__none'
+
+ROW_FIELDS = ('id', 'played_on', 'created_at', 'course_name', 'score_relative', 'notes')
+
+
+def course_label(name):
+    return name.strip() if name else 'Unspecified course'
+
+
+def selected_course_label(course_filter):
+    if not course_filter:
+        return 'All courses'
+    if course_filter == NO_COURSE:
+        return course_label('')
+    return course_label(course_filter)
+
+
+def course_value(name):
+    """Return the ``course`` query parameter that selects ``name``."""
+    return name if name else NO_COURSE
+
+
+def matches_course(name, course_filter):
+    if not course_filter:
+        return True
+    if course_filter == NO_COURSE:
+        return not name
+    return name == course_filter
+
+
+def filter_by_course(queryset, course_filter):
+    """Apply the progress page ``course`` filter to a RoundResult queryset."""
+    if not course_filter:
+        return queryset
+    if course_filter == NO_COURSE:
+        return queryset.filter(Q(course_name__isnull=True) | Q(course_name__exact=''))
+    return queryset.filter(course_name=course_filter)
+
+
+@dataclass(frozen=True)
+class RoundRow:
+    """A lightweight, read-only view of a RoundResult row."""
+
+    id: int
+    played_on: date
+    created_at: datetime
+    course_name: str
+    score_relative: int
+    notes: str
+
+    @property
+    def score_display(self):
+        return f"{self.score_relative:+d}"
+
+    def chart_point(self):
+        return {
+            'date': self.played_on.strftime('%Y-%m-%d'),
+            'label': self.course_name or 'Round',
+            'score': self.score_relative,
+        }
+
+
+@dataclass
+class ScoreSummary:
+    """Round count and score extremes accumulated one score at a time."""
+
+    rounds: int = 0
+    score_total: int = 0
+    best: int | None = None
+    worst: int | None = None
+
+    def add(self, score):
+        self.rounds += 1
+        self.score_total += score
+        if self.best is None or score < self.best:
+            self.best = score
+        if self.worst is None or score > self.worst:
+            self.worst = score
+
+    @property
+    def avg_score(self):
+        if not self.rounds:
+            return None
+        return self.score_total / self.rounds
+
+    def as_aggregate(self):
+        """Return the summary shaped like the ORM ``aggregate()`` result."""
+        return {'avg_score': self.avg_score, 'best': self.best, 'worst': self.worst}
+
+
+@dataclass
+class CourseSummary(ScoreSummary):
+    course_name: str = ''
+
+    @property
+    def value(self):
+        return course_value(self.course_name)
+
+    @property
+    def label(self):
+        return course_label(self.course_name)
+
+
+@dataclass
+class ProgressReport:
+    course_filter: str = ''
+    overall: ScoreSummary = field(default_factory=ScoreSummary)
+    filtered: ScoreSummary = field(default_factory=ScoreSummary)
+    courses: list[CourseSummary] = field(default_factory=list)
+    rows: list[RoundRow] = field(default_factory=list)
+
+    @property
+    def selected_course_label(self):
+        return selected_course_label(self.course_filter)
+
+    @property
+    def course_suggestions(self):
+        names = [course.course_name for course in self.courses if course.course_name]
+        return sorted(names, key=str.lower)
+
+    @property
+    def entries(self):
+        """Filtered rounds, newest first."""
+        return self.rows[::-1]
+
+    @property
+    def chart_points(self):
+        """Filtered rounds as chart points, oldest first."""
+        return [row.chart_point() for row in self.rows]
+
+
+def round_rows(queryset):
+    """Stream a RoundResult queryset as RoundRow tuples, oldest first."""
+    ordered = queryset.order_by('played_on', 'created_at', 'id').values_list(*ROW_FIELDS)
+    for values in ordered.iterator(chunk_size=2000):
+        yield RoundRow(*values)
+
+
+def build_progress_report(athlete, course_filter=''):
+    """Compute the progress report for ``athlete`` with a single query."""
+    report = ProgressReport(course_filter=course_filter)
+    if athlete is None:
+        return report
+
+    courses = {}
+    for row in round_rows(RoundResult.objects.filter(athlete=athlete)):
+        score = row.score_relative
+        report.overall.add(score)
+        course = courses.get(row.course_name)
+        if course is None:
+            course = courses[row.course_name] = CourseSummary(course_name=row.course_name)
+        course.add(score)
+        if matches_course(row.course_name, course_filter):
+            report.filtered.add(score)
+            report.rows.append(row)
+
+    report.courses = [courses[name] for name in sorted(courses)]
+    return report
+
+
+def downsample_lttb(points, threshold, value=lambda point: point['score']):
+    """Reduce ``points`` to ``threshold`` items with Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Every other bucket contributes
+    the point that forms the largest triangle with the previously chosen
+    point and the average of the next bucket. That keeps peaks and dips that
+    plain striding would drop. Points are assumed evenly spaced on the x axis,
+    which matches how the progress chart plots one round per label.
+    """
+    size = len(points)
+    if threshold >= size or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (size - 2) / (threshold - 2)
+    anchor = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, size)
+        next_count = next_end - next_start
+        avg_x = (next_start + next_end - 1) / 2
+        avg_y = sum(value(point) for point in points[next_start:next_end]) / next_count
+
+        anchor_y = value(points[anchor])
+        chosen = start
+        max_area = -1.0
+        for index in range(start, end):
+            area = abs((anchor - avg_x) * (value(points[index]) - anchor_y) - (anchor - index) * (avg_y - anchor_y))
+            if area > max_area:
+                max_area = area
+                chosen = index
+        sampled.append(points[chosen])
+        anchor = chosen
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,163 @@
+"""Bulk-created coaching data at realistic volumes.
+
+``seed_site`` fills the database with coaches, athletes, conversations,
+messages, responses and rounds so that pages can be exercised against
+something closer to production than a handful of rows. It is what the query
+budget tests and ``manage.py seed_data`` run.
+
+Rows are inserted with bulk_create, so model signals do not run: profiles
+and course stats are written here rather than by their signal handlers.
+"""
+
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Conversation, Message, Profile, ReadCursor, Response, RoundResult
+from .stats import rebuild_stats
+from .usercache import invalidate_cached_user
+
+COURSES = (
+    'Maple Hill', 'Blue Ribbon Pines', 'Idlewild', 'Fox Run Meadows',
+    'Harmon Hills', 'Smugglers Notch', 'DeLaveaga', 'Milo McIver', '',
+)
+SEED_PASSWORD = 'seeded-password'
+BATCH_SIZE = 500
+
+
+@dataclass
+class SeededSite:
+    coaches: list = field(default_factory=list)
+    athletes: list = field(default_factory=list)
+    conversations: list = field(default_factory=list)
+    counts: dict = field(default_factory=dict)
+
+
+def _create_users(usernames, role, password):
+    User.objects.bulk_create(
+        [User(username=name, email=f'{name}@example.com', password=password) for name in usernames],
+        batch_size=BATCH_SIZE,
+    )
+    users = list(User.objects.filter(username__in=usernames).order_by('pk'))
+    Profile.objects.bulk_create(
+        [Profile(user=user, role=role, full_name=user.username.replace('-', ' ').title()) for user in users],
+        batch_size=BATCH_SIZE,
+    )
+    # A reused id must not pick up a cached user deleted earlier.
+    for user in users:
+        invalidate_cached_user(user.pk)
+    return users
+
+
+@transaction.atomic
+def seed_site(
+    athletes=200, coaches=5, rounds_per_athlete=20, messages_per_conversation=10,
+    responses_per_conversation=0, prefix='seed', seed=0,
+):
+    """Create ``coaches`` coaches and ``athletes`` athletes with their activity.
+
+    Every athlete gets a conversation with one coach, assigned round robin,
+    holding ``messages_per_conversation`` messages from both sides, and
+    ``rounds_per_athlete`` rounds spread over the courses in COURSES. The
+    coach responds to the first ``responses_per_conversation`` athlete
+    messages of each thread, and has read the older half of every thread. Seeding with the same
+    ``seed`` gives the same data. Usernames start with ``prefix``. All users
+    log in with SEED_PASSWORD.
+    """
+    rng = random.Random(seed)
+    # Hashing is deliberately slow, so every user shares one hash.
+    password = make_password(SEED_PASSWORD)
+    site = SeededSite(
+        coaches=_create_users([f'{prefix}-coach-{n}' for n in range(coaches)], Profile.COACH, password),
+        athletes=_create_users([f'{prefix}-athlete-{n}' for n in range(athletes)], Profile.ATHLETE, password),
+    )
+
+    pairs = [(athlete, site.coaches[n % coaches]) for n, athlete in enumerate(site.athletes)] if coaches else []
+    Conversation.objects.bulk_create(
+        [Conversation(athlete=athlete, coach=coach) for athlete, coach in pairs],
+        batch_size=BATCH_SIZE,
+    )
+    site.conversations = list(
+        Conversation.objects.filter(athlete__in=site.athletes).select_related('athlete', 'coach').order_by('pk')
+    )
+    for coach in site.coaches:
+        coach.profile.assigned_athletes.add(*[c.athlete for c in site.conversations if c.coach_id == coach.pk])
+
+    Message.objects.bulk_create(
+        [
+            Message(
+                conversation=conversation,
+                sender=conversation.athlete if number % 2 == 0 else conversation.coach,
+                text=f'Message {number} about {rng.choice(("putting", "drives", "upshots", "form"))}',
+                has_content=True,
+            )
+            for conversation in site.conversations
+            for number in range(messages_per_conversation)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    responded = []
+    if responses_per_conversation:
+        athlete_messages = (
+            Message.objects
+            .filter(conversation__in=site.conversations, sender__profile__role=Profile.ATHLETE)
+            .order_by('pk')
+            .values_list('conversation', 'pk')
+        )
+        per_thread = {}
+        for conversation_id, message_id in athlete_messages:
+            if len(per_thread.setdefault(conversation_id, [])) < responses_per_conversation:
+                per_thread[conversation_id].append(message_id)
+        responded = [message_id for ids in per_thread.values() for message_id in ids]
+        Response.objects.bulk_create(
+            [Response(message_id=message_id, text='Try a smoother reach back.') for message_id in responded],
+            batch_size=BATCH_SIZE,
+        )
+        for start in range(0, len(responded), BATCH_SIZE):
+            Message.objects.filter(pk__in=responded[start:start + BATCH_SIZE]).update(responded=True)
+
+    if messages_per_conversation:
+        thread_ids = {}
+        for conversation_id, message_id in (
+            Message.objects.filter(conversation__in=site.conversations).order_by('pk').values_list('conversation', 'pk')
+        ):
+            thread_ids.setdefault(conversation_id, []).append(message_id)
+        ReadCursor.objects.bulk_create(
+            [
+                ReadCursor(
+                    conversation=conversation,
+                    user=conversation.coach,
+                    last_read_message_id=thread_ids[conversation.pk][(len(thread_ids[conversation.pk]) - 1) // 2],
+                )
+                for conversation in site.conversations
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+    today = date.today()
+    RoundResult.objects.bulk_create(
+        [
+            RoundResult(
+                athlete=athlete,
+                course_name=rng.choice(COURSES),
+                score_relative=rng.randint(-10, 15),
+                played_on=today - timedelta(days=rng.randrange(3 * 365)),
+            )
+            for athlete in site.athletes
+            for _ in range(rounds_per_athlete)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    rebuild_stats(site.athletes)
+    site.counts = {
+        'users': coaches + athletes,
+        'conversations': len(site.conversations),
+        'messages': len(site.conversations) * messages_per_conversation,
+        'responses': len(responded),
+        'rounds': athletes * rounds_per_athlete,
+    }
+    return site
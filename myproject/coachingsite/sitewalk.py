@@ -0,0 +1,75 @@
+"""GET every coachingsite URL as a seeded coach and athlete.
+
+Shared by ``manage.py benchmark_views`` and the query plan check, so both
+cover the same pages with the same arguments. Data comes from
+``seeding.seed_site`` (or ``manage.py seed_data``); requests run for real,
+so they write read cursors and sessions like a browser would.
+"""
+
+from django.test import Client
+from django.urls import reverse
+
+from . import urls
+from .models import Conversation
+from .uploads import create_session, discard_session
+
+# URLs that cannot be driven with a plain GET
+SKIPPED = {
+    'conversation_events': 'streams until the client disconnects',
+    'upload_create': 'POST only',
+    'upload_finalize': 'POST only',
+}
+
+
+def seeded_conversation(prefix='seed'):
+    """Return the first conversation of the first seeded coach, or None."""
+    return (
+        Conversation.objects
+        .filter(coach__username=f'{prefix}-coach-0')
+        .select_related('athlete', 'coach')
+        .order_by('pk')
+        .first()
+    )
+
+
+def iter_site_requests(conversation, only=None, skipped=None):
+    """Yield ``(url_name, role, client, url)`` for every GETtable URL.
+
+    Each role's client is logged in as that participant of ``conversation``.
+    URLs that cannot be requested are recorded in the ``skipped`` dict, if
+    given, with the reason. ``only`` limits the walk to some URL names.
+    """
+    message = conversation.messages.order_by('pk').first()
+    roles = {
+        # the view's coach_id is whoever the user wants to talk to
+        'coach': (conversation.coach, conversation.athlete),
+        'athlete': (conversation.athlete, conversation.coach),
+    }
+    for role, (user, other) in roles.items():
+        upload = create_session(user, 'walk.mp4', 1)
+        try:
+            targets = {
+                'conversation_detail': [conversation.pk],
+                'conversation_updates': [conversation.pk],
+                'start_conversation': [other.pk],
+                'upload_detail': [upload.pk],
+            }
+            if message is not None:
+                targets['message_detail'] = [message.pk]
+            client = Client()
+            client.force_login(user)
+            for pattern in urls.urlpatterns:
+                name = pattern.name
+                if only and name not in only:
+                    continue
+                if name in SKIPPED:
+                    reason = SKIPPED[name]
+                elif pattern.pattern.converters and name not in targets:
+                    reason = 'no arguments known for this URL'
+                else:
+                    yield name, role, client, reverse(f'{urls.app_name}:{name}', args=targets.get(name, []))
+                    continue
+                if skipped is not None:
+                    skipped[name] = reason
+        finally:
+            discard_session(upload)
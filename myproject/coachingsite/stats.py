@@ -0,0 +1,115 @@
+"""Incremental maintenance of the CourseStats summary table.
+
+Each RoundResult contributes to two CourseStats rows: the one for its course
+and the athlete's all-courses row. Adding a round only touches those rows
+with atomic ``F()`` updates. Removing a round decrements the counters and
+only recomputes best/worst when the removed score was one of them.
+
+``updated_at`` is bumped explicitly because ``auto_now`` does not apply to
+``QuerySet.update()``; the all-courses row's timestamp doubles as the
+athlete's "rounds last changed" marker for HTTP caching.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from .jobs import task
+from .models import CourseStats, RoundResult
+
+
+def _stats_rows(athlete_id, course_name):
+    """Return filters for the per-course row and the all-courses row."""
+    return (
+        {'athlete_id': athlete_id, 'is_total': False, 'course_name': course_name or ''},
+        {'athlete_id': athlete_id, 'is_total': True, 'course_name': ''},
+    )
+
+
+def record_round(athlete_id, course_name, score):
+    """Add a single round's score to the athlete's stats."""
+    with transaction.atomic():
+        for lookup in _stats_rows(athlete_id, course_name):
+            CourseStats.objects.get_or_create(**lookup)
+            CourseStats.objects.filter(**lookup).update(
+                rounds=F('rounds') + 1,
+                score_total=F('score_total') + score,
+                best=Least(Coalesce(F('best'), Value(score)), Value(score)),
+                worst=Greatest(Coalesce(F('worst'), Value(score)), Value(score)),
+                updated_at=timezone.now(),
+            )
+
+
+def touch_rounds(athlete_id):
+    """Mark the athlete's rounds as changed without changing any statistics."""
+    CourseStats.objects.filter(athlete_id=athlete_id, is_total=True).update(updated_at=timezone.now())
+
+
+def forget_round(athlete_id, course_name, score):
+    """Remove a single round's score from the athlete's stats."""
+    course_lookup, total_lookup = _stats_rows(athlete_id, course_name)
+    with transaction.atomic():
+        for lookup in (course_lookup, total_lookup):
+            row = CourseStats.objects.select_for_update().filter(**lookup).first()
+            if row is None:
+                continue
+            if row.rounds <= 1:
+                row.delete()
+                continue
+            CourseStats.objects.filter(pk=row.pk).update(
+                rounds=F('rounds') - 1,
+                score_total=F('score_total') - score,
+                updated_at=timezone.now(),
+            )
+            if score in (row.best, row.worst):
+                _refresh_extremes(row)
+
+
+def _refresh_extremes(row):
+    """Recompute best/worst for a stats row after an extreme was removed."""
+    if row.is_total:
+        # The all-courses extremes follow from the per-course rows, which
+        # were already refreshed, so there is no need to touch the rounds.
+        source = CourseStats.objects.filter(athlete_id=row.athlete_id, is_total=False)
+        extremes = source.aggregate(best=Min('best'), worst=Max('worst'))
+    else:
+        source = RoundResult.objects.filter(athlete_id=row.athlete_id, course_name=row.course_name)
+        extremes = source.aggregate(best=Min('score_relative'), worst=Max('score_relative'))
+    CourseStats.objects.filter(pk=row.pk).update(**extremes)
+
+
+@task()
+def rebuild_stats(athletes=None):
+    """Recompute CourseStats from scratch, optionally for some athletes only.
+
+    ``athletes`` may be users or user ids; ids make it usable as a job.
+
+    Returns the number of stats rows written.
+    """
+    rounds = RoundResult.objects.order_by()
+    stats = CourseStats.objects.all()
+    if athletes is not None:
+        rounds = rounds.filter(athlete__in=athletes)
+        stats = stats.filter(athlete__in=athletes)
+
+    per_course = rounds.values('athlete_id', 'course_name').annotate(
+        rounds=Count('id'),
+        score_total=Sum('score_relative'),
+        best=Min('score_relative'),
+        worst=Max('score_relative'),
+    )
+    totals = rounds.values('athlete_id').annotate(
+        rounds=Count('id'),
+        score_total=Sum('score_relative'),
+        best=Min('score_relative'),
+        worst=Max('score_relative'),
+    )
+
+    rows = [CourseStats(is_total=False, **group) for group in per_course]
+    rows += [CourseStats(is_total=True, course_name='', **group) for group in totals]
+
+    with transaction.atomic():
+        stats.delete()
+        CourseStats.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
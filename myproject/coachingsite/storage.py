@@ -0,0 +1,193 @@
+"""Content-addressed, deduplicating storage for uploaded videos.
+
+An upload is hashed with SHA-256 while it is written to a staging file, then
+stored once as ``blobs/<ab>/<cd>/<digest><ext>``. A clip that is already
+stored is not written again; the new Message or Response simply points at
+the existing blob. A VideoBlob row counts the references to each blob:
+``save`` adds one, ``delete`` removes one, and the file is deleted with its
+last reference. Message and Response save inside a transaction, so the
+reference added while storing a video rolls back with a failed save, and
+they release the old blob once a replaced video is committed.
+
+Blob contents never change, which lets ``serve_media`` use the digest as
+the ETag and mark responses immutable. Later processing, such as faststart,
+stores its output as a new blob and repoints the rows with ``replace_blob``.
+"""
+
+import fcntl
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+from contextlib import contextmanager
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(r'^%s/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[\w]+)?$' % BLOB_DIR)
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class LocalFile(File):
+    """A File whose data is already on local disk.
+
+    Storages move such files into place instead of copying them, because
+    they expose ``temporary_file_path()`` like large uploaded files do.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def video_storage():
+    return storages['videos']
+
+
+def blob_digest(name):
+    """Return the SHA-256 hex digest encoded in a blob name, or None for other names."""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DedupStorage(FileSystemStorage):
+    def blob_name(self, digest, extension=''):
+        return posixpath.join(BLOB_DIR, digest[:2], digest[2:4], digest + extension.lower())
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is chosen by _save from the content.
+        return name
+
+    @contextmanager
+    def _lock(self):
+        # Serialises "add reference, then make sure the file exists" against
+        # "drop the last reference, then delete the file".
+        os.makedirs(self.path(BLOB_DIR), exist_ok=True)
+        with open(self.path(posixpath.join(BLOB_DIR, '.lock')), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1]
+        if hasattr(content, 'temporary_file_path'):
+            source = content.temporary_file_path()
+            digest = hash_file(source)
+            staged = False
+        else:
+            hasher = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=self.staging_dir(), delete=False) as target:
+                try:
+                    for chunk in content.chunks():
+                        hasher.update(chunk)
+                        target.write(chunk)
+                except BaseException:
+                    os.remove(target.name)
+                    raise
+            source, digest, staged = target.name, hasher.hexdigest(), True
+
+        name = self.blob_name(digest, extension)
+        full_path = self.path(name)
+        with self._lock():
+            self.retain(name, size=os.path.getsize(source))
+            if not os.path.exists(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                file_move_safe(source, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+            elif staged:
+                os.remove(source)
+        return name
+
+    def staging_dir(self):
+        """A directory on the same filesystem as the blobs, for files about to be stored."""
+        path = self.path(posixpath.join(BLOB_DIR, '.staging'))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def retain(self, name, count=1, size=None):
+        """Add ``count`` references to the blob ``name``."""
+        from .models import VideoBlob
+
+        if count <= 0:
+            return
+        if VideoBlob.objects.filter(name=name).update(refcount=F('refcount') + count, replaced_by=''):
+            return
+        if size is None:
+            size = os.path.getsize(self.path(name))
+        try:
+            with transaction.atomic():
+                VideoBlob.objects.create(name=name, size=size, refcount=count)
+        except IntegrityError:
+            VideoBlob.objects.filter(name=name).update(refcount=F('refcount') + count, replaced_by='')
+
+    def release(self, name, count=1, replaced_by=''):
+        """Drop ``count`` references to the blob ``name``, deleting it with the last one.
+
+        With ``replaced_by`` the row outlives the file, so links to the old
+        name that are already out in rendered pages can be redirected.
+        """
+        from .models import VideoBlob
+
+        if count <= 0:
+            return
+        with self._lock():
+            VideoBlob.objects.filter(name=name).update(refcount=F('refcount') - count)
+            unused = VideoBlob.objects.filter(name=name, refcount__lte=0)
+            if replaced_by:
+                gone = unused.update(refcount=0, replaced_by=replaced_by)
+            else:
+                gone, _ = unused.delete()
+            if gone:
+                super().delete(name)
+
+    def delete(self, name):
+        if blob_digest(name) is None:
+            super().delete(name)
+        else:
+            self.release(name)
+
+
+def replace_blob(storage, old_name, path):
+    """Store the file at ``path`` as a blob and move every reference to ``old_name`` onto it.
+
+    Used by processing stages that produce a new version of a stored video.
+    ``path`` must be on the storage's filesystem and is consumed. Returns
+    the new blob name.
+    """
+    from .models import Message, Response
+
+    with open(path, 'rb') as file:
+        new_name = storage.save(old_name, LocalFile(file))
+    if os.path.exists(path):
+        os.remove(path)
+    if new_name == old_name:
+        storage.release(new_name)
+        return new_name
+    with transaction.atomic():
+        moved = Message.objects.filter(video=old_name).update(video=new_name)
+        moved += Response.objects.filter(video=old_name).update(video=new_name)
+        # save() already added one reference to the new blob.
+        if moved:
+            storage.retain(new_name, moved - 1)
+        else:
+            storage.release(new_name)
+    if blob_digest(old_name) is None:
+        storage.delete(old_name)
+    else:
+        storage.release(old_name, moved, replaced_by=new_name)
+    return new_name
@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from coachingsite.thumbnails import thumbnail_names
+
+register = template.Library()
+
+MIME_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+
+
+@register.inclusion_tag('site/avatar.html')
+def avatar(user, size=36, css_class=''):
+    """Render ``user``'s profile picture at ``size`` CSS pixels, or their initial.
+
+    The browser picks the smallest thumbnail that is sharp at the screen's
+    pixel density from ``srcset``, so avatars never download the original.
+    """
+    context = {'user': user, 'size': size, 'css_class': css_class}
+    picture = user.profile.profile_picture
+    if not picture:
+        return context
+
+    formats = thumbnail_names(picture.name)
+    srcsets = {
+        extension: ', '.join(f'{default_storage.url(name)} {width}w' for width, name in names)
+        for extension, names in formats.items()
+    }
+    fallback = 'jpg'
+    context['sources'] = [
+        {'type': MIME_TYPES[extension], 'srcset': srcset}
+        for extension, srcset in srcsets.items() if extension != fallback
+    ]
+    context['srcset'] = srcsets[fallback]
+    context['src'] = default_storage.url(formats[fallback][0][1])
+    return context
@@ -1,8 +1,54 @@
+import asyncio
+import base64
+import difflib
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Avg, Count, Max, Min
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from myproject.metrics import UPLOAD_BYTES, ValueStore, reset_store
+from myproject.middleware import LoginRequiredMiddleware, compile_login_exemptions
+from myproject.profiling import read_profile, write_profile
+from myproject.timing import SlowRequest, SlowRequestLog, slow_requests
+from PIL import Image
 
-from .models import Profile, Conversation, Message, Response, RoundResult
+from . import views
+from .backends import CachedModelBackend
+from .events import conversation_channel, hub
+from .jobs import Worker, run_pending, task
+from .models import Profile, Conversation, ConversationQuerySet, CourseStats, Job, Message, ReadCursor, Response, RoundResult, UploadSession, VideoBlob
+from .mp4 import STCO_MAX_OFFSET, faststart, iter_boxes, iter_top_level_boxes, read_metadata, read_moov
+from .queryplans import SEED, collect_problems, compare, describe, explain, load_baseline, normalize_sql, plan_problems
+from .seeding import seed_site
+from .sitewalk import seeded_conversation
+from .reports import NO_COURSE, build_progress_report, downsample_lttb, filter_by_course
+from .unread import mark_read
+from .usercache import cached_user, invalidate_cached_user
 
 
 def create_user(username: str, role: str = Profile.ATHLETE) -> User:
@@ -12,6 +58,67 @@ def create_user(username: str, role: str = Profile.ATHLETE) -> User:
 	return nuser
 
 
+JOB_CALLS = []
+
+
+@task()
+def record_job_call(value):
+	JOB_CALLS.append(value)
+
+
+@task(max_attempts=2)
+def failing_job():
+	raise RuntimeError('boom')
+
+
+def mp4_box(kind: bytes, payload: bytes) -> bytes:
+	return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def make_mp4(
+	frames=480, timescale=24000, frame_delta=100, width=1920, height=1080, rotated=False, faststart=False, mdat_size=1024,
+	trailing_mdat=False, wide_moov_header=False,
+):
+	"""Build a minimal MP4 with an audio track and a video track.
+
+	Each track has a chunk offset table pointing at four chunks in mdat,
+	whose payload is a repeating byte pattern. With ``trailing_mdat`` a
+	copy of mdat follows moov and the video chunks are in that copy.
+	``wide_moov_header`` gives moov a 64-bit size header.
+	"""
+	duration = frames * frame_delta
+	matrix = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000) if rotated else (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+	def trak(handler, sample_count, delta, size, chunks):
+		tkhd = struct.pack('>I5I8x4H9i2I', 0, 0, 0, 1, 0, duration, 0, 0, 0, 0, *matrix, size[0] << 16, size[1] << 16)
+		mdhd = struct.pack('>I4I4x', 0, 0, 0, timescale, duration)
+		hdlr = struct.pack('>II4s12x', 0, 0, handler) + b'\0'
+		stts = struct.pack('>II2I', 0, 1, sample_count, delta)
+		stco = struct.pack(f'>II{len(chunks)}I', 0, len(chunks), *chunks)
+		stbl = mp4_box(b'stbl', mp4_box(b'stts', stts) + mp4_box(b'stco', stco))
+		mdia = mp4_box(b'mdhd', mdhd) + mp4_box(b'hdlr', hdlr) + mp4_box(b'minf', stbl)
+		return mp4_box(b'trak', mp4_box(b'tkhd', tkhd) + mp4_box(b'mdia', mdia))
+
+	def moov(mdat_offset, video_mdat_offset=None):
+		step = mdat_size // 8
+		video_mdat_offset = mdat_offset if video_mdat_offset is None else video_mdat_offset
+		audio = [mdat_offset + 8 + step * i for i in range(0, 8, 2)]
+		video = [video_mdat_offset + 8 + step * i for i in range(1, 8, 2)]
+		mvhd = struct.pack('>I4I80x', 0, 0, 0, timescale, duration)
+		payload = mp4_box(b'mvhd', mvhd) + trak(b'soun', frames // 2, frame_delta * 2, (0, 0), audio) + trak(b'vide', frames, frame_delta, (width, height), video)
+		if wide_moov_header:
+			return struct.pack('>I4sQ', 1, b'moov', 16 + len(payload)) + payload
+		return mp4_box(b'moov', payload)
+
+	ftyp = mp4_box(b'ftyp', b'isom\0\0\0\0isomavc1')
+	mdat = mp4_box(b'mdat', bytes(i % 251 for i in range(mdat_size)))
+	if faststart:
+		return ftyp + moov(len(ftyp) + len(moov(0))) + mdat
+	if trailing_mdat:
+		return ftyp + mdat + moov(len(ftyp), len(ftyp) + len(mdat) + len(moov(0))) + mdat
+	return ftyp + mdat + moov(len(ftyp))
+
+
 class ProfileModelTests(TestCase):
 	def test_profile_created_with_default_role(self):
 		user = User.objects.create_user(username='athlete', password='pass1234')
@@ -106,6 +213,24 @@ class SubmitMessageViewTests(TestCase):
 		self.assertIsNotNone(message.conversation)
 		self.assertEqual(message.conversation.coach, self.coach)
 
+	def test_submissions_and_starts_share_one_conversation(self):
+		self.client.force_login(self.athlete)
+		self.client.post(reverse('coachingsite:start_conversation', args=[self.coach.pk]))
+		for text in ('first', 'second'):
+			self.client.post(reverse('coachingsite:submit'), {'text': text, 'coach': self.coach.id})
+		conversation = Conversation.objects.get()
+		self.assertEqual(conversation.messages.count(), 2)
+		self.assertEqual(Conversation.objects.between(self.athlete, self.coach), conversation)
+
+		# a request that lost the race to insert gets the winner's row
+		lookups = [Conversation.DoesNotExist, conversation]
+		with mock.patch.object(ConversationQuerySet, 'get', side_effect=lookups) as get:
+			self.assertEqual(Conversation.objects.between(self.athlete, self.coach), conversation)
+		self.assertEqual(get.call_count, 2)
+		self.assertEqual(Conversation.objects.count(), 1)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+
 
 class ConversationDetailViewTests(TestCase):
 	def setUp(self):
@@ -133,3 +258,1578 @@ class ConversationDetailViewTests(TestCase):
 		message = self.conversation.messages.first()
 		self.assertEqual(message.text, 'New update')
 		self.assertEqual(message.sender, self.athlete)
+
+
+class CourseStatsTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('stats-athlete')
+
+	def add_round(self, course, score):
+		return RoundResult.objects.create(athlete=self.athlete, course_name=course, score_relative=score)
+
+	def assertStatsMatchRounds(self):
+		expected = {
+			(group['course_name'], False): (group['rounds'], group['avg'], group['best'], group['worst'])
+			for group in RoundResult.objects.filter(athlete=self.athlete).values('course_name').annotate(
+				rounds=Count('id'), avg=Avg('score_relative'), best=Min('score_relative'), worst=Max('score_relative'),
+			)
+		}
+		total = RoundResult.objects.filter(athlete=self.athlete).aggregate(
+			rounds=Count('id'), avg=Avg('score_relative'), best=Min('score_relative'), worst=Max('score_relative'),
+		)
+		if total['rounds']:
+			expected[('', True)] = (total['rounds'], total['avg'], total['best'], total['worst'])
+		actual = {
+			(row.course_name, row.is_total): (row.rounds, row.avg_score, row.best, row.worst)
+			for row in CourseStats.objects.filter(athlete=self.athlete)
+		}
+		self.assertEqual(actual, expected)
+
+	def test_stats_follow_creates_edits_and_deletes(self):
+		low = self.add_round('Local Park', -3)
+		self.add_round('Local Park', 2)
+		high = self.add_round('Hilltop', 6)
+		self.add_round('', 0)
+		self.assertStatsMatchRounds()
+
+		low.score_relative = 1
+		low.save()
+		self.assertStatsMatchRounds()
+
+		high.course_name = 'Local Park'
+		high.save()
+		self.assertStatsMatchRounds()
+
+		high.delete()
+		self.assertStatsMatchRounds()
+
+		RoundResult.objects.filter(athlete=self.athlete).delete()
+		self.assertFalse(CourseStats.objects.filter(athlete=self.athlete).exists())
+
+	def test_rebuild_command_restores_stats(self):
+		self.add_round('Local Park', -1)
+		self.add_round('Hilltop', 4)
+		CourseStats.objects.all().delete()
+		call_command('rebuild_round_stats', stdout=StringIO())
+		self.assertStatsMatchRounds()
+
+
+class ProgressReportTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('report-athlete')
+		other = create_user('report-other')
+		rounds = [
+			('Local Park', -2, '2024-03-01'), ('Local Park', 4, '2024-03-05'), ('Hilltop', 1, '2024-02-11'),
+			('', 3, '2024-04-01'), ('hilltop', -5, '2024-04-02'), ('Local Park', 0, '2024-03-05'),
+		]
+		for course, score, played_on in rounds:
+			RoundResult.objects.create(athlete=self.athlete, course_name=course, score_relative=score, played_on=played_on)
+		RoundResult.objects.create(athlete=other, course_name='Local Park', score_relative=9)
+
+	def test_report_matches_orm_aggregates(self):
+		rounds_qs = RoundResult.objects.filter(athlete=self.athlete)
+		groups = list(rounds_qs.values('course_name').annotate(
+			total_rounds=Count('id'), avg_score=Avg('score_relative'), best=Min('score_relative'), worst=Max('score_relative'),
+		).order_by('course_name'))
+		suggestions = sorted(
+			rounds_qs.exclude(course_name='').order_by('course_name').values_list('course_name', flat=True).distinct(),
+			key=lambda name: name.lower(),
+		)
+
+		for course_filter in ('', 'Local Park', 'Hilltop', NO_COURSE, 'Nowhere'):
+			with self.subTest(course=course_filter):
+				with self.assertNumQueries(1):
+					report = build_progress_report(self.athlete, course_filter)
+				filtered_qs = filter_by_course(rounds_qs, course_filter)
+				self.assertEqual(
+					[(c.course_name, c.rounds, c.avg_score, c.best, c.worst) for c in report.courses],
+					[(g['course_name'], g['total_rounds'], g['avg_score'], g['best'], g['worst']) for g in groups],
+				)
+				self.assertEqual(report.filtered.as_aggregate(), filtered_qs.aggregate(
+					avg_score=Avg('score_relative'), best=Min('score_relative'), worst=Max('score_relative'),
+				))
+				self.assertEqual(report.filtered.rounds, filtered_qs.count())
+				self.assertEqual(report.overall.rounds, rounds_qs.count())
+				self.assertEqual(report.course_suggestions, suggestions)
+				self.assertEqual(
+					[row.id for row in report.entries],
+					list(filtered_qs.order_by('-played_on', '-created_at', '-id').values_list('id', flat=True)),
+				)
+				self.assertEqual(
+					[point['score'] for point in report.chart_points],
+					list(filtered_qs.order_by('played_on', 'created_at', 'id').values_list('score_relative', flat=True)),
+				)
+
+	def test_report_agrees_with_course_stats(self):
+		report = build_progress_report(self.athlete)
+		stats = {row.course_name: row for row in CourseStats.objects.filter(athlete=self.athlete, is_total=False)}
+		self.assertEqual(
+			[(c.course_name, c.rounds, c.avg_score, c.best, c.worst) for c in report.courses],
+			[(name, row.rounds, row.avg_score, row.best, row.worst) for name, row in sorted(stats.items())],
+		)
+		total = CourseStats.objects.get(athlete=self.athlete, is_total=True)
+		self.assertEqual(report.overall.as_aggregate(), {'avg_score': total.avg_score, 'best': total.best, 'worst': total.worst})
+
+	def test_report_without_athlete_is_empty(self):
+		with self.assertNumQueries(0):
+			report = build_progress_report(None)
+		self.assertEqual(report.filtered.as_aggregate(), {'avg_score': None, 'best': None, 'worst': None})
+		self.assertEqual(report.entries, [])
+
+
+class ProgressViewTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('progress-athlete')
+		for course, score in (('Local Park', -2), ('Local Park', 4), ('Hilltop', 1), ('', 3)):
+			RoundResult.objects.create(athlete=self.athlete, course_name=course, score_relative=score)
+		self.client.force_login(self.athlete)
+
+	def test_summaries_for_all_courses(self):
+		response = self.client.get(reverse('coachingsite:progress'))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.context['round_count'], 4)
+		self.assertEqual(response.context['overall_round_count'], 4)
+		self.assertEqual(response.context['aggregate'], {'avg_score': 1.5, 'best': -2, 'worst': 4})
+		self.assertEqual(response.context['course_suggestions'], ['Hilltop', 'Local Park'])
+		self.assertEqual(
+			[(option['value'], option['count']) for option in response.context['course_options']],
+			[('__none', 1), ('Hilltop', 1), ('Local Park', 2)],
+		)
+
+	def test_summaries_for_filtered_course(self):
+		response = self.client.get(reverse('coachingsite:progress'), {'course': 'Local Park'})
+		self.assertEqual(response.context['round_count'], 2)
+		self.assertEqual(response.context['overall_round_count'], 4)
+		self.assertEqual(response.context['aggregate'], {'avg_score': 1.0, 'best': -2, 'worst': 4})
+
+		response = self.client.get(reverse('coachingsite:progress'), {'course': '__none'})
+		self.assertEqual(response.context['round_count'], 1)
+		self.assertEqual(response.context['selected_course_label'], 'Unspecified course')
+
+
+class RoundHistoryPaginationTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('history-athlete')
+		self.coach = create_user('history-coach', role=Profile.COACH)
+		courses = ['Local Park', '', 'Hilltop']
+		for index in range(60):
+			RoundResult.objects.create(
+				athlete=self.athlete,
+				course_name=courses[index % 3],
+				score_relative=index % 7 - 3,
+				played_on=f'2024-01-{index % 20 + 1:02d}',
+			)
+
+	def collect_pages(self, course=''):
+		response = self.client.get(reverse('coachingsite:progress'), {'course': course})
+		ids = [entry.id for entry in response.context['entries']]
+		cursor = response.context['next_cursor']
+		while cursor:
+			with CaptureQueriesContext(connection) as queries:
+				page = self.client.get(reverse('coachingsite:progress_rounds'), {
+					'course': course, 'cursor': cursor, 'athlete': self.athlete.id,
+				})
+			self.assertEqual(page.status_code, 200)
+			self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+			data = page.json()
+			ids += [int(pk) for pk in re.findall(r'data-round="(\d+)"', data['html'])]
+			cursor = data['next_cursor']
+		return ids
+
+	def test_pages_cover_history_in_order(self):
+		self.client.force_login(self.athlete)
+		for course in ('', 'Local Park', NO_COURSE):
+			with self.subTest(course=course):
+				expected = filter_by_course(RoundResult.objects.filter(athlete=self.athlete), course)
+				expected = list(expected.order_by('-played_on', '-created_at', 'id').values_list('id', flat=True))
+				self.assertEqual(self.collect_pages(course), expected)
+
+	def test_coach_pages_selected_athlete(self):
+		self.client.force_login(self.coach)
+		self.assertEqual(len(self.collect_pages()), 60)
+
+	def test_invalid_cursor_is_rejected(self):
+		self.client.force_login(self.athlete)
+		response = self.client.get(reverse('coachingsite:progress_rounds'), {'cursor': 'not-a-cursor'})
+		self.assertEqual(response.status_code, 400)
+
+	def test_cursors_with_values_of_the_wrong_type_are_rejected(self):
+		self.client.force_login(self.athlete)
+		for values in ([[1], 5], [{'a': 1}, 5], [None, 5], [True, [2]]):
+			cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+			with self.subTest(values=values):
+				self.assertEqual(self.client.get(reverse('coachingsite:inbox'), {'cursor': cursor}).status_code, 400)
+		cursor = base64.urlsafe_b64encode(json.dumps([[1], None, 3]).encode()).decode()
+		self.assertEqual(self.client.get(reverse('coachingsite:progress_rounds'), {'cursor': cursor}).status_code, 400)
+
+
+class ProgressChartTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('chart-athlete')
+		for index in range(40):
+			RoundResult.objects.create(
+				athlete=self.athlete,
+				course_name='Local Park' if index % 2 else 'Hilltop',
+				score_relative=12 if index == 17 else index % 3,
+				played_on=f'2024-02-{index % 28 + 1:02d}',
+			)
+		self.client.force_login(self.athlete)
+		self.url = reverse('coachingsite:progress_chart')
+
+	def test_returns_full_series_in_play_order(self):
+		response = self.client.get(self.url, {'course': 'Local Park'})
+		self.assertEqual(response.status_code, 200)
+		data = response.json()
+		self.assertEqual(data['total'], 20)
+		self.assertEqual(data['label'], 'Local Park')
+		dates = [point['date'] for point in data['points']]
+		self.assertEqual(dates, sorted(dates))
+
+	def test_downsampling_keeps_endpoints_and_spikes(self):
+		full = self.client.get(self.url).json()['points']
+		sampled = self.client.get(self.url, {'max_points': 10}).json()['points']
+		self.assertEqual(len(sampled), 10)
+		self.assertEqual(sampled[0], full[0])
+		self.assertEqual(sampled[-1], full[-1])
+		self.assertIn(12, [point['score'] for point in sampled])
+		self.assertEqual(downsample_lttb(full, 100), full)
+
+	def test_invalid_max_points(self):
+		self.assertEqual(self.client.get(self.url, {'max_points': 'lots'}).status_code, 400)
+		self.assertEqual(self.client.get(self.url, {'max_points': 2}).status_code, 400)
+
+	def test_conditional_requests_revalidate(self):
+		response = self.client.get(self.url)
+		etag = response['ETag']
+		self.assertIn('Last-Modified', response)
+		self.assertIn('no-cache', response['Cache-Control'])
+
+		cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(cached.status_code, 304)
+
+		RoundResult.objects.filter(athlete=self.athlete).first().delete()
+		refreshed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(refreshed.status_code, 200)
+		self.assertNotEqual(refreshed['ETag'], etag)
+		self.assertEqual(refreshed.json()['total'], 39)
+
+	def test_edits_that_keep_the_statistics_change_the_etag(self):
+		etag = self.client.get(self.url)['ETag']
+		round_result = RoundResult.objects.filter(athlete=self.athlete).first()
+		round_result.played_on = '2023-12-31'
+		round_result.notes = 'windy'
+		round_result.save()
+		refreshed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(refreshed.status_code, 200)
+		self.assertEqual(refreshed.json()['points'][0]['date'], '2023-12-31')
+
+
+class InboxViewTests(TestCase):
+	def setUp(self):
+		self.coach = create_user('inbox-coach', role=Profile.COACH)
+		self.athletes = [create_user(f'inbox-athlete-{index}') for index in range(6)]
+		for index, athlete in enumerate(self.athletes):
+			convo = Conversation.objects.create(athlete=athlete, coach=self.coach)
+			Message.objects.create(conversation=convo, sender=self.coach, text='How did it go?')
+			for number in range(index):
+				Message.objects.create(conversation=convo, sender=athlete, text=f'update {number}')
+
+	def test_inbox_renders_in_constant_queries(self):
+		self.client.force_login(self.coach)
+		self.client.get(reverse('coachingsite:inbox'))
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('coachingsite:inbox'))
+		self.assertEqual(response.status_code, 200)
+		baseline = len(queries)
+
+		athlete = create_user('inbox-athlete-extra')
+		Conversation.objects.create(athlete=athlete, coach=self.coach)
+		with self.assertNumQueries(baseline):
+			self.client.get(reverse('coachingsite:inbox'))
+
+	def test_inbox_annotations(self):
+		self.client.force_login(self.coach)
+		response = self.client.get(reverse('coachingsite:inbox'))
+		convos = {convo.athlete.username: convo for convo in response.context['conversations']}
+		self.assertEqual(convos['inbox-athlete-3'].unread_count, 3)
+		self.assertEqual(convos['inbox-athlete-3'].last_message_text, 'update 2')
+		self.assertEqual(convos['inbox-athlete-0'].unread_count, 0)
+		self.assertEqual(convos['inbox-athlete-0'].last_message_text, 'How did it go?')
+
+		self.client.force_login(self.athletes[3])
+		response = self.client.get(reverse('coachingsite:inbox'))
+		self.assertEqual([convo.unread_count for convo in response.context['conversations']], [1])
+
+	def test_inbox_keyset_pages(self):
+		self.client.force_login(self.coach)
+		with mock.patch.object(views, 'INBOX_PAGE_SIZE', 4):
+			first = self.client.get(reverse('coachingsite:inbox'))
+			second = self.client.get(reverse('coachingsite:inbox'), {'cursor': first.context['next_cursor']})
+		seen = [convo.pk for convo in first.context['conversations']] + [convo.pk for convo in second.context['conversations']]
+		expected = list(Conversation.objects.filter(coach=self.coach).order_by('-updated_at', '-id').values_list('pk', flat=True))
+		self.assertEqual(seen, expected)
+		self.assertIsNone(second.context['next_cursor'])
+
+
+class ReadCursorTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.athlete = create_user('reader-athlete')
+		self.coach = create_user('reader-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+		for number in range(3):
+			Message.objects.create(conversation=self.conversation, sender=self.athlete, text=f'clip {number}')
+
+	def unread_badge(self):
+		response = self.client.get(reverse('coachingsite:profile'))
+		match = re.search(r'id="unreadBadge">(\d+)<', response.content.decode())
+		return int(match.group(1)) if match else 0
+
+	def test_viewing_conversation_marks_messages_read(self):
+		self.client.force_login(self.coach)
+		self.assertEqual(self.unread_badge(), 3)
+		self.client.get(reverse('coachingsite:conversation_detail', args=[self.conversation.pk]))
+		self.assertEqual(self.unread_badge(), 0)
+		cursor = ReadCursor.objects.get(conversation=self.conversation, user=self.coach)
+		self.assertEqual(cursor.last_read_message_id, self.conversation.messages.order_by('-id').first().pk)
+
+		Message.objects.create(conversation=self.conversation, sender=self.athlete, text='one more')
+		self.assertEqual(self.unread_badge(), 1)
+
+	def test_own_messages_are_never_unread(self):
+		self.client.force_login(self.athlete)
+		self.assertEqual(self.unread_badge(), 0)
+
+	def test_badge_is_served_from_cache(self):
+		self.client.force_login(self.coach)
+		self.unread_badge()
+		with CaptureQueriesContext(connection) as queries:
+			self.unread_badge()
+		self.assertFalse(any('coachingsite_readcursor' in query['sql'] for query in queries.captured_queries))
+
+	def test_read_cursor_never_moves_backwards(self):
+		newest = self.conversation.messages.order_by('-id').first()
+		mark_read(self.conversation, self.coach)
+		mark_read(self.conversation, self.coach, newest.pk - 2)
+		cursor = ReadCursor.objects.get(conversation=self.conversation, user=self.coach)
+		self.assertEqual(cursor.last_read_message_id, newest.pk)
+
+
+class ConversationThreadTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('paged-athlete')
+		self.coach = create_user('paged-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+		for number in range(70):
+			sender = self.athlete if number % 2 else self.coach
+			Message.objects.create(conversation=self.conversation, sender=sender, text=f'message {number}')
+		Message.objects.create(conversation=self.conversation, sender=self.athlete, text='   ')
+		self.url = reverse('coachingsite:conversation_detail', args=[self.conversation.pk])
+		self.client.force_login(self.athlete)
+
+	def test_has_content_flag(self):
+		blank = Message.objects.get(text='   ')
+		self.assertFalse(blank.has_content)
+		blank.text = 'now with words'
+		blank.save(update_fields=['text'])
+		blank.refresh_from_db()
+		self.assertTrue(blank.has_content)
+
+	def test_newest_page_then_older_history(self):
+		response = self.client.get(self.url)
+		texts = [msg.text for msg in response.context['thread_messages']]
+		self.assertEqual(texts, [f'message {number}' for number in range(40, 70)])
+
+		updates_url = reverse('coachingsite:conversation_updates', args=[self.conversation.pk])
+		self.assertContains(response, f'data-updates-url="{updates_url}"')
+
+		seen = texts
+		cursor = response.context['older_cursor']
+		while cursor:
+			response = self.client.get(self.url, {'before': cursor})
+			# Older pages are not polled, or new messages would be appended to them.
+			self.assertNotContains(response, 'data-updates-url')
+			self.assertNotContains(response, 'data-events-url')
+			seen = [msg.text for msg in response.context['thread_messages']] + seen
+			cursor = response.context['older_cursor']
+		self.assertEqual(seen, [f'message {number}' for number in range(70)])
+
+	def test_updates_return_only_newer_messages(self):
+		response = self.client.get(self.url)
+		last_id = response.context['thread_messages'][-1].pk
+		updates_url = reverse('coachingsite:conversation_updates', args=[self.conversation.pk])
+
+		data = self.client.get(updates_url, {'after': last_id}).json()
+		self.assertEqual(data['ids'], [])
+		self.assertEqual(data['last_id'], last_id)
+
+		reply = Message.objects.create(conversation=self.conversation, sender=self.coach, text='fresh reply')
+		data = self.client.get(updates_url, {'after': last_id}).json()
+		self.assertEqual(data['ids'], [reply.pk])
+		self.assertIn('fresh reply', data['html'])
+		self.assertEqual(self.client.get(updates_url, {'after': 'x'}).status_code, 400)
+
+	def test_outsiders_cannot_fetch_updates(self):
+		self.client.force_login(create_user('paged-outsider'))
+		response = self.client.get(reverse('coachingsite:conversation_updates', args=[self.conversation.pk]))
+		self.assertEqual(response.status_code, 403)
+
+
+class ConversationEventsTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('live-athlete')
+		self.coach = create_user('live-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+		self.url = reverse('coachingsite:conversation_events', args=[self.conversation.pk])
+		self.channel = conversation_channel(self.conversation.pk)
+
+	async def next_frame(self, stream):
+		return (await asyncio.wait_for(anext(stream), timeout=2)).decode()
+
+	async def test_stream_forwards_published_events(self):
+		await self.async_client.aforce_login(self.coach)
+		response = await self.async_client.get(self.url)
+		self.assertEqual(response['Content-Type'], 'text/event-stream')
+		stream = aiter(response.streaming_content)
+		self.assertTrue((await self.next_frame(stream)).startswith('retry:'))
+		self.assertEqual(hub.subscriber_count(self.channel), 1)
+
+		hub.publish(self.channel, {'type': 'message', 'id': 42, 'sender_id': self.athlete.pk})
+		frame = await self.next_frame(stream)
+		self.assertIn('id: 42\n', frame)
+		self.assertIn('event: message\n', frame)
+
+		# ASGI servers cancel the response task when the client disconnects.
+		waiting = asyncio.ensure_future(anext(stream))
+		await asyncio.sleep(0)
+		waiting.cancel()
+		with self.assertRaises(asyncio.CancelledError):
+			await waiting
+		self.assertEqual(hub.subscriber_count(self.channel), 0)
+
+	async def test_reconnect_replays_missed_messages(self):
+		first = await Message.objects.acreate(conversation=self.conversation, sender=self.athlete, text='one')
+		second = await Message.objects.acreate(conversation=self.conversation, sender=self.athlete, text='two')
+		await self.async_client.aforce_login(self.coach)
+		response = await self.async_client.get(self.url, headers={'Last-Event-ID': str(first.pk)})
+		stream = aiter(response.streaming_content)
+		await self.next_frame(stream)
+		self.assertIn(f'id: {second.pk}\n', await self.next_frame(stream))
+
+	async def test_asgi_pages_open_the_stream(self):
+		await self.async_client.aforce_login(self.coach)
+		response = await self.async_client.get(reverse('coachingsite:conversation_detail', args=[self.conversation.pk]))
+		self.assertContains(response, f'data-events-url="{self.url}"')
+
+	def test_wsgi_requests_are_told_not_to_reconnect(self):
+		self.client.force_login(self.coach)
+		response = self.client.get(reverse('coachingsite:conversation_detail', args=[self.conversation.pk]))
+		self.assertContains(response, 'data-updates-url')
+		self.assertNotContains(response, 'data-events-url')
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 204)
+		self.assertFalse(response.streaming)
+		self.assertEqual(hub.subscriber_count(self.channel), 0)
+
+	async def test_outsiders_are_rejected(self):
+		outsider = await User.objects.acreate(username='live-outsider')
+		await self.async_client.aforce_login(outsider)
+		response = await self.async_client.get(self.url)
+		self.assertEqual(response.status_code, 403)
+
+	def test_posting_publishes_after_commit(self):
+		self.client.force_login(self.athlete)
+		url = reverse('coachingsite:conversation_detail', args=[self.conversation.pk])
+		with mock.patch.object(hub, 'publish') as publish:
+			with self.captureOnCommitCallbacks(execute=True):
+				self.client.post(url, {'text': 'live now'})
+		message = self.conversation.messages.get()
+		publish.assert_called_once()
+		channel, event = publish.call_args.args
+		self.assertEqual(channel, self.channel)
+		self.assertEqual((event['type'], event['id']), ('message', message.pk))
+
+
+class ChunkedUploadTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(
+			MEDIA_ROOT=self.media_root,
+			CHUNKED_UPLOAD_DIR=os.path.join(self.media_root, 'sessions'),
+			CHUNKED_UPLOAD_MAX_CHUNK=1024,
+		)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		self.athlete = create_user('upload-athlete')
+		self.coach = create_user('upload-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+		self.client.force_login(self.athlete)
+		self.payload = os.urandom(2500)
+
+	def start(self):
+		response = self.client.post(reverse('coachingsite:upload_create'), {'filename': 'throw.mp4', 'size': len(self.payload)})
+		self.assertEqual(response.status_code, 201)
+		return response.json()['url']
+
+	def send(self, url, offset, chunk, checksum=None):
+		digest = checksum or base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+		return self.client.patch(url, chunk, content_type='application/offset+octet-stream', headers={
+			'Upload-Offset': str(offset),
+			'Upload-Checksum': f'sha256 {digest}',
+		})
+
+	def upload_all(self, url):
+		for offset in range(0, len(self.payload), 1000):
+			response = self.send(url, offset, self.payload[offset:offset + 1000])
+			self.assertEqual(response.status_code, 200)
+		return response
+
+	def test_chunks_resume_and_reject_bad_data(self):
+		url = self.start()
+		self.assertEqual(self.send(url, 0, self.payload[:1000]).status_code, 200)
+
+		bad = base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+		self.assertEqual(self.send(url, 1000, self.payload[1000:2000], checksum=bad).status_code, 460)
+		self.assertEqual(self.send(url, 0, self.payload[:1000]).status_code, 409)
+		self.assertEqual(self.send(url, 1000, self.payload[1000:2100]).status_code, 413)
+
+		head = self.client.head(url)
+		self.assertEqual(head['Upload-Offset'], '1000')
+		self.assertEqual(self.send(url, 1000, self.payload[1000:2000])['Upload-Offset'], '2000')
+		done = self.send(url, 2000, self.payload[2000:])
+		self.assertTrue(done.json()['complete'])
+
+	def test_finalize_attaches_to_message(self):
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, text='see clip')
+		url = self.start()
+		self.upload_all(url)
+		session_id = url.rstrip('/').rsplit('/', 1)[-1]
+		response = self.client.post(reverse('coachingsite:upload_finalize', args=[session_id]), {'message': message.pk})
+		self.assertEqual(response.status_code, 200)
+		message.refresh_from_db()
+		with message.video.open('rb') as stored:
+			self.assertEqual(stored.read(), self.payload)
+		self.assertFalse(UploadSession.objects.exists())
+		self.assertEqual(os.listdir(os.path.join(self.media_root, 'sessions')), [])
+
+	def test_composer_uses_completed_upload(self):
+		url = self.start()
+		session_id = url.rstrip('/').rsplit('/', 1)[-1]
+		detail = reverse('coachingsite:conversation_detail', args=[self.conversation.pk])
+		self.assertEqual(self.client.post(detail, {'text': '', 'upload_session': session_id}).status_code, 400)
+
+		self.upload_all(url)
+		self.assertEqual(self.client.post(detail, {'text': '', 'upload_session': session_id}).status_code, 302)
+		message = self.conversation.messages.get()
+		self.assertTrue(message.has_content)
+		with message.video.open('rb') as stored:
+			self.assertEqual(stored.read(), self.payload)
+
+	def test_abandoned_uploads_are_pruned(self):
+		sessions_dir = os.path.join(self.media_root, 'sessions')
+		abandoned, active = self.start(), self.start()
+		later = timezone.now() + timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY - 60)
+		with mock.patch('django.utils.timezone.now', return_value=later):
+			self.assertEqual(self.send(active, 0, self.payload[:1000]).status_code, 200)
+		stray = os.path.join(sessions_dir, f'{uuid.uuid4()}.part')
+		open(stray, 'wb').close()
+		os.utime(stray, (0, 0))
+
+		out = StringIO()
+		with mock.patch('django.utils.timezone.now', return_value=later + timedelta(seconds=120)):
+			call_command('prune_uploads', stdout=out)
+		self.assertIn('Deleted 1 expired uploads.', out.getvalue())
+		active_id = active.rstrip('/').rsplit('/', 1)[-1]
+		self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [uuid.UUID(active_id)])
+		self.assertEqual(os.listdir(sessions_dir), [f'{active_id}.part'])
+		self.assertEqual(self.client.head(abandoned).status_code, 404)
+
+	def test_sessions_are_private(self):
+		url = self.start()
+		self.client.force_login(self.coach)
+		self.assertEqual(self.client.head(url).status_code, 404)
+
+
+class MediaViewTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_OFFLOAD=None)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		self.athlete = create_user('media-athlete')
+		self.coach = create_user('media-coach', role=Profile.COACH)
+		conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+		self.name = 'uploads/media-athlete/throw.mp4'
+		os.makedirs(os.path.join(self.media_root, 'uploads/media-athlete'))
+		self.payload = os.urandom(1000)
+		with open(os.path.join(self.media_root, self.name), 'wb') as handle:
+			handle.write(self.payload)
+		Message.objects.create(conversation=conversation, sender=self.athlete, video=self.name)
+		self.url = '/media/' + self.name
+		self.client.force_login(self.coach)
+
+	def body(self, response):
+		return b''.join(response.streaming_content)
+
+	def test_full_file_advertises_ranges(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Accept-Ranges'], 'bytes')
+		self.assertEqual(response['Content-Type'], 'video/mp4')
+		self.assertEqual(self.body(response), self.payload)
+
+	def test_range_requests(self):
+		response = self.client.get(self.url, headers={'Range': 'bytes=0-99'})
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(response['Content-Range'], 'bytes 0-99/1000')
+		self.assertEqual(response['Content-Length'], '100')
+		self.assertEqual(self.body(response), self.payload[:100])
+
+		response = self.client.get(self.url, headers={'Range': 'bytes=900-'})
+		self.assertEqual(self.body(response), self.payload[900:])
+		response = self.client.get(self.url, headers={'Range': 'bytes=-50'})
+		self.assertEqual(response['Content-Range'], 'bytes 950-999/1000')
+		self.assertEqual(self.body(response), self.payload[950:])
+
+		response = self.client.get(self.url, headers={'Range': 'bytes=1000-'})
+		self.assertEqual(response.status_code, 416)
+		self.assertEqual(response['Content-Range'], 'bytes */1000')
+
+	def test_conditional_requests(self):
+		etag = self.client.get(self.url)['ETag']
+		self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+		stale = self.client.get(self.url, headers={'Range': 'bytes=0-99', 'If-Range': '"stale"'})
+		self.assertEqual(stale.status_code, 200)
+		self.assertEqual(self.body(stale), self.payload)
+		fresh = self.client.get(self.url, headers={'Range': 'bytes=0-99', 'If-Range': etag})
+		self.assertEqual(fresh.status_code, 206)
+
+	def test_outsiders_and_traversal_get_404(self):
+		self.client.force_login(create_user('media-outsider'))
+		self.assertEqual(self.client.get(self.url).status_code, 404)
+		self.client.force_login(self.athlete)
+		self.assertEqual(self.client.get('/media/../db.sqlite3').status_code, 404)
+		self.assertEqual(self.client.get('/media/uploads/missing.mp4').status_code, 404)
+		self.client.logout()
+		self.assertEqual(self.client.get(self.url).status_code, 302)
+
+	def test_offload_to_proxy(self):
+		with override_settings(MEDIA_OFFLOAD='x-accel-redirect'):
+			response = self.client.get(self.url)
+		self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+		self.assertEqual(response.content, b'')
+		with override_settings(MEDIA_OFFLOAD='x-sendfile'):
+			response = self.client.get(self.url)
+		self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, self.name))
+
+
+class VideoMetadataTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		self.athlete = create_user('fps-athlete')
+		self.coach = create_user('fps-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+
+	def test_reads_moov_without_reading_samples(self):
+		class CountingFile(BytesIO):
+			read_bytes = 0
+
+			def read(self, size=-1):
+				data = super().read(size)
+				self.read_bytes += len(data)
+				return data
+
+		file = CountingFile(make_mp4(mdat_size=4 * 1024 * 1024))
+		metadata = read_metadata(file)
+		self.assertEqual((metadata.fps, metadata.duration, metadata.width, metadata.height), (240.0, 2.0, 1920, 1080))
+		self.assertLess(file.read_bytes, 4096)
+		self.assertEqual(file.tell(), 0)
+
+	def test_rotation_and_fractional_frame_rates(self):
+		metadata = read_metadata(BytesIO(make_mp4(frames=300, timescale=30000, frame_delta=1001, rotated=True, faststart=True)))
+		self.assertEqual(metadata.fps, 29.97)
+		self.assertEqual((metadata.width, metadata.height), (1080, 1920))
+
+	def test_upload_populates_fields(self):
+		clip = SimpleUploadedFile('throw.mp4', make_mp4(frames=120, timescale=12000, frame_delta=100), content_type='video/mp4')
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, video=clip)
+		message.refresh_from_db()
+		self.assertEqual((message.video_fps, message.video_duration), (120.0, 1.0))
+		with message.video.open('rb') as stored:
+			self.assertEqual(stored.read(8)[4:], b'ftyp')
+
+		self.client.force_login(self.coach)
+		response = self.client.get(reverse('coachingsite:conversation_detail', args=[self.conversation.pk]))
+		self.assertContains(response, 'data-fps="120"')
+
+		broken = Response.objects.create(message=message, video=SimpleUploadedFile('notes.mp4', b'not a video'))
+		self.assertIsNone(broken.video_fps)
+
+	def test_backfill_command(self):
+		clip = SimpleUploadedFile('throw.mp4', make_mp4(), content_type='video/mp4')
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, video=clip)
+		Message.objects.update(video_fps=None, video_duration=None, video_width=None, video_height=None)
+		Message.objects.create(conversation=self.conversation, sender=self.athlete, video=SimpleUploadedFile('a.mp4', b'junk'))
+
+		out = StringIO()
+		call_command('backfill_video_metadata', workers=2, stdout=out)
+		message.refresh_from_db()
+		self.assertEqual((message.video_fps, message.video_width, message.video_height), (240.0, 1920, 1080))
+		self.assertIn('messages: 1 updated, 1 without readable metadata', out.getvalue())
+
+
+class FaststartTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+	def chunks(self, path):
+		"""Return the first bytes of every chunk, found through the chunk offset tables."""
+		with open(path, 'rb') as file:
+			moov = read_moov(file)
+			found = []
+
+			def walk(start, end):
+				for box_type, payload_start, payload_end in iter_boxes(moov, start, end):
+					if box_type in (b'trak', b'mdia', b'minf', b'stbl'):
+						walk(payload_start, payload_end)
+					elif box_type in (b'stco', b'co64'):
+						(count,) = struct.unpack_from('>I', moov, payload_start + 4)
+						width = 'I' if box_type == b'stco' else 'Q'
+						for offset in struct.unpack_from(f'>{count}{width}', moov, payload_start + 8):
+							file.seek(offset)
+							found.append(file.read(16))
+
+			walk(0, len(moov))
+			return found
+
+	def layout(self, path):
+		with open(path, 'rb') as file:
+			return [box[0] for box in iter_top_level_boxes(file)]
+
+	def test_moves_moov_and_relocates_chunks(self):
+		path = os.path.join(self.media_root, 'throw.mp4')
+		with open(path, 'wb') as file:
+			file.write(make_mp4(mdat_size=64 * 1024))
+		before = self.chunks(path)
+		self.assertEqual(len(before), 8)
+
+		self.assertTrue(faststart(path))
+		self.assertEqual(self.layout(path), [b'ftyp', b'moov', b'mdat'])
+		self.assertEqual(self.chunks(path), before)
+		with open(path, 'rb') as file:
+			self.assertEqual(read_metadata(file).fps, 240.0)
+
+		with open(path, 'rb') as file:
+			rewritten = file.read()
+		self.assertFalse(faststart(path))
+		with open(path, 'rb') as file:
+			self.assertEqual(file.read(), rewritten)
+		self.assertEqual(os.listdir(self.media_root), ['throw.mp4'])
+
+	def test_relocates_chunks_after_moov_when_its_size_changes(self):
+		cases = {
+			'co64': ({'trailing_mdat': True}, 0),
+			'wide header': ({'trailing_mdat': True, 'wide_moov_header': True}, STCO_MAX_OFFSET),
+		}
+		for name, (options, limit) in cases.items():
+			with self.subTest(name):
+				path = os.path.join(self.media_root, 'throw.mp4')
+				with open(path, 'wb') as file:
+					file.write(make_mp4(mdat_size=64 * 1024, **options))
+				before = self.chunks(path)
+				self.assertEqual(len(before), 8)
+
+				# A zero limit widens every stco table to co64, as offsets past 4 GB would.
+				with mock.patch('coachingsite.mp4.STCO_MAX_OFFSET', limit):
+					self.assertTrue(faststart(path))
+				self.assertEqual(self.layout(path), [b'ftyp', b'moov', b'mdat', b'mdat'])
+				self.assertEqual(self.chunks(path), before)
+
+	def test_uploads_are_rewritten_after_commit(self):
+		athlete = create_user('faststart-athlete')
+		clip = SimpleUploadedFile('throw.mp4', make_mp4(), content_type='video/mp4')
+		message = Message.objects.create(sender=athlete, video=clip)
+		self.assertEqual(Job.objects.get().task, 'coachingsite.pipeline.faststart_video')
+		self.assertEqual(run_pending(), 1)
+		uploaded = message.video.path
+		message.refresh_from_db()
+		# Blobs are immutable, so the rewrite is stored as a new blob.
+		self.assertNotEqual(message.video.path, uploaded)
+		self.assertFalse(os.path.exists(uploaded))
+		self.assertEqual(self.layout(message.video.path), [b'ftyp', b'moov', b'mdat'])
+
+		message.text = 'edited'
+		message.save()
+		self.assertEqual(run_pending(), 0)
+
+
+class DedupStorageTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		self.athlete = create_user('dedup-athlete')
+		self.coach = create_user('dedup-coach', role=Profile.COACH)
+		self.conversation = Conversation.objects.create(athlete=self.athlete, coach=self.coach)
+
+	def blob_files(self):
+		found = []
+		for root, dirs, files in os.walk(os.path.join(self.media_root, 'blobs')):
+			dirs[:] = [name for name in dirs if not name.startswith('.')]
+			found.extend(name for name in files if not name.startswith('.'))
+		return found
+
+	def test_identical_uploads_share_one_counted_blob(self):
+		data = b'the same throw ' * 1000
+		first = Message.objects.create(conversation=self.conversation, sender=self.athlete, video=SimpleUploadedFile('a.mp4', data))
+		second = Message.objects.create(sender=self.athlete, video=SimpleUploadedFile('b.MP4', data))
+		echo = Response.objects.create(message=first, video=SimpleUploadedFile('c.mp4', data))
+
+		digest = hashlib.sha256(data).hexdigest()
+		self.assertEqual(first.video.name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.mp4')
+		self.assertEqual({second.video.name, echo.video.name}, {first.video.name})
+		self.assertEqual(len(self.blob_files()), 1)
+		self.assertEqual(VideoBlob.objects.get().refcount, 3)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertEqual(VideoBlob.objects.get().refcount, 2)
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertFalse(VideoBlob.objects.exists())
+		self.assertEqual(self.blob_files(), [])
+
+	def test_replacing_a_video_releases_the_old_blob(self):
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, video=SimpleUploadedFile('a.mp4', b'first throw'))
+		old_name = message.video.name
+		message.video = SimpleUploadedFile('b.mp4', b'second throw')
+		with self.captureOnCommitCallbacks(execute=True):
+			message.save()
+		self.assertEqual(list(VideoBlob.objects.values_list('name', 'refcount')), [(message.video.name, 1)])
+		self.assertEqual(len(self.blob_files()), 1)
+
+		message.text = 'same video'
+		with self.captureOnCommitCallbacks(execute=True):
+			message.save()
+		self.assertEqual(VideoBlob.objects.get().refcount, 1)
+		self.assertNotEqual(old_name, message.video.name)
+
+	def test_failed_saves_do_not_keep_a_reference(self):
+		with mock.patch.object(Message, '_do_insert', side_effect=IntegrityError('rejected')):
+			with self.assertRaises(IntegrityError):
+				Message.objects.create(sender=self.athlete, video=SimpleUploadedFile('a.mp4', b'lost throw'))
+		self.assertFalse(VideoBlob.objects.exists())
+
+	def test_blobs_are_served_immutably_and_old_names_redirect(self):
+		clip = SimpleUploadedFile('throw.mp4', make_mp4(), content_type='video/mp4')
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, video=clip)
+		run_pending()
+		uploaded = message.video.name
+		message.refresh_from_db()
+		self.assertEqual(VideoBlob.objects.get(name=uploaded).replaced_by, message.video.name)
+
+		self.client.force_login(self.coach)
+		response = self.client.get('/media/' + uploaded)
+		self.assertRedirects(response, '/media/' + message.video.name, status_code=301, fetch_redirect_response=False)
+		response = self.client.get('/media/' + message.video.name)
+		self.assertEqual(response['ETag'], '"%s"' % message.video.name.rsplit('/', 1)[-1].split('.')[0])
+		self.assertIn('immutable', response['Cache-Control'])
+		self.assertEqual(b''.join(response.streaming_content)[4:12], b'ftypisom')
+
+		self.client.force_login(create_user('dedup-outsider'))
+		self.assertEqual(self.client.get('/media/' + uploaded).status_code, 404)
+
+	def test_dedup_media_moves_existing_files(self):
+		os.makedirs(os.path.join(self.media_root, 'uploads/2024/05/01'))
+		os.makedirs(os.path.join(self.media_root, 'responses/2024/05/02'))
+		for name in ('uploads/2024/05/01/throw.mp4', 'responses/2024/05/02/throw_copy.mp4'):
+			with open(os.path.join(self.media_root, name), 'wb') as handle:
+				handle.write(b'x' * 4096)
+		message = Message.objects.create(conversation=self.conversation, sender=self.athlete, video='uploads/2024/05/01/throw.mp4')
+		response = Response.objects.create(message=message, video='responses/2024/05/02/throw_copy.mp4')
+
+		out = StringIO()
+		call_command('dedup_media', dry_run=True, stdout=out)
+		self.assertIn('Would move 2 files into the blob store; 1 were duplicates', out.getvalue())
+		self.assertFalse(VideoBlob.objects.exists())
+
+		out = StringIO()
+		call_command('dedup_media', stdout=out)
+		self.assertIn('Moved 2 files into the blob store; 1 were duplicates', out.getvalue())
+		message.refresh_from_db()
+		response.refresh_from_db()
+		self.assertEqual(message.video.name, response.video.name)
+		self.assertEqual(VideoBlob.objects.get().refcount, 2)
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, 'uploads/2024/05/01/throw.mp4')))
+		with message.video.open('rb') as stored:
+			self.assertEqual(stored.read(), b'x' * 4096)
+
+
+class ProfileThumbnailTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		self.athlete = create_user('thumb-athlete')
+
+	def picture(self, color, name='me.png'):
+		buffer = BytesIO()
+		Image.new('RGB', (1200, 800), color).save(buffer, 'PNG')
+		return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+	def thumbnail(self, picture_name, size, extension):
+		return os.path.join(self.media_root, 'thumbnails', picture_name, f'{size}.{extension}')
+
+	def test_saving_the_form_writes_and_replaces_thumbnails(self):
+		self.client.force_login(self.athlete)
+		url = reverse('coachingsite:edit_profile')
+		self.client.post(url, {'full_name': 'Thumb', 'bio': '', 'profile_picture': self.picture('red')})
+		self.assertEqual(run_pending(), 1)
+		first = Profile.objects.get(user=self.athlete).profile_picture.name
+		for size in (48, 96, 256):
+			for extension in ('webp', 'jpg'):
+				with Image.open(self.thumbnail(first, size, extension)) as image:
+					self.assertEqual(image.size, (size, size))
+
+		self.client.post(url, {'full_name': 'Thumb', 'bio': '', 'profile_picture': self.picture('blue')})
+		run_pending()
+		second = Profile.objects.get(user=self.athlete).profile_picture.name
+		self.assertNotEqual(first, second)
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, 'thumbnails', first)))
+		self.assertTrue(os.path.exists(self.thumbnail(second, 48, 'webp')))
+
+	def test_missing_thumbnails_are_generated_on_first_request(self):
+		profile = self.athlete.profile
+		profile.profile_picture = self.picture('green')
+		profile.save()
+		name = profile.profile_picture.name
+		self.assertFalse(os.path.exists(self.thumbnail(name, 96, 'webp')))
+
+		self.client.force_login(create_user('thumb-viewer'))
+		response = self.client.get(f'/media/thumbnails/{name}/96.webp')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'image/webp')
+		self.assertTrue(os.path.exists(self.thumbnail(name, 48, 'jpg')))
+		self.assertEqual(self.client.get(f'/media/thumbnails/{name}/100.webp').status_code, 404)
+
+	def test_dashboard_cards_use_small_thumbnails(self):
+		profile = self.athlete.profile
+		profile.profile_picture = self.picture('green')
+		profile.save()
+		create_user('thumb-athlete-2')
+		coach = create_user('thumb-coach', role=Profile.COACH)
+		self.client.force_login(coach)
+		# user with profile (the session is cached), unread badge, then one query for every card
+		with self.assertNumQueries(3):
+			response = self.client.get(reverse('coachingsite:home'))
+		self.assertContains(response, f'/media/thumbnails/{profile.profile_picture.name}/48.webp 48w')
+		self.assertContains(response, 'sizes="36px"')
+		self.assertNotContains(response, f'src="/media/{profile.profile_picture.name}"')
+
+
+class JobQueueTests(TestCase):
+	def setUp(self):
+		JOB_CALLS.clear()
+
+	def test_enqueued_jobs_run_once(self):
+		job = record_job_call.enqueue(value=3)
+		self.assertEqual((job.task, job.status), ('coachingsite.tests.record_job_call', Job.QUEUED))
+		self.assertEqual(run_pending(), 1)
+		self.assertEqual(run_pending(), 0)
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+		self.assertEqual(JOB_CALLS, [3])
+
+	def test_failures_back_off_then_give_up(self):
+		job = failing_job.enqueue()
+		with self.assertLogs('coachingsite.jobs', 'WARNING'):
+			run_pending()
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+		self.assertIn('RuntimeError: boom', job.last_error)
+		self.assertGreater(job.run_at, timezone.now())
+		self.assertEqual(run_pending(), 0)
+
+		Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+		with self.assertLogs('coachingsite.jobs', 'WARNING'):
+			run_pending()
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+	def test_expired_leases_are_reclaimed(self):
+		stale = timezone.now() - timedelta(seconds=1)
+		job = record_job_call.enqueue(value=1)
+		Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, locked_by='dead', locked_until=stale, attempts=1)
+		exhausted = record_job_call.enqueue(value=2)
+		Job.objects.filter(pk=exhausted.pk).update(status=Job.RUNNING, locked_by='dead', locked_until=stale, attempts=5)
+
+		first, second = Worker(worker_id='first'), Worker(worker_id='second')
+		self.assertEqual([claimed.pk for claimed in first.claim(10)], [job.pk])
+		self.assertEqual(second.claim(10), [])
+		exhausted.refresh_from_db()
+		self.assertEqual(exhausted.status, Job.FAILED)
+
+		# The first worker's result is ignored once another worker holds the lease.
+		Job.objects.filter(pk=job.pk).update(locked_by='second')
+		first.finish(Job.objects.get(pk=job.pk))
+		self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+	def test_jobs_roll_back_with_the_request(self):
+		try:
+			with transaction.atomic():
+				record_job_call.enqueue(value=1)
+				raise RuntimeError
+		except RuntimeError:
+			pass
+		self.assertFalse(Job.objects.exists())
+
+
+def query_shapes(queries):
+	return [normalize_sql(query['sql']) for query in queries]
+
+
+class QueryBudgetTests(TestCase):
+	"""Each page must cost a fixed number of queries however much data there is.
+
+	Every view is requested once by a user with almost no data and once by a
+	user of a large seeded site. Both must run the same statements, within
+	the view's budget. A failure shows the difference between the two.
+	"""
+
+	BUDGETS = {
+		'home': 2,
+		'inbox': 2,
+		'conversation_detail': 5,
+		'conversation_detail_first_visit': 11,
+		'conversation_detail_revisit': 7,
+		'conversation_updates': 7,
+		'progress': 3,
+		'progress_for_coach': 5,
+		'progress_rounds': 2,
+		'progress_chart': 3,
+	}
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.small = seed_site(athletes=1, coaches=1, rounds_per_athlete=3, messages_per_conversation=2, prefix='small')
+		cls.large = seed_site(athletes=300, coaches=5, rounds_per_athlete=20, messages_per_conversation=40, prefix='large')
+
+	def capture(self, user, url, params=None):
+		self.client.force_login(user)
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url, params or {})
+		self.assertEqual(response.status_code, 200)
+		return queries.captured_queries
+
+	def assertWithinBudget(self, budget, small, large):
+		small_shapes, large_shapes = query_shapes(small), query_shapes(large)
+		if small_shapes == large_shapes and len(large) <= self.BUDGETS[budget]:
+			return
+		# Without a difference between the sites the whole over-budget list is shown.
+		lines = difflib.unified_diff(small_shapes, large_shapes, 'small site', 'large site', lineterm='')
+		detail = '\n'.join(lines) or '\n'.join(large_shapes)
+		self.fail(
+			f'{budget}: {len(small)} queries on the small site, {len(large)} on the large site, '
+			f'budget {self.BUDGETS[budget]}\n{detail}'
+		)
+
+	def compare(self, budget, view, small_user, large_user, args=((), ()), params=(None, None)):
+		"""Request ``view`` as both users; ``args`` and ``params`` are (small, large) pairs."""
+		small = self.capture(small_user, reverse(f'coachingsite:{view}', args=args[0]), params[0])
+		large = self.capture(large_user, reverse(f'coachingsite:{view}', args=args[1]), params[1])
+		self.assertWithinBudget(budget, small, large)
+
+	def test_dashboards(self):
+		self.compare('home', 'home', self.small.coaches[0], self.large.coaches[0])
+		self.compare('home', 'home', self.small.athletes[0], self.large.athletes[0])
+
+	def test_inbox(self):
+		self.compare('inbox', 'inbox', self.small.coaches[0], self.large.coaches[0])
+		self.compare('inbox', 'inbox', self.small.athletes[0], self.large.athletes[0])
+
+	def test_conversations(self):
+		small, large = self.small.conversations[0], self.large.conversations[0]
+		threads = ([small.pk], [large.pk])
+		self.compare('conversation_detail', 'conversation_detail', small.coach, large.coach, threads)
+		# the athlete has no read cursor yet, so the first visit creates one
+		self.compare('conversation_detail_first_visit', 'conversation_detail', small.athlete, large.athlete, threads)
+		self.compare('conversation_detail_revisit', 'conversation_detail', small.athlete, large.athlete, threads)
+		self.compare('conversation_updates', 'conversation_updates', small.coach, large.coach, threads, ({'after': 1},) * 2)
+
+	def test_progress(self):
+		small, large = self.small.athletes[0], self.large.athletes[0]
+		self.compare('progress', 'progress', small, large)
+		self.compare('progress_rounds', 'progress_rounds', small, large)
+		self.compare('progress_chart', 'progress_chart', small, large)
+		self.compare(
+			'progress_for_coach', 'progress', self.small.coaches[0], self.large.coaches[0],
+			params=({'athlete': small.pk}, {'athlete': large.pk}),
+		)
+
+	def test_failures_show_the_extra_queries(self):
+		small = [{'sql': 'SELECT "id" FROM "conversation" WHERE "coach_id" = 1'}]
+		large = small + [{'sql': f'SELECT "name" FROM "profile" WHERE "user_id" = {pk}'} for pk in (7, 8)]
+		with self.assertRaises(AssertionError) as failure:
+			self.assertWithinBudget('inbox', small, large)
+		self.assertIn('+SELECT "name" FROM "profile" WHERE "user_id" = ?', str(failure.exception))
+
+
+class BenchmarkCommandTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(
+			MEDIA_ROOT=self.media_root,
+			CHUNKED_UPLOAD_DIR=os.path.join(self.media_root, 'sessions'),
+		)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+	def seed(self, **options):
+		call_command('seed_data', athletes=4, coaches=2, rounds=3, messages=4, responses=1, stdout=StringIO(), **options)
+		return list(RoundResult.objects.order_by('pk').values_list('athlete__username', 'course_name', 'score_relative'))
+
+	def test_seeding_is_deterministic_and_replaceable(self):
+		rounds = self.seed()
+		self.assertEqual((User.objects.count(), Message.objects.count(), Response.objects.count()), (6, 16, 4))
+		self.assertEqual(CourseStats.objects.filter(is_total=True).count(), 4)
+		with self.assertRaises(CommandError):
+			self.seed()
+		self.assertEqual(self.seed(replace=True), rounds)
+		self.assertEqual((User.objects.count(), Message.objects.count()), (6, 16))
+
+	def test_benchmark_reports_every_url(self):
+		self.seed()
+		out = StringIO()
+		call_command('benchmark_views', requests=2, warmup=0, json=True, stdout=out)
+		report = json.loads(out.getvalue())
+		views = {result['view'] for result in report['results']}
+		self.assertTrue({'home', 'inbox', 'conversation_detail', 'progress', 'upload_detail'} <= views)
+		self.assertEqual(set(report['skipped']), {'conversation_events', 'upload_create', 'upload_finalize'})
+		for result in report['results']:
+			self.assertLess(result['status'], 400, result['view'])
+			self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+			# With the session and user cached, pages like upload_detail need no queries at all.
+			if result['view'] in ('home', 'inbox', 'conversation_detail', 'progress'):
+				self.assertGreater(result['queries'], 0, result['view'])
+		self.assertEqual(os.listdir(os.path.join(self.media_root, 'sessions')), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+	"""Pages may only scan whole tables or sort without an index where the baseline allows it.
+
+	After adding an accepted scan, regenerate the baseline with
+	``manage.py check_query_plans --update``.
+	"""
+
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root)
+		settings_override = override_settings(CHUNKED_UPLOAD_DIR=os.path.join(self.media_root, 'sessions'))
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+	def test_no_new_full_scans(self):
+		seed_site(**SEED)
+		new, _ = compare(collect_problems(seeded_conversation(SEED['prefix'])), load_baseline())
+		if new:
+			self.fail(f'New full scans or unindexed sorts:\n{describe(new)}')
+
+	def test_scans_and_sorts_are_detected(self):
+		scan = 'SELECT "id" FROM "coachingsite_message" WHERE "text" = \'hi\''
+		self.assertEqual(plan_problems(explain(scan)), ['SCAN coachingsite_message'])
+		self.assertEqual(plan_problems(explain('SELECT "id" FROM "coachingsite_message" WHERE "id" = 1')), [])
+		sort = 'SELECT "id" FROM "coachingsite_message" ORDER BY "text"'
+		self.assertIn('USE TEMP B-TREE FOR ORDER BY', plan_problems(explain(sort)))
+
+		known = {'view': 'inbox', 'role': 'coach', 'plan': 'SCAN coachingsite_message', 'sql': normalize_sql(scan)}
+		gone = dict(known, view='home')
+		self.assertEqual(compare([known], [gone]), ([known], [gone]))
+		self.assertEqual(known['sql'], 'SELECT "id" FROM "coachingsite_message" WHERE "text" = ?')
+
+
+class RequestTimingTests(TestCase):
+	def setUp(self):
+		self.coach = create_user('timing-coach', role=Profile.COACH)
+		athlete = create_user('timing-athlete')
+		Conversation.objects.create(athlete=athlete, coach=self.coach)
+		slow_requests.clear()
+		self.addCleanup(slow_requests.clear)
+
+	def timings(self, response):
+		metrics = {}
+		for metric in response['Server-Timing'].split(', '):
+			name, *fields = metric.split(';')
+			metrics[name] = dict(field.split('=', 1) for field in fields)
+		return metrics
+
+	def test_server_timing_header(self):
+		self.coach.is_staff = True
+		self.coach.save()
+		self.client.force_login(self.coach)
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('coachingsite:inbox'))
+		metrics = self.timings(response)
+		self.assertEqual(set(metrics), {'total', 'db', 'tpl'})
+		self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+		self.assertGreater(float(metrics['tpl']['dur']), 0)
+		self.assertGreaterEqual(float(metrics['total']['dur']), float(metrics['db']['dur']))
+
+	def test_server_timing_is_only_sent_to_staff_and_internal_ips(self):
+		self.assertNotIn('Server-Timing', self.client.get('/'))
+		self.client.force_login(self.coach)
+		self.assertNotIn('Server-Timing', self.client.get(reverse('coachingsite:inbox')))
+		with self.settings(INTERNAL_IPS=['127.0.0.1']):
+			self.assertIn('Server-Timing', Client().get('/'))
+
+	def test_slowest_requests_are_kept_with_their_sql(self):
+		with override_settings(SLOW_REQUEST_LOG_SIZE=2):
+			client = Client()
+			client.force_login(self.coach)
+			for name in ('home', 'inbox', 'profile', 'progress'):
+				client.get(reverse(f'coachingsite:{name}'))
+		entries = slow_requests.entries()
+		self.assertEqual(len(entries), 2)
+		self.assertGreaterEqual(entries[0].total_ms, entries[1].total_ms)
+		self.assertEqual(len(entries[0].queries), entries[0].query_count)
+		self.assertTrue(any('coachingsite_' in sql for sql, _, _ in entries[0].queries))
+
+		log = SlowRequestLog(2)
+		for total in (5, 1, 9, 3):
+			log.record(SlowRequest('GET', f'/{total}', 200, total, 0, 0, 0))
+		self.assertEqual([entry.path for entry in log.entries()], ['/9', '/5'])
+		self.assertFalse(log.would_keep(4))
+
+	def test_staff_can_browse_and_clear_the_log(self):
+		url = reverse('slow_requests')
+		self.client.force_login(self.coach)
+		self.assertEqual(self.client.get(url).status_code, 302)
+
+		admin_user = User.objects.create_superuser('timing-admin', password='pass1234')
+		self.client.force_login(admin_user)
+		self.client.get(reverse('coachingsite:inbox'))
+		response = self.client.get(url)
+		self.assertContains(response, 'GET /inbox/')
+		self.assertContains(response, 'coachingsite_conversation')
+		self.client.post(url)
+		self.assertEqual([entry.path for entry in slow_requests.entries()], [url])
+
+	@override_settings(REQUEST_TIMING_ENABLED=False)
+	def test_disabled_middleware_is_removed(self):
+		client = Client()
+		client.force_login(self.coach)
+		response = client.get(reverse('coachingsite:inbox'))
+		self.assertNotIn('Server-Timing', response)
+		self.assertEqual(slow_requests.entries(), [])
+
+
+def _count_upload_in_child():
+	UPLOAD_BYTES.inc(100)
+
+
+class MetricsTests(TestCase):
+	def setUp(self):
+		self.metrics_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.metrics_dir)
+		settings_override = override_settings(METRICS_DIR=self.metrics_dir)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		reset_store()
+		self.addCleanup(reset_store)
+		self.coach = create_user('metrics-coach', role=Profile.COACH)
+
+	def scrape(self, **extra):
+		response = Client().get('/metrics', **extra)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+		return response.content.decode()
+
+	def test_requests_are_labelled_by_url_name(self):
+		self.client.force_login(self.coach)
+		for _ in range(2):
+			self.client.get(reverse('coachingsite:inbox'))
+		self.client.get('/no-such-page/')
+		text = self.scrape()
+		self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+		self.assertIn('http_request_duration_seconds_bucket{view="coachingsite:inbox",le="+Inf"} 2.0', text)
+		self.assertIn('http_request_duration_seconds_count{view="coachingsite:inbox"} 2.0', text)
+		self.assertIn('http_responses_total{status="200",view="coachingsite:inbox"} 2.0', text)
+		self.assertIn('http_responses_total{status="404",view="<unresolved>"} 1.0', text)
+		queries = re.search(r'^db_queries_total\{view="coachingsite:inbox"\} (\S+)$', text, re.M)
+		self.assertGreater(float(queries[1]), 0)
+
+		buckets = re.findall(r'^http_request_duration_seconds_bucket\{view="coachingsite:inbox",le="([^"]+)"\} (\S+)$', text, re.M)
+		self.assertEqual(buckets[-1][0], '+Inf')
+		counts = [float(count) for _, count in buckets]
+		self.assertEqual(counts, sorted(counts))
+
+	def test_processes_are_summed(self):
+		process = multiprocessing.get_context('fork').Process(target=_count_upload_in_child)
+		process.start()
+		process.join()
+		self.assertEqual(process.exitcode, 0)
+		UPLOAD_BYTES.inc(50)
+		self.assertEqual(len(os.listdir(self.metrics_dir)), 2)
+		self.assertIn('upload_received_bytes_total 150.0', self.scrape())
+
+	def test_exited_processes_are_merged(self):
+		for _ in range(2):
+			process = multiprocessing.get_context('fork').Process(target=_count_upload_in_child)
+			process.start()
+			process.join()
+		UPLOAD_BYTES.inc(50)
+		self.assertIn('upload_received_bytes_total 250.0', self.scrape())
+		files = {name for name in os.listdir(self.metrics_dir) if name.endswith('.db')}
+		self.assertEqual(files, {'metrics-merged.db', f'metrics-{os.getpid()}.db'})
+		# Merging again adds nothing twice
+		self.assertIn('upload_received_bytes_total 250.0', self.scrape())
+
+	def test_values_survive_reopening_and_growth(self):
+		path = os.path.join(self.metrics_dir, 'metrics-1.db')
+		values = ValueStore(path)
+		for number in range(3000):
+			values.inc(f'key-{number}', number)
+		values.inc('key-7', 1)
+		reopened = ValueStore(path).values()
+		self.assertEqual(len(reopened), 3000)
+		self.assertEqual(reopened['key-7'], 8)
+		self.assertGreater(os.path.getsize(path), 64 * 1024)
+
+	def test_access_is_limited(self):
+		self.assertEqual(Client().get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 403)
+		staff = User.objects.create_user('metrics-staff', password='pass1234', is_staff=True)
+		client = Client(REMOTE_ADDR='10.1.2.3')
+		client.force_login(staff)
+		self.assertEqual(client.get('/metrics').status_code, 200)
+
+
+class ProfilingTests(TestCase):
+	def setUp(self):
+		self.profile_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.profile_dir)
+		settings_override = override_settings(
+			PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir, PROFILING_INTERVAL_MS=1,
+		)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		self.coach = create_user('profiled-coach', role=Profile.COACH)
+
+	def get_inbox(self, delay=0.0):
+		real_render = views.render
+
+		def slow_render(*args, **kwargs):
+			time.sleep(delay)
+			return real_render(*args, **kwargs)
+
+		client = Client()
+		client.force_login(self.coach)
+		with mock.patch.object(views, 'render', slow_render):
+			self.assertEqual(client.get(reverse('coachingsite:inbox')).status_code, 200)
+		return sorted(os.listdir(self.profile_dir))
+
+	def test_only_slow_requests_are_profiled(self):
+		with self.settings(PROFILING_THRESHOLD_MS=20):
+			self.assertEqual(self.get_inbox(), [])
+			files = self.get_inbox(delay=0.2)
+		self.assertEqual(len(files), 1)
+		self.assertTrue(files[0].startswith('coachingsite:inbox.'))
+		samples = read_profile(os.path.join(self.profile_dir, files[0]))
+		self.assertGreater(samples.total(), 1)
+		stack = samples.most_common(1)[0][0]
+		self.assertIn('coachingsite.views.inbox;', stack)
+		self.assertTrue(stack.endswith('slow_render'))
+
+	def test_one_in_n_requests_are_profiled_from_the_start(self):
+		with self.settings(PROFILING_THRESHOLD_MS=60000, PROFILING_SAMPLE_RATE=1):
+			self.assertEqual(len(self.get_inbox(delay=0.05)), 1)
+
+	def test_old_profiles_are_rotated_away(self):
+		with self.settings(PROFILING_MAX_FILES=3):
+			paths = []
+			for number in range(5):
+				paths.append(write_profile('coachingsite:inbox', Counter({'a;b': number + 1})))
+				os.utime(paths[-1], (number, number))
+		self.assertEqual(sorted(os.listdir(self.profile_dir)), sorted(os.path.basename(p) for p in paths[2:]))
+
+	def test_merge_profiles_per_view(self):
+		write_profile('coachingsite:inbox', Counter({'app;view;query': 3, 'app;view;render': 1}))
+		write_profile('coachingsite:inbox', Counter({'app;view;query': 2}))
+		write_profile('coachingsite:progress', Counter({'app;report': 4}))
+		output = os.path.join(self.profile_dir, 'merged')
+		out = StringIO()
+		call_command('merge_profiles', output=output, stdout=out)
+		self.assertIn('coachingsite:inbox: 6 samples from 2 requests', out.getvalue())
+		self.assertIn('83.3%  query', out.getvalue())
+		with open(os.path.join(output, 'coachingsite:inbox.folded')) as handle:
+			self.assertEqual(handle.read(), 'app;view;query 5\napp;view;render 1\n')
+
+		out = StringIO()
+		call_command('merge_profiles', view=['coachingsite:progress'], stdout=out)
+		self.assertNotIn('inbox', out.getvalue())
+
+
+class LoginRequiredTests(TestCase):
+	def test_exemptions(self):
+		exempt = compile_login_exemptions().match
+		for path in ('/', '/accounts/login/', '/accounts/password_reset/', '/static/site.css', '/media/profiles/a.jpg', '/admin/auth/user/', '/metrics'):
+			self.assertTrue(exempt(path), path)
+		for path in ('/inbox/', '/metrics/extra', '/progress/', '/accounts/password_change/', '/conversation/1/'):
+			self.assertFalse(exempt(path), path)
+
+	def test_exempt_paths_do_not_touch_the_user(self):
+		middleware = LoginRequiredMiddleware(lambda request: HttpResponse('ok'))
+		# RequestFactory requests have no user; reading it would raise AttributeError.
+		self.assertEqual(middleware(RequestFactory().get('/static/site.css')).status_code, 200)
+		with self.assertRaises(AttributeError):
+			middleware(RequestFactory().get('/inbox/'))
+
+	def test_anonymous_users_are_sent_to_login(self):
+		self.assertRedirects(self.client.get('/inbox/'), '/accounts/login/', fetch_redirect_response=False)
+		self.assertEqual(self.client.get('/').status_code, 200)
+		self.assertEqual(self.client.get('/accounts/password_reset/').status_code, 200)
+		self.client.force_login(create_user('member', role=Profile.ATHLETE))
+		self.assertEqual(self.client.get('/inbox/').status_code, 200)
+
+	@override_settings(LOGIN_EXEMPT_URLNAMES=['login', 'no-such-page'])
+	def test_unknown_url_names_are_rejected(self):
+		with self.assertRaisesMessage(ImproperlyConfigured, 'no-such-page'):
+			compile_login_exemptions()
+
+
+class CachedUserTests(TestCase):
+	def setUp(self):
+		self.athlete = create_user('cached-athlete')
+		self.client.force_login(self.athlete)
+		# The first request after logging in loads the user and profile in one query.
+		self.client.get(reverse('coachingsite:profile'))
+
+	def test_authenticated_pages_make_no_auth_queries(self):
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.client.get(reverse('coachingsite:profile')).status_code, 200)
+		tables = ' '.join(query['sql'] for query in queries.captured_queries)
+		self.assertNotIn('"auth_user"', tables)
+		self.assertNotIn('"coachingsite_profile"', tables)
+
+	def test_profile_and_role_changes_are_seen_on_the_next_request(self):
+		response = self.client.post(reverse('coachingsite:edit_profile'), {'full_name': 'New Name', 'bio': ''})
+		self.assertEqual(response.status_code, 302)
+		self.assertEqual(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.profile.full_name, 'New Name')
+
+		profile = Profile.objects.get(user=self.athlete)
+		profile.role = Profile.COACH
+		profile.save()
+		self.assertEqual(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.profile.role, Profile.COACH)
+
+	def test_password_changes_end_other_sessions(self):
+		self.athlete.set_password('another-password')
+		self.athlete.save()
+		self.assertRedirects(self.client.get(reverse('coachingsite:inbox')), '/accounts/login/', fetch_redirect_response=False)
+
+	def test_deleted_users_are_signed_out(self):
+		self.athlete.delete()
+		self.assertFalse(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.is_authenticated)
+
+	def test_role_changes_inside_a_transaction_are_not_cached_stale(self):
+		stale = User.objects.select_related('profile').get(pk=self.athlete.pk)
+		with self.captureOnCommitCallbacks(execute=True):
+			with transaction.atomic():
+				profile = Profile.objects.get(user=self.athlete)
+				profile.role = Profile.COACH
+				profile.save()
+				# A concurrent request still sees the committed row and caches it.
+				cached_user(self.athlete.pk, lambda user_id: stale)
+		self.assertEqual(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.profile.role, Profile.COACH)
+
+	def test_invalidations_reach_other_processes(self):
+		User.objects.filter(pk=self.athlete.pk).update(first_name='Renamed')
+		self.assertEqual(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.first_name, '')
+		process = multiprocessing.get_context('fork').Process(target=invalidate_cached_user, args=(self.athlete.pk,))
+		process.start()
+		process.join()
+		self.assertEqual(process.exitcode, 0)
+		self.assertEqual(self.client.get(reverse('coachingsite:profile')).wsgi_request.user.first_name, 'Renamed')
+
+	def test_per_process_caches_are_refused(self):
+		locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+		with self.settings(CACHES=locmem), self.assertRaisesMessage(ImproperlyConfigured, 'local-memory'):
+			CachedModelBackend()
+
+
+class SessionEngineTests(TestCase):
+	def setUp(self):
+		self.user = create_user('session-user')
+		self.client.force_login(self.user)
+		self.session_key = self.client.session.session_key
+
+	def store(self):
+		store = import_module(settings.SESSION_ENGINE).SessionStore(self.session_key)
+		store.load()
+		return store
+
+	def test_signed_in_requests_read_the_session_from_the_cache(self):
+		self.client.get(reverse('coachingsite:profile'))
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.client.get(reverse('coachingsite:profile')).status_code, 200)
+		self.assertNotIn('django_session', ' '.join(query['sql'] for query in queries.captured_queries))
+
+	def test_unchanged_sessions_are_not_rewritten(self):
+		store = self.store()
+		store.modified = True
+		with self.assertNumQueries(0):
+			store.save()
+		# Two hours later the expiry has moved, but only past a one hour window is it rewritten.
+		later = timezone.now() + timedelta(hours=2)
+		with mock.patch('django.utils.timezone.now', return_value=later):
+			with self.settings(SESSION_DB_REFRESH_WINDOW=3 * 3600), self.assertNumQueries(0):
+				store.save()
+			with self.settings(SESSION_DB_REFRESH_WINDOW=3600):
+				store.save()
+		expire_date = Session.objects.get(session_key=self.session_key).expire_date
+		self.assertEqual(expire_date, later + timedelta(seconds=settings.SESSION_COOKIE_AGE))
+
+	def test_changed_sessions_reach_the_database(self):
+		store = self.store()
+		store['course'] = 'Maple Hill'
+		store.save()
+		cache.clear()
+		self.assertEqual(self.store()['course'], 'Maple Hill')
+
+	def test_logout_ends_the_session_everywhere(self):
+		self.client.get(reverse('coachingsite:profile'))
+		self.client.post(reverse('logout'))
+		self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+		self.assertEqual(self.store().items(), {}.items())
+
+	def test_per_process_caches_are_refused(self):
+		locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+		with self.settings(CACHES=locmem), self.assertRaisesMessage(ImproperlyConfigured, 'local-memory'):
+			import_module(settings.SESSION_ENGINE).SessionStore(self.session_key)
+
+	def test_prune_sessions_deletes_expired_rows_in_batches(self):
+		expired = timezone.now() - timedelta(days=1)
+		Session.objects.bulk_create([Session(session_key=f'expired{n:05}', session_data='', expire_date=expired) for n in range(25)])
+		out = StringIO()
+		with CaptureQueriesContext(connection) as queries:
+			call_command('prune_sessions', batch_size=10, pause=0, stdout=out)
+		self.assertIn('Deleted 25 expired sessions.', out.getvalue())
+		self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries.captured_queries), 3)
+		self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [self.session_key])
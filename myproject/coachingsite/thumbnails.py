@@ -0,0 +1,119 @@
+"""Square thumbnails of profile pictures.
+
+Each picture gets a WebP and a JPEG version at every size in
+THUMBNAIL_SIZES. They are stored next to each other under a name derived
+from the picture's own name::
+
+    thumbnails/profiles/2024/05/01/me.png/96.webp
+
+Because uploaded pictures never reuse a name, a changed picture gets new
+thumbnail names and old ones can never be served for it. Templates can
+therefore build thumbnail URLs without touching the disk. Saving a new
+picture through ProfileForm queues a job that writes its thumbnails. Any
+that are missing when requested, for example before that job has run, are
+generated by the media view on first request.
+"""
+
+import io
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .jobs import task
+
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_SIZES = (48, 96, 256)
+# WebP where the Pillow build supports it, JPEG as the fallback for every browser
+THUMBNAIL_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG')) if features.check('webp') else (('jpg', 'JPEG'),)
+THUMBNAIL_QUALITY = 82
+THUMBNAIL_NAME_RE = re.compile(
+    r'^%s/(?P<source>profiles/.+)/(?P<size>\d+)\.(?P<extension>\w+)$' % THUMBNAIL_DIR
+)
+
+
+def thumbnail_name(source_name, size, extension):
+    return posixpath.join(THUMBNAIL_DIR, source_name, f'{size}.{extension}')
+
+
+def thumbnail_names(source_name):
+    """Return ``{extension: [(size, name), ...]}`` for every thumbnail of ``source_name``."""
+    return {
+        extension: [(size, thumbnail_name(source_name, size, extension)) for size in THUMBNAIL_SIZES]
+        for extension, _ in THUMBNAIL_FORMATS
+    }
+
+
+def _write(storage, name, image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        image.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=THUMBNAIL_QUALITY, method=4)
+
+    # Written to a temporary file and renamed, so a concurrent first request
+    # never sees a half-written thumbnail.
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as target:
+        target.write(buffer.getvalue())
+    if storage.file_permissions_mode is not None:
+        os.chmod(target.name, storage.file_permissions_mode)
+    os.replace(target.name, path)
+
+
+@task()
+def generate_thumbnails(source_name, storage=default_storage):
+    """Write every thumbnail of the picture ``source_name``.
+
+    Returns False if the picture is missing or is not an image Pillow can
+    read.
+    """
+    try:
+        with storage.open(source_name, 'rb') as source, Image.open(source) as image:
+            # Let the JPEG decoder scale down while decoding; large phone
+            # photos then decode at a fraction of their full size.
+            largest = max(THUMBNAIL_SIZES)
+            image.draft('RGB', (largest * 2, largest * 2))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+            # Each size is reduced from the next larger one, not the original.
+            for size in sorted(THUMBNAIL_SIZES, reverse=True):
+                image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+                for extension, image_format in THUMBNAIL_FORMATS:
+                    _write(storage, thumbnail_name(source_name, size, extension), image, image_format)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+def ensure_thumbnail(name, storage=default_storage):
+    """Generate the thumbnails behind the thumbnail ``name`` if they do not exist yet.
+
+    Returns True when the thumbnail exists afterwards.
+    """
+    match = THUMBNAIL_NAME_RE.match(name)
+    if not match or int(match['size']) not in THUMBNAIL_SIZES:
+        return False
+    if match['extension'] not in dict(THUMBNAIL_FORMATS):
+        return False
+    if storage.exists(name):
+        return True
+    return generate_thumbnails(match['source'], storage) and storage.exists(name)
+
+
+def delete_thumbnails(source_name, storage=default_storage):
+    """Remove every thumbnail of ``source_name``."""
+    if not source_name:
+        return
+    shutil.rmtree(storage.path(posixpath.join(THUMBNAIL_DIR, source_name)), ignore_errors=True)
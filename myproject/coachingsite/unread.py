@@ -0,0 +1,91 @@
+"""Read cursors and unread message counts.
+
+Each participant has at most one ReadCursor per conversation. It stores the
+id of the newest message they have seen, so "unread" means messages from
+someone else with a larger id. That comparison is served by the
+``conversation_id`` index together with the primary key.
+
+The per-user total behind the navigation badge is cached. Saving a message
+clears the cached total of the other participant, and moving a read cursor
+clears the reader's own.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Message, ReadCursor
+
+
+def _cache_key(user_id):
+    return f'coachingsite:unread-total:{user_id}'
+
+
+def invalidate_unread_total(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def unread_messages(user):
+    """Messages from others that ``user`` has not read, across all their conversations."""
+    last_read_id = (
+        ReadCursor.objects
+        .filter(conversation=OuterRef('conversation'), user=user)
+        .values('last_read_message_id')[:1]
+    )
+    return (
+        Message.objects
+        .filter(Q(conversation__athlete=user) | Q(conversation__coach=user))
+        .exclude(sender=user)
+        .filter(id__gt=Coalesce(Subquery(last_read_id), 0))
+    )
+
+
+def unread_total(user):
+    """Return the number of unread messages for ``user``, cached between requests."""
+    key = _cache_key(user.pk)
+    total = cache.get(key)
+    if total is None:
+        total = unread_messages(user).count()
+        cache.set(key, total, settings.UNREAD_COUNT_CACHE_TIMEOUT)
+    return total
+
+
+def mark_read(conversation, user, message_id=None):
+    """Move ``user``'s read cursor in ``conversation`` forward to ``message_id``.
+
+    ``conversation`` may be a Conversation or its id. Without ``message_id``
+    the newest message in the conversation is used. The cursor never moves
+    backwards.
+    """
+    conversation_id = getattr(conversation, 'pk', conversation)
+    if message_id is None:
+        message_id = (
+            Message.objects
+            .filter(conversation_id=conversation_id)
+            .order_by('-id')
+            .values_list('id', flat=True)
+            .first()
+        )
+    if not message_id:
+        return
+
+    moved = ReadCursor.objects.filter(
+        conversation_id=conversation_id,
+        user=user,
+        last_read_message_id__lt=message_id,
+    ).update(last_read_message_id=message_id)
+    if not moved:
+        try:
+            with transaction.atomic():
+                _, moved = ReadCursor.objects.get_or_create(
+                    conversation_id=conversation_id,
+                    user=user,
+                    defaults={'last_read_message_id': message_id},
+                )
+        except IntegrityError:
+            # Another request created the cursor first; the next visit moves it on.
+            moved = False
+    if moved:
+        invalidate_unread_total(user.pk)
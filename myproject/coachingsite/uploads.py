@@ -0,0 +1,193 @@
+"""Resumable, chunked video uploads.
+
+The protocol follows the same shape as tus:
+
+1. ``POST /uploads/`` with ``filename`` and ``size`` creates an UploadSession.
+2. ``PATCH /uploads/<id>/`` appends one chunk. The request sends
+   ``Upload-Offset`` (where the chunk starts) and optionally
+   ``Upload-Checksum: sha256 <base64 digest>`` for the chunk.
+   The response carries the new ``Upload-Offset``.
+3. ``HEAD /uploads/<id>/`` reports the current offset so an interrupted
+   upload resumes where it stopped instead of starting again.
+4. Once every byte has arrived, ``POST /uploads/<id>/finalize/`` moves the
+   file into media storage and attaches it to a Message or Response.
+
+Chunks are streamed from the request to the session's ``.part`` file in small
+blocks, so memory use does not depend on chunk or file size.
+
+A session that receives no chunk for CHUNKED_UPLOAD_EXPIRY seconds is
+abandoned; ``manage.py prune_uploads`` deletes it with its ``.part`` file.
+"""
+
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from myproject.metrics import UPLOAD_BYTES
+
+from .models import UploadSession, upload_expiry
+from .storage import LocalFile
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A chunk could not be accepted; ``status`` is the HTTP status to return."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.pk}.part')
+
+
+def parse_checksum(header):
+    """Parse ``Upload-Checksum: sha256 <base64>`` into raw digest bytes."""
+    if not header:
+        return None
+    algorithm, _, encoded = header.partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError('Only sha256 checksums are supported')
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except (binascii.Error, ValueError) as exc:
+        raise UploadError('Malformed Upload-Checksum header') from exc
+
+
+def create_session(user, filename, size):
+    if size <= 0:
+        raise UploadError('size must be a positive number of bytes')
+    if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError('File is too large', status=413)
+    session = UploadSession.objects.create(user=user, filename=os.path.basename(filename)[:255], size=size)
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def append_chunk(session, stream, offset, length, checksum=None):
+    """Append ``length`` bytes read from ``stream`` at ``offset``.
+
+    Raises UploadError if the offset is stale, the chunk is too large, another
+    request is writing to the session, or the checksum does not match. In
+    those cases the stored file is left exactly as it was. Returns the new
+    offset.
+    """
+    if session.is_complete:
+        raise UploadError('Upload is already complete', status=409)
+    if offset != session.offset:
+        raise UploadError(f'Upload-Offset must be {session.offset}', status=409)
+    if length <= 0 or length > settings.CHUNKED_UPLOAD_MAX_CHUNK:
+        raise UploadError('Chunk size is out of range', status=413)
+    if offset + length > session.size:
+        raise UploadError('Chunk runs past the declared upload size', status=413)
+
+    with open(part_path(session), 'r+b') as part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as exc:
+            raise UploadError('Another chunk is being written', status=423) from exc
+        # Drop any bytes left behind by an interrupted earlier attempt.
+        part.truncate(offset)
+        part.seek(offset)
+        digest = hashlib.sha256()
+        remaining = length
+        while remaining:
+            block = stream.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            part.write(block)
+            remaining -= len(block)
+
+        if remaining or (checksum is not None and digest.digest() != checksum):
+            part.truncate(offset)
+            if remaining:
+                raise UploadError('Chunk ended before Content-Length bytes were received')
+            raise UploadError('Checksum mismatch', status=460)
+        part.flush()
+        os.fsync(part.fileno())
+
+        new_offset = offset + length
+        updated = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+            offset=new_offset, expires_at=upload_expiry(),
+        )
+        if not updated:
+            part.truncate(offset)
+            raise UploadError('Upload offset changed concurrently', status=409)
+    session.offset = new_offset
+    UPLOAD_BYTES.inc(length)
+    return new_offset
+
+
+def finalize_session(session, instance, save=True):
+    """Move the completed upload into ``instance.video``.
+
+    With ``save=False`` the caller saves ``instance`` itself, which lets a
+    view attach the file to a new Message or Response before its first save.
+    """
+    if not session.is_complete:
+        raise UploadError('Upload is not complete yet', status=409)
+    path = part_path(session)
+    with open(path, 'rb') as part:
+        # LocalFile lets the storage move the part file instead of copying it,
+        # so finalising a multi-GB upload is a rename.
+        instance.video.save(session.filename, LocalFile(part), save=save)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
+    return instance
+
+
+def discard_session(session):
+    path = part_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
+
+
+def prune_expired():
+    """Delete expired sessions and stray ``.part`` files; return the number of sessions deleted.
+
+    A session whose part file is locked is receiving a chunk right now and
+    is left alone.
+    """
+    deleted = 0
+    for session in UploadSession.objects.filter(expires_at__lt=timezone.now()):
+        path = part_path(session)
+        try:
+            part = open(path, 'rb')
+        except FileNotFoundError:
+            deleted += UploadSession.objects.filter(pk=session.pk, expires_at__lt=timezone.now()).delete()[0]
+            continue
+        with part:
+            try:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            # A chunk may have arrived since the query.
+            if UploadSession.objects.filter(pk=session.pk, expires_at__lt=timezone.now()).delete()[0]:
+                os.remove(path)
+                deleted += 1
+
+    # Part files left behind by a session row deleted some other way
+    if os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+        cutoff = timezone.now().timestamp() - settings.CHUNKED_UPLOAD_EXPIRY
+        for entry in os.scandir(settings.CHUNKED_UPLOAD_DIR):
+            stem, extension = os.path.splitext(entry.name)
+            if extension != '.part' or entry.stat().st_mtime >= cutoff:
+                continue
+            try:
+                session_id = uuid.UUID(stem)
+            except ValueError:
+                continue
+            if not UploadSession.objects.filter(pk=session_id).exists():
+                os.remove(entry.path)
+    return deleted
@@ -9,8 +9,15 @@ urlpatterns = [
     path('inbox/', views.inbox, name='inbox'),
     path('message/<int:pk>/', views.message_detail, name='message_detail'),
     path('conversation/<int:pk>/', views.conversation_detail, name='conversation_detail'),
+    path('conversation/<int:pk>/updates/', views.conversation_updates, name='conversation_updates'),
+    path('conversation/<int:pk>/events/', views.conversation_events, name='conversation_events'),
     path('conversation/start/<int:coach_id>/', views.start_conversation, name='start_conversation'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
     path('profile/', views.profile, name='profile'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('progress/', views.progress, name='progress'),
+    path('progress/rounds/', views.progress_rounds, name='progress_rounds'),
+    path('progress/chart/', views.progress_chart, name='progress_chart'),
 ]
@@ -0,0 +1,65 @@
+"""Signed-in users, with their profile, cached between requests.
+
+CachedModelBackend (backends.py) loads the session's user through
+``cached_user``, so an authenticated page view makes no user or profile
+query while the entry is fresh.
+
+Each user has a version stamp stored next to the cached entry, and an entry
+is only used while its stamp matches. Invalidating replaces the stamp
+instead of deleting the entry, so a request that loaded the user before a
+change cannot cache the old row after it. Inside a transaction the stamp is
+replaced again on commit: until then other requests still read the old row,
+and may cache it under the first new stamp. Saving or deleting a User or
+Profile invalidates it (see the signal handlers in models.py); code that
+bypasses signals, such as bulk_create or queryset.update(), must call
+``invalidate_cached_user`` itself.
+
+The default cache must be shared by all worker processes, or a change made
+in one is only seen by the others after AUTH_USER_CACHE_TIMEOUT;
+CachedModelBackend refuses a local-memory cache.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _cache_keys(user_id):
+    return f'coachingsite:auth-user:{user_id}', f'coachingsite:auth-user-version:{user_id}'
+
+
+def _restamp(user_id):
+    _, version_key = _cache_keys(user_id)
+    cache.set(version_key, uuid.uuid4().hex, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def invalidate_cached_user(user_id):
+    _restamp(user_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _restamp(user_id))
+
+
+def cached_user(user_id, load):
+    """Return the user with id ``user_id`` from the cache, or from ``load(user_id)`` on a miss."""
+    entry_key, version_key = _cache_keys(user_id)
+    found = cache.get_many([entry_key, version_key])
+    version, entry = found.get(version_key), found.get(entry_key)
+    if version is not None and entry is not None and entry[0] == version:
+        return entry[1]
+
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    if version is None:
+        version = uuid.uuid4().hex
+        # add() is not atomic on every backend (the file cache checks, then
+        # writes), so it can overwrite a stamp set in between. That is safe:
+        # the user is loaded after stamping, and a change still being
+        # committed restamps again on commit.
+        if not cache.add(version_key, version, timeout):
+            # Another request stamped it first.
+            version = cache.get(version_key, version)
+    user = load(user_id)
+    if user is not None:
+        cache.set(entry_key, (version, user), timeout)
+    return user
@@ -1,119 +1,260 @@
-import json
-
+import hashlib
+import mimetypes
+import os
+import posixpath
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models import Q, Avg, Min, Max, Count
-from django.http import HttpResponseForbidden
-from django.shortcuts import render, redirect, get_object_or_404
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_http_methods, require_POST
 from django.urls import reverse
+from myproject.metrics import MEDIA_BYTES
 
+from .events import conversation_stream, publish_message, publish_response
 from .forms import MessageForm, ResponseForm, ProfileForm, RegistrationForm, RoundResultForm
-from .models import Message, Conversation, Profile, RoundResult
+from .media import FileRange, UnsatisfiableRange, can_view_media, parse_range, replacement_for
+from .models import Message, Conversation, CourseStats, Profile, Response, RoundResult, UploadSession
+from .pagination import InvalidCursor, KeysetPage, keyset_paginate
+from .reports import (
+	NO_COURSE, ROW_FIELDS, course_label, course_value, downsample_lttb, filter_by_course, round_rows,
+	selected_course_label,
+)
+from .storage import blob_digest
+from .thumbnails import THUMBNAIL_DIR, ensure_thumbnail
+from .unread import mark_read
+from .uploads import UploadError, append_chunk, create_session, discard_session, finalize_session, parse_checksum
 
 
 def home(request):
 	"""Render the site home page."""
 	if request.user.is_authenticated:
 		if request.user.profile.role == Profile.COACH:
-			athletes = User.objects.filter(profile__role=Profile.ATHLETE)
+			athletes = User.objects.filter(profile__role=Profile.ATHLETE).select_related('profile')
 			return render(request, "site/dashboard.html", {'athletes': athletes})
-		coaches = User.objects.filter(profile__role=Profile.COACH)
+		coaches = User.objects.filter(profile__role=Profile.COACH).select_related('profile')
 		return render(request, "site/dashboard.html", {'coaches': coaches})
 	return render(request, "site/home.html")
 
 
+def _completed_upload(request):
+	"""Return the finished UploadSession named in the POST data.
+
+	Returns None when the form carries no resumable upload and False when it
+	names a session that is unknown, not the user's or still incomplete.
+	"""
+	session_id = request.POST.get('upload_session')
+	if not session_id:
+		return None
+	if not request.user.is_authenticated:
+		return False
+	try:
+		session = UploadSession.objects.get(pk=session_id, user=request.user)
+	except (UploadSession.DoesNotExist, ValidationError):
+		return False
+	return session if session.is_complete else False
+
+
 def submit_message(request):
 	"""Allow users to submit a message or video."""
 	if request.method == 'POST':
 		form = MessageForm(request.POST, request.FILES, user=request.user)
+		upload = _completed_upload(request)
+		if upload is False:
+			return HttpResponseBadRequest('Unknown or incomplete upload')
 		if form.is_valid():
 			msg = form.save(commit=False)
+			if upload:
+				finalize_session(upload, msg, save=False)
 			# associate sender if logged in
 			if request.user.is_authenticated:
 				msg.sender = request.user
-			# if coach selected, find or create a conversation
+			# if coach selected, file the message in the athlete's conversation with them;
+			# anonymous messages have no athlete and stay outside any conversation
 			coach = form.cleaned_data.get('coach')
-			if coach:
-				# find existing conversation between this athlete and coach
-				athlete = msg.sender or None
-				convo = None
-				if athlete:
-					convo = Conversation.objects.filter(athlete=athlete, coach=coach).first()
-				if not convo:
-					convo = Conversation.objects.create(athlete=athlete or None, coach=coach, subject='')
-				msg.conversation = convo
+			if coach and msg.sender:
+				msg.conversation = Conversation.objects.between(msg.sender, coach)
 			msg.save()
+			publish_message(msg)
 			return redirect(reverse('coachingsite:submit') + '?sent=1')
 	else:
 		form = MessageForm(user=request.user)
 	return render(request, 'site/submit.html', {'form': form})
 
 
+INBOX_ORDERING = ('-updated_at', '-id')
+INBOX_PAGE_SIZE = 50
+
+
 def inbox(request):
 	"""List active conversations for the current user (coach or athlete)"""
-	if request.user.is_authenticated and request.user.profile.role == Profile.COACH:
-		convos = Conversation.objects.filter(coach=request.user).order_by('-updated_at')
-	elif request.user.is_authenticated:
-		convos = Conversation.objects.filter(athlete=request.user).order_by('-updated_at')
-	else:
-		convos = Conversation.objects.none()
-	return render(request, 'site/inbox.html', {'conversations': convos})
+	if not request.user.is_authenticated:
+		return render(request, 'site/inbox.html', {'conversations': []})
+	convos = Conversation.objects.for_participant(request.user).with_inbox_summary(request.user)
+	try:
+		page = keyset_paginate(convos, INBOX_ORDERING, request.GET.get('cursor'), INBOX_PAGE_SIZE)
+	except InvalidCursor:
+		return HttpResponseBadRequest('Invalid cursor')
+	return render(request, 'site/inbox.html', {'conversations': page.items, 'next_cursor': page.next_cursor})
 
 
 def message_detail(request, pk):
 	msg = get_object_or_404(Message, pk=pk)
 	if request.method == 'POST':
 		form = ResponseForm(request.POST, request.FILES)
+		upload = _completed_upload(request)
+		if upload is False:
+			return HttpResponseBadRequest('Unknown or incomplete upload')
 		if form.is_valid():
 			resp = form.save(commit=False)
+			if upload:
+				finalize_session(upload, resp, save=False)
 			resp.message = msg
 			resp.save()
-			msg.responded = True
-			msg.save()
+			publish_response(resp, msg.conversation_id)
+			# Only the flag changes; avoid rewriting the whole row.
+			Message.objects.filter(pk=msg.pk).update(responded=True)
 			return redirect('coachingsite:message_detail', pk=pk)
 	else:
 		form = ResponseForm()
+	if msg.conversation_id and request.user.is_authenticated:
+		mark_read(msg.conversation_id, request.user, msg.pk)
 	return render(request, 'site/message_detail.html', {'message': msg, 'form': form})
 
 
+THREAD_ORDERING = ('-created_at', '-id')
+THREAD_PAGE_SIZE = 30
+THREAD_UPDATES_LIMIT = 100
+
+
+def _participant_conversation(request, pk):
+	"""Return the conversation if the user may read it, or None if they may not."""
+	convo = get_object_or_404(Conversation.objects.select_related('athlete', 'coach'), pk=pk)
+	user = request.user
+	# access control: only participant users or superusers can access
+	if not (user.pk in (convo.athlete_id, convo.coach_id) or user.is_superuser):
+		return None
+	return convo
+
+
+def _thread_messages(convo):
+	return convo.messages.filter(has_content=True).select_related('sender')
+
+
 @login_required
 def conversation_detail(request, pk):
-	convo = get_object_or_404(Conversation, pk=pk)
-	# access control: only participant users or superusers can access
-	user = request.user
-	if not (user == convo.athlete or user == convo.coach or user.is_superuser):
+	convo = _participant_conversation(request, pk)
+	if convo is None:
 		return HttpResponseForbidden('You do not have permission to view this conversation')
-	thread_msgs = (
-		convo.messages
-		.select_related('sender', 'conversation')
-		.prefetch_related('responses')
-		.filter(Q(text__regex=r'\S') | Q(video__isnull=False))
-		.order_by('created_at')
-	)
+	user = request.user
 	# single composer form: use MessageForm to create new messages within conversation
 	composer = MessageForm(user=request.user)
 	if request.method == 'POST':
 		composer = MessageForm(request.POST, request.FILES, user=request.user)
+		upload = _completed_upload(request)
+		if upload is False:
+			return HttpResponseBadRequest('Unknown or incomplete upload')
 		if composer.is_valid():
 			msg = composer.save(commit=False)
 			# normalize/trim text to avoid saving whitespace-only messages
 			if msg.text:
 				msg.text = msg.text.strip()
-			if not msg.text and not msg.video:
+			if not msg.text and not msg.video and not upload:
 				return redirect('coachingsite:conversation_detail', pk=pk)
-			if convo.coach == convo.athlete:
+			if convo.coach_id == convo.athlete_id:
 				return HttpResponseForbidden('You cannot message yourself')
+			if upload:
+				finalize_session(upload, msg, save=False)
 			msg.sender = request.user
 			msg.conversation = convo
 			msg.save()
 			convo.updated_at = msg.created_at
 			convo.save()
+			mark_read(convo, user, msg.pk)
+			publish_message(msg)
 			return redirect('coachingsite:conversation_detail', pk=pk)
 
-	return render(request, 'site/conversation_detail.html', {'conversation': convo, 'thread_messages': thread_msgs, 'composer': composer})
+	# Only the newest page is rendered; older history is paged backwards.
+	try:
+		page = keyset_paginate(_thread_messages(convo), THREAD_ORDERING, request.GET.get('before'), THREAD_PAGE_SIZE)
+	except InvalidCursor:
+		return HttpResponseBadRequest('Invalid cursor')
+	thread_msgs = page.items[::-1]
+	is_newest_page = not request.GET.get('before')
+	if thread_msgs and is_newest_page:
+		mark_read(convo, user, max(msg.pk for msg in thread_msgs))
+	return render(request, 'site/conversation_detail.html', {
+		'conversation': convo,
+		'thread_messages': thread_msgs,
+		'older_cursor': page.next_cursor,
+		# New messages belong on the newest page, so only it receives live updates.
+		'is_newest_page': is_newest_page,
+		# Event streams need an ASGI server; under WSGI the page only polls.
+		'live_events': isinstance(request, ASGIRequest),
+		'composer': composer,
+	})
+
+
+@login_required
+def conversation_updates(request, pk):
+	"""Return messages newer than ``?after=<message id>`` as JSON with a rendered fragment."""
+	convo = _participant_conversation(request, pk)
+	if convo is None:
+		return HttpResponseForbidden('You do not have permission to view this conversation')
+	try:
+		after = int(request.GET.get('after', 0))
+	except ValueError:
+		return HttpResponseBadRequest('after must be a message id')
+
+	new_msgs = list(_thread_messages(convo).filter(id__gt=after).order_by('id')[:THREAD_UPDATES_LIMIT])
+	if new_msgs:
+		mark_read(convo, request.user, new_msgs[-1].pk)
+	html = render_to_string('site/conversation_messages.html', {'thread_messages': new_msgs}, request=request)
+	return JsonResponse({
+		'html': html,
+		'ids': [msg.pk for msg in new_msgs],
+		'last_id': new_msgs[-1].pk if new_msgs else after,
+		'has_more': len(new_msgs) == THREAD_UPDATES_LIMIT,
+	})
+
+
+@login_required
+async def conversation_events(request, pk):
+	"""Stream live updates for a conversation as Server-Sent Events.
+
+	Needs an ASGI server to hold connections open cheaply; see coachingsite.events.
+	Under WSGI the stream would be read to the end before anything is sent, so
+	the view answers 204 instead, which tells EventSource not to reconnect.
+	"""
+	if not isinstance(request, ASGIRequest):
+		return HttpResponse(status=204)
+	convo = await aget_object_or_404(Conversation, pk=pk)
+	user = await request.auser()
+	if not (user.pk in (convo.athlete_id, convo.coach_id) or user.is_superuser):
+		return HttpResponseForbidden('You do not have permission to view this conversation')
+
+	last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('after')
+	try:
+		last_event_id = int(last_event_id) if last_event_id else None
+	except ValueError:
+		return HttpResponseBadRequest('Last-Event-ID must be a message id')
+
+	response = StreamingHttpResponse(conversation_stream(convo.pk, last_event_id), content_type='text/event-stream')
+	response['Cache-Control'] = 'no-cache'
+	# Tell nginx-style proxies not to buffer the stream.
+	response['X-Accel-Buffering'] = 'no'
+	return response
 
 
 @login_required
@@ -130,9 +271,7 @@ def start_conversation(request, coach_id):
 	if coach == athlete:
 		return HttpResponseForbidden('You cannot start a conversation with yourself')
 
-	convo = Conversation.objects.filter(athlete=athlete, coach=coach).first()
-	if not convo:
-		convo = Conversation.objects.create(athlete=athlete, coach=coach, subject='')
+	convo = Conversation.objects.between(athlete, coach)
 	return redirect('coachingsite:conversation_detail', pk=convo.pk)
 
 
@@ -177,6 +316,28 @@ def edit_profile(request):
 	return render(request, 'site/profile_settings.html', {'form': form})
 
 
+ROUND_HISTORY_ORDERING = ('-played_on', '-created_at', 'id')
+ROUND_HISTORY_PAGE_SIZE = 25
+
+
+def _selected_progress_athlete(request, is_coach):
+	"""Return the athlete whose progress is being viewed, or None if there is none."""
+	if not is_coach:
+		return request.user
+	athlete_id = request.GET.get('athlete')
+	if athlete_id:
+		return get_object_or_404(User, pk=athlete_id, profile__role=Profile.ATHLETE)
+	return User.objects.filter(profile__role=Profile.ATHLETE).order_by('username').first()
+
+
+def _round_history_page(athlete, course_filter, cursor=None):
+	"""Return one keyset page of the athlete's round history, newest first."""
+	if athlete is None:
+		return KeysetPage()
+	rounds = filter_by_course(RoundResult.objects.filter(athlete=athlete), course_filter).only(*ROW_FIELDS)
+	return keyset_paginate(rounds, ROUND_HISTORY_ORDERING, cursor, ROUND_HISTORY_PAGE_SIZE)
+
+
 @login_required
 def progress(request):
 	"""Allow athletes to log rounds and coaches to review progress over time, per course."""
@@ -192,11 +353,7 @@ def progress(request):
 
 	if is_coach:
 		athletes = User.objects.filter(profile__role=Profile.ATHLETE).order_by('username')
-		athlete_id = request.GET.get('athlete')
-		if athlete_id:
-			selected_athlete = get_object_or_404(User, pk=athlete_id, profile__role=Profile.ATHLETE)
-		else:
-			selected_athlete = athletes.first() if athletes.exists() else None
+		selected_athlete = _selected_progress_athlete(request, is_coach)
 	elif is_athlete:
 		selected_athlete = request.user
 		if request.method == 'POST':
@@ -216,85 +373,54 @@ def progress(request):
 	else:
 		return HttpResponseForbidden('Progress tracking is limited to coaches and athletes.')
 
-	rounds_qs = RoundResult.objects.filter(athlete=selected_athlete) if selected_athlete else RoundResult.objects.none()
-
-	def course_label(name):
-		return name.strip() if name else 'Unspecified course'
-
-	course_groups = rounds_qs.values('course_name').annotate(
-		total_rounds=Count('id'),
-		avg_score=Avg('score_relative'),
-		best=Min('score_relative'),
-		worst=Max('score_relative'),
-	).order_by('course_name')
+	# Summaries come from the incrementally maintained stats table, so this
+	# costs one query per page regardless of how many rounds were logged.
+	stats_rows = list(CourseStats.objects.filter(athlete=selected_athlete)) if selected_athlete else []
+	total_stats = next((row for row in stats_rows if row.is_total), None)
+	course_rows = sorted((row for row in stats_rows if not row.is_total), key=lambda row: row.course_name)
+	stats_by_course = {row.course_name: row for row in course_rows}
 
 	course_options = []
 	course_stats = []
-	for group in course_groups:
-		name = group['course_name'] or ''
-		value = name if name else '__none'
-		label = course_label(name)
-		course_options.append({'value': value, 'label': label, 'count': group['total_rounds']})
+	for row in course_rows:
+		label = course_label(row.course_name)
+		course_options.append({'value': course_value(row.course_name), 'label': label, 'count': row.rounds})
 		course_stats.append({
 			'label': label,
-			'rounds': group['total_rounds'],
-			'avg': group['avg_score'],
-			'best': group['best'],
-			'worst': group['worst'],
+			'rounds': row.rounds,
+			'avg': row.avg_score,
+			'best': row.best,
+			'worst': row.worst,
 		})
 
 	course_filter = request.GET.get('course', '')
-	filtered_qs = rounds_qs
-	if course_filter:
-		if course_filter == '__none':
-			filtered_qs = filtered_qs.filter(Q(course_name__isnull=True) | Q(course_name__exact=''))
-		else:
-			filtered_qs = filtered_qs.filter(course_name=course_filter)
-
-	selected_course_label = 'All courses'
-	if course_filter == '__none':
-		selected_course_label = course_label('')
+	filtered_stats = total_stats
+	if course_filter == NO_COURSE:
+		filtered_stats = stats_by_course.get('')
 	elif course_filter:
-		selected_course_label = course_label(course_filter)
+		filtered_stats = stats_by_course.get(course_filter)
 
-	entries = filtered_qs.order_by('-played_on', '-created_at')
-	chart_qs = filtered_qs.order_by('played_on', 'created_at')
+	# The chart is fetched separately from progress_chart; the history table
+	# only renders its first page and loads the rest on demand.
+	history = _round_history_page(selected_athlete, course_filter)
 
-	course_suggestions = []
-	if selected_athlete:
-		course_suggestions = list(
-			rounds_qs
-			.exclude(course_name__isnull=True)
-			.exclude(course_name__exact='')
-			.values_list('course_name', flat=True)
-			.distinct()
-		)
-		course_suggestions.sort(key=lambda name: name.lower())
-
-	aggregates = filtered_qs.aggregate(
-		avg_score=Avg('score_relative'),
-		best=Min('score_relative'),
-		worst=Max('score_relative'),
-	) if selected_athlete else {'avg_score': None, 'best': None, 'worst': None}
-
-	chart_points = [
-		{
-			'date': entry.played_on.strftime('%Y-%m-%d'),
-			'label': entry.course_name or 'Round',
-			'score': entry.score_relative,
-		}
-		for entry in chart_qs
-	]
+	course_suggestions = sorted((row.course_name for row in course_rows if row.course_name), key=str.lower)
+
+	aggregates = {
+		'avg_score': filtered_stats.avg_score if filtered_stats else None,
+		'best': filtered_stats.best if filtered_stats else None,
+		'worst': filtered_stats.worst if filtered_stats else None,
+	}
 
 	context = {
 		'form': form,
-		'entries': entries,
-		'chart_data': json.dumps(chart_points, cls=DjangoJSONEncoder),
+		'entries': history.items,
+		'next_cursor': history.next_cursor,
 		'aggregate': aggregates,
-		'round_count': filtered_qs.count(),
-		'overall_round_count': rounds_qs.count(),
+		'round_count': filtered_stats.rounds if filtered_stats else 0,
+		'overall_round_count': total_stats.rounds if total_stats else 0,
 		'selected_course': course_filter,
-		'selected_course_label': selected_course_label,
+		'selected_course_label': selected_course_label(course_filter),
 		'course_options': course_options,
 		'course_stats': course_stats,
 		'course_suggestions': course_suggestions,
@@ -304,3 +430,239 @@ def progress(request):
 		'is_athlete': is_athlete,
 	}
 	return render(request, 'site/progress.html', context)
+
+
+@login_required
+def progress_rounds(request):
+	"""Return the next page of round history as JSON with a rendered HTML fragment."""
+	role = getattr(getattr(request.user, 'profile', None), 'role', None)
+	if role not in (Profile.COACH, Profile.ATHLETE):
+		return HttpResponseForbidden('Progress tracking is limited to coaches and athletes.')
+
+	selected_athlete = _selected_progress_athlete(request, role == Profile.COACH)
+	try:
+		page = _round_history_page(selected_athlete, request.GET.get('course', ''), request.GET.get('cursor'))
+	except InvalidCursor:
+		return HttpResponseBadRequest('Invalid cursor')
+
+	html = render_to_string('site/progress_rounds.html', {'entries': page.items}, request=request)
+	return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
+
+@login_required
+def progress_chart(request):
+	"""Return the progress chart series as JSON, optionally downsampled.
+
+	Responses carry an ETag and Last-Modified derived from the athlete's
+	all-courses stats row, which changes whenever a round is written, so
+	clients can revalidate without the series being rebuilt.
+	"""
+	role = getattr(getattr(request.user, 'profile', None), 'role', None)
+	if role not in (Profile.COACH, Profile.ATHLETE):
+		return HttpResponseForbidden('Progress tracking is limited to coaches and athletes.')
+
+	max_points = request.GET.get('max_points')
+	if max_points:
+		try:
+			max_points = int(max_points)
+		except ValueError:
+			return HttpResponseBadRequest('max_points must be an integer')
+		if max_points < 3:
+			return HttpResponseBadRequest('max_points must be at least 3')
+
+	selected_athlete = _selected_progress_athlete(request, role == Profile.COACH)
+	course_filter = request.GET.get('course', '')
+
+	stats = None
+	if selected_athlete:
+		stats = CourseStats.objects.filter(athlete=selected_athlete, is_total=True).only('rounds', 'updated_at').first()
+	last_modified = stats.updated_at if stats else None
+	version = f"{getattr(selected_athlete, 'pk', '')}:{course_filter}:{max_points or ''}:{last_modified.isoformat() if last_modified else ''}:{getattr(stats, 'rounds', 0)}"
+	etag = quote_etag(hashlib.sha1(version.encode()).hexdigest())
+	last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+
+	response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+	if response is None:
+		points = []
+		if selected_athlete:
+			rounds = filter_by_course(RoundResult.objects.filter(athlete=selected_athlete), course_filter)
+			points = [row.chart_point() for row in round_rows(rounds)]
+		total = len(points)
+		if max_points:
+			points = downsample_lttb(points, max_points)
+		response = JsonResponse({
+			'label': selected_course_label(course_filter),
+			'total': total,
+			'points': points,
+		})
+
+	response['ETag'] = etag
+	if last_modified_ts is not None:
+		response['Last-Modified'] = http_date(last_modified_ts)
+	# Per-user data: caches may store it but must revalidate every time.
+	patch_cache_control(response, private=True, no_cache=True)
+	return response
+
+
+def _upload_response(session, status=200):
+	response = JsonResponse({
+		'id': str(session.pk),
+		'offset': session.offset,
+		'size': session.size,
+		'complete': session.is_complete,
+		'url': reverse('coachingsite:upload_detail', args=[session.pk]),
+	}, status=status)
+	response['Upload-Offset'] = str(session.offset)
+	response['Upload-Length'] = str(session.size)
+	response['Cache-Control'] = 'no-store'
+	return response
+
+
+def _upload_error(error):
+	return JsonResponse({'error': str(error)}, status=error.status)
+
+
+@login_required
+@require_POST
+def upload_create(request):
+	"""Start a resumable upload; see coachingsite.uploads for the protocol."""
+	try:
+		size = int(request.POST.get('size', ''))
+	except ValueError:
+		return HttpResponseBadRequest('size must be an integer')
+	try:
+		session = create_session(request.user, request.POST.get('filename') or 'upload.mp4', size)
+	except UploadError as error:
+		return _upload_error(error)
+	response = _upload_response(session, status=201)
+	response['Location'] = reverse('coachingsite:upload_detail', args=[session.pk])
+	return response
+
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+def upload_detail(request, upload_id):
+	"""Report the offset of, append a chunk to, or cancel an upload session."""
+	session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+	if request.method == 'DELETE':
+		discard_session(session)
+		return HttpResponse(status=204)
+	if request.method == 'PATCH':
+		try:
+			offset = int(request.headers.get('Upload-Offset', ''))
+			length = int(request.headers.get('Content-Length', ''))
+		except ValueError:
+			return HttpResponseBadRequest('Upload-Offset and Content-Length headers are required')
+		try:
+			checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+			append_chunk(session, request, offset, length, checksum)
+		except UploadError as error:
+			return _upload_error(error)
+	return _upload_response(session)
+
+
+@login_required
+@require_POST
+def upload_finalize(request, upload_id):
+	"""Attach a completed upload to an existing Message or Response."""
+	session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+	user = request.user
+	if request.POST.get('message'):
+		target = get_object_or_404(Message.objects.select_related('conversation'), pk=request.POST['message'])
+		convo = target.conversation
+	elif request.POST.get('response'):
+		target = get_object_or_404(Response.objects.select_related('message__conversation'), pk=request.POST['response'])
+		convo = target.message.conversation
+	else:
+		return HttpResponseBadRequest('Give a message or response to attach the upload to')
+
+	sender_id = getattr(target, 'sender_id', None)
+	participants = (convo.athlete_id, convo.coach_id) if convo else ()
+	if not (user.pk == sender_id or user.pk in participants or user.is_superuser):
+		return HttpResponseForbidden('You cannot attach files to this item')
+	try:
+		finalize_session(session, target)
+	except UploadError as error:
+		return _upload_error(error)
+	return JsonResponse({'video': target.video.url})
+
+
+# blobs are named after their content, so a cached copy never goes stale
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _media_headers(response, etag, last_modified, immutable=False):
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(last_modified)
+	response['Accept-Ranges'] = 'bytes'
+	if immutable:
+		patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+	else:
+		patch_cache_control(response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+	return response
+
+
+@login_required
+def serve_media(request, path):
+	"""Serve an uploaded file to users allowed to see it, honouring Range requests."""
+	name = posixpath.normpath(path).lstrip('/')
+	try:
+		full_path = safe_join(settings.MEDIA_ROOT, name)
+	except SuspiciousFileOperation:
+		raise Http404('Not found')
+	# Files the user may not see are reported as missing rather than forbidden.
+	if not can_view_media(request.user, name):
+		# Pages rendered before a blob was reprocessed still link to the old one.
+		replacement = replacement_for(name)
+		if replacement and can_view_media(request.user, replacement):
+			return redirect(settings.MEDIA_URL + replacement, permanent=True)
+		raise Http404('Not found')
+	if name.startswith(THUMBNAIL_DIR + '/') and not os.path.exists(full_path):
+		# Thumbnails are generated on their first request.
+		ensure_thumbnail(name)
+	try:
+		stat = os.stat(full_path)
+	except (FileNotFoundError, NotADirectoryError):
+		raise Http404('Not found')
+	if not S_ISREG(stat.st_mode):
+		raise Http404('Not found')
+
+	digest = blob_digest(name)
+	etag = quote_etag(digest or f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+	last_modified = int(stat.st_mtime)
+	immutable = digest is not None
+	response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	if response is not None:
+		return _media_headers(response, etag, last_modified, immutable)
+
+	content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+	offload = settings.MEDIA_OFFLOAD
+	if offload:
+		response = HttpResponse(content_type=content_type)
+		if offload == 'x-accel-redirect':
+			response['X-Accel-Redirect'] = settings.MEDIA_OFFLOAD_PREFIX + quote(name)
+		else:
+			response['X-Sendfile'] = full_path
+		MEDIA_BYTES.inc(stat.st_size, delivery='offload')
+		return _media_headers(response, etag, last_modified, immutable)
+
+	byte_range = None
+	if_range = request.headers.get('If-Range')
+	if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+		try:
+			byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+		except UnsatisfiableRange:
+			response = HttpResponse(status=416)
+			response['Content-Range'] = f'bytes */{stat.st_size}'
+			return _media_headers(response, etag, last_modified, immutable)
+
+	media_file = open(full_path, 'rb')
+	if byte_range:
+		start, length = byte_range
+		response = FileResponse(FileRange(media_file, start, length), status=206, content_type=content_type)
+		response['Content-Range'] = f'bytes {start}-{start + length - 1}/{stat.st_size}'
+	else:
+		response = FileResponse(media_file, content_type=content_type)
+		length = stat.st_size
+	MEDIA_BYTES.inc(length, delivery='django')
+	return _media_headers(response, etag, last_modified, immutable)
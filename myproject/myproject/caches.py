@@ -0,0 +1,21 @@
+"""Guard for caches that must be visible to every worker process."""
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+
+def shared_cache(alias):
+    """Return cache ``alias``, refusing a cache that only this process can see.
+
+    Invalidations written to a local-memory cache never reach the other
+    workers, which then serve stale users and sessions until the entries
+    expire.
+    """
+    cache = caches[alias]
+    if isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured(
+            f"CACHES[{alias!r}] is a local-memory cache; configure one shared "
+            f"by all worker processes, such as FileBasedCache or Redis."
+        )
+    return cache
@@ -0,0 +1,322 @@
+"""Prometheus metrics, aggregated across worker processes.
+
+Each process adds to its own memory-mapped file in METRICS_DIR, so
+increments never wait for another process and take only an uncontended
+thread lock. ``/metrics`` sums the files of every process, living or
+exited, and renders them in the Prometheus text exposition format.
+Counters therefore survive worker restarts; empty METRICS_DIR when
+deploying to reset them. The files of exited processes are folded into
+``metrics-merged.db`` by the next collection, so the directory does not
+grow with every restart. That check uses process ids, so METRICS_DIR
+must not be shared between hosts. With METRICS_DIR set to None each
+process keeps its values in anonymous memory and ``/metrics`` reports
+only the process that serves it.
+
+File layout: an 8 byte header holding the number of bytes in use, then
+entries of ``<key length> <utf-8 key> <padding> <float64 value>``, with
+values 8 byte aligned. A new entry is written before the header is moved
+past it, so readers never see a partial entry.
+"""
+
+import fcntl
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from math import inf
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+HEADER = struct.Struct('<Q')
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 64 * 1024
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, inf)
+MERGED_NAME = 'metrics-merged.db'
+PROCESS_FILE_RE = re.compile(r'^metrics-(?P<pid>\d+)\.db$')
+
+
+def _value_offset(entry_offset, key_length):
+    end = entry_offset + KEY_LENGTH.size + key_length
+    return end + (-end % 8)
+
+
+def _entries(data):
+    """Yield ``(key, value offset)`` for each entry of a values file."""
+    used = HEADER.unpack_from(data, 0)[0] if len(data) >= HEADER.size else 0
+    offset = HEADER.size
+    while offset < used:
+        (length,) = KEY_LENGTH.unpack_from(data, offset)
+        start = offset + KEY_LENGTH.size
+        value_offset = _value_offset(offset, length)
+        yield bytes(data[start:start + length]).decode(), value_offset
+        offset = value_offset + VALUE.size
+
+
+def read_values(data):
+    """Yield ``(key, value)`` from the bytes of a values file."""
+    for key, offset in _entries(data):
+        yield key, VALUE.unpack_from(data, offset)[0]
+
+
+class ValueStore:
+    """Float values by key in a memory map written by one process."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        if path is None:
+            self.file = None
+            self.map = mmap.mmap(-1, INITIAL_SIZE)
+        else:
+            self.file = open(path, 'a+b')
+            if os.fstat(self.file.fileno()).st_size < INITIAL_SIZE:
+                self.file.truncate(INITIAL_SIZE)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = HEADER.unpack_from(self.map, 0)[0]
+        if self.used < HEADER.size:
+            self.used = HEADER.size
+            HEADER.pack_into(self.map, 0, self.used)
+        # A restarted process that got the same pid continues the old file.
+        self.offsets = dict(_entries(self.map))
+
+    def _grow(self, needed):
+        size = len(self.map)
+        while size < self.used + needed:
+            size *= 2
+        if self.file is None:
+            grown = mmap.mmap(-1, size)
+            grown[:self.used] = self.map[:self.used]
+        else:
+            self.file.truncate(size)
+            grown = mmap.mmap(self.file.fileno(), 0)
+        self.map.close()
+        self.map = grown
+
+    def _add_key(self, key):
+        encoded = key.encode()
+        value_offset = _value_offset(self.used, len(encoded))
+        end = value_offset + VALUE.size
+        if end > len(self.map):
+            self._grow(end - self.used)
+        KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + KEY_LENGTH.size:self.used + KEY_LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self.map, value_offset, 0.0)
+        self.used = end
+        HEADER.pack_into(self.map, 0, end)
+        self.offsets[key] = value_offset
+        return value_offset
+
+    def inc(self, key, amount=1.0):
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self._add_key(key)
+            VALUE.pack_into(self.map, offset, VALUE.unpack_from(self.map, offset)[0] + amount)
+
+    def values(self):
+        with self.lock:
+            return dict(read_values(self.map))
+
+    def close(self):
+        self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def store():
+    """This process's ValueStore, reopened after a fork."""
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store_pid != pid:
+        with _store_lock:
+            if _store_pid != pid:
+                directory = settings.METRICS_DIR
+                path = None
+                if directory is not None:
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f'metrics-{pid}.db')
+                _store, _store_pid = ValueStore(path), pid
+    return _store
+
+
+def reset_store():
+    """Forget this process's store, so the next write opens METRICS_DIR again."""
+    global _store, _store_pid
+    with _store_lock:
+        _store = _store_pid = None
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        return True
+    return True
+
+
+def _merge_exited(directory):
+    """Fold the files of exited processes into ``metrics-merged.db``.
+
+    Called with the merge lock held, so a collection never sees a file's
+    values both merged and still on disk.
+    """
+    exited = []
+    for name in os.listdir(directory):
+        match = PROCESS_FILE_RE.match(name)
+        if match and int(match['pid']) != os.getpid() and not _process_exists(int(match['pid'])):
+            exited.append(os.path.join(directory, name))
+    if not exited:
+        return
+    merged = ValueStore(os.path.join(directory, MERGED_NAME))
+    try:
+        for path in exited:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            for key, value in read_values(data):
+                merged.inc(key, value)
+            os.remove(path)
+    finally:
+        merged.close()
+
+
+def collect():
+    """Return ``{key: value}`` summed over every process's values."""
+    directory = settings.METRICS_DIR
+    if directory is None:
+        return store().values()
+    os.makedirs(directory, exist_ok=True)
+    totals = {}
+    with open(os.path.join(directory, '.merge.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            _merge_exited(directory)
+            for path in glob.glob(os.path.join(glob.escape(str(directory)), 'metrics-*.db')):
+                with open(path, 'rb') as handle:
+                    data = handle.read()
+                for key, value in read_values(data):
+                    totals[key] = totals.get(key, 0.0) + value
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return totals
+
+
+REGISTRY = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, sample, labels, le=None):
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        items = sorted(labels.items())
+        if le is not None:
+            items.append(('le', le))
+        return json.dumps([self.name, sample, items])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store().inc(self._key(f'{self.name}_total', labels), amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(set(buckets) | {inf}))
+
+    def observe(self, value, **labels):
+        values = store()
+        for bound in self.buckets:
+            if value <= bound:
+                values.inc(self._key(f'{self.name}_bucket', labels, le=bound))
+        values.inc(self._key(f'{self.name}_sum', labels), value)
+        values.inc(self._key(f'{self.name}_count', labels))
+
+
+def _format_value(value):
+    if value == inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(values=None):
+    """Return the text exposition of every registered metric."""
+    values = collect() if values is None else values
+    samples = {}
+    for key, value in values.items():
+        name, sample, labels = json.loads(key)
+        if name in REGISTRY:
+            samples.setdefault(name, []).append((sample, labels, value))
+
+    suffix_order = {'_bucket': 0, '_sum': 1, '_count': 2}
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        if name not in samples:
+            continue
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+
+        def order(item):
+            sample, labels, _ = item
+            plain = [pair for pair in labels if pair[0] != 'le']
+            le = next((pair[1] for pair in labels if pair[0] == 'le'), 0)
+            return plain, suffix_order.get(sample[len(name):], 0), le
+
+        for sample, labels, value in sorted(samples[name], key=order):
+            if labels:
+                sample += '{%s}' % ','.join(
+                    f'{label}="{_format_value(label_value) if label == "le" else _escape(label_value)}"'
+                    for label, label_value in labels
+                )
+            lines.append(f'{sample} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Serve every process's metrics to scrapers from METRICS_ALLOWED_IPS, or to staff."""
+    allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not allowed and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden('Metrics are not available from this address')
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by URL name.', ['view'],
+)
+RESPONSES = Counter('http_responses', 'Responses sent, by URL name and status code.', ['view', 'status'])
+DB_QUERIES = Counter('db_queries', 'Database queries run while handling requests, by URL name.', ['view'])
+UPLOAD_BYTES = Counter('upload_received_bytes', 'Bytes of video received through chunked uploads.')
+MEDIA_BYTES = Counter(
+    'media_served_bytes',
+    'Body bytes of media responses. Offloaded responses count the whole file.',
+    ['delivery'],
+)
@@ -1,34 +1,215 @@
+import re
+import time
+from contextlib import ExitStack
+
 from django.conf import settings
-from django.shortcuts import redirect
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from django.shortcuts import redirect, resolve_url
+from django.urls import URLResolver, get_resolver
+from django.utils.functional import empty
+
+from .metrics import DB_QUERIES, REQUEST_LATENCY, RESPONSES
+from .profiling import sampler, should_sample_from_start, write_profile
+from .timing import RequestTimer, SlowRequest, current_timer, slow_requests
+
+
+def _pattern_regex(pattern):
+    """The regex source of a URL pattern, without its leading ``^`` or group names."""
+    return re.sub(r'\(\?P<\w+>', '(?:', pattern.pattern.regex.pattern.removeprefix('^'))
+
+
+def _exempt_url_regexes(resolver, names, prefix='', namespace=''):
+    """Yield path regexes for the URL ``names`` (or whole namespaces) found under ``resolver``."""
+    for entry in resolver.url_patterns:
+        regex = prefix + _pattern_regex(entry)
+        if isinstance(entry, URLResolver):
+            nested = f'{namespace}{entry.namespace}:' if entry.namespace else namespace
+            if entry.namespace and nested[:-1] in names:
+                names.discard(nested[:-1])
+                yield regex
+            else:
+                yield from _exempt_url_regexes(entry, names, regex, nested)
+        elif entry.name and f'{namespace}{entry.name}' in names:
+            names.discard(f'{namespace}{entry.name}')
+            yield regex
+
+
+def compile_login_exemptions():
+    """Compile the paths LoginRequiredMiddleware lets through into one regex.
+
+    Exempt are everything under LOGIN_URL, STATIC_URL and MEDIA_URL, and the
+    URLs named in LOGIN_EXEMPT_URLNAMES. A namespace in that list, such as
+    ``admin``, exempts every URL in it.
+    """
+    regexes = []
+    for url in (resolve_url(settings.LOGIN_URL), settings.STATIC_URL, settings.MEDIA_URL):
+        # An empty or root prefix would exempt the whole site.
+        if url and url.startswith('/') and url != '/':
+            regexes.append(re.escape(url))
+    names = set(settings.LOGIN_EXEMPT_URLNAMES)
+    root = get_resolver()
+    regexes.extend(_exempt_url_regexes(root, names, prefix=_pattern_regex(root)))
+    if names:
+        raise ImproperlyConfigured(f'LOGIN_EXEMPT_URLNAMES has unknown URL names: {", ".join(sorted(names))}')
+    return re.compile('|'.join(f'(?:{regex})' for regex in regexes))
 
 
 class LoginRequiredMiddleware:
     """Middleware that requires authentication for most site pages.
 
-    Exemptions are based on path prefixes: the LOGIN_URL, registration
-    path, admin, and static/media when DEBUG. This avoids fragile view-name
-    resolution.
+    Exempt paths (see compile_login_exemptions) are matched against one
+    regex built at startup, before ``request.user`` is touched, so static
+    files, media and login pages never load the session or the user. Views
+    behind exempt URLs that need a user, such as serve_media and the admin,
+    check it themselves.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.exempt = compile_login_exemptions().match
 
     def __call__(self, request):
-        # Allow access if already authenticated
-        if request.user.is_authenticated:
+        if self.exempt(request.path_info) or request.user.is_authenticated:
             return self.get_response(request)
-        path = request.path
-        # Always allow access to auth related and admin URLs and the public root
-        login_url = settings.LOGIN_URL
-        accounts_prefix = '/accounts/'
-        admin_prefix = '/admin/'
+        return redirect(settings.LOGIN_URL)
 
-        if path == '/' or path.startswith(login_url) or path.startswith(accounts_prefix) or path.startswith(admin_prefix):
-            return self.get_response(request)
 
-        # Allow static and media in DEBUG
-        if settings.DEBUG and (path.startswith(settings.STATIC_URL) or path.startswith(settings.MEDIA_URL)):
-            return self.get_response(request)
+class RequestTimingMiddleware:
+    """Report where each request's time went and remember the slowest ones.
 
-        # Otherwise redirect anonymous users to login
-        return redirect(settings.LOGIN_URL)
+    Adds a ``Server-Timing`` header with total, database and template time
+    (and the query count) for staff and INTERNAL_IPS, and records the
+    request in ``timing.slow_requests`` if it is among the
+    SLOW_REQUEST_LOG_SIZE slowest this process has served. With
+    REQUEST_TIMING_ENABLED off the middleware removes itself from the stack
+    and costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        slow_requests.resize(settings.SLOW_REQUEST_LOG_SIZE)
+
+    def __call__(self, request):
+        timer = RequestTimer(settings.SLOW_REQUEST_MAX_QUERIES)
+        token = timer.activate()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            timer.deactivate(token)
+
+        total_ms = timer.elapsed() * 1000
+        db_ms = timer.db_seconds * 1000
+        template_ms = timer.template_seconds * 1000
+        if self.may_see_timing(request):
+            response['Server-Timing'] = (
+                f'total;dur={total_ms:.1f}, '
+                f'db;dur={db_ms:.1f};desc="{timer.query_count} queries", '
+                f'tpl;dur={template_ms:.1f}'
+            )
+        if slow_requests.would_keep(total_ms):
+            slow_requests.record(SlowRequest(
+                method=request.method,
+                path=request.get_full_path(),
+                status=response.status_code,
+                total_ms=total_ms,
+                db_ms=db_ms,
+                query_count=timer.query_count,
+                template_ms=template_ms,
+                queries=timer.queries,
+            ))
+        return response
+
+    @staticmethod
+    def may_see_timing(request):
+        """Backend timings are only shown to staff and INTERNAL_IPS."""
+        if request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS:
+            return True
+        user = getattr(request, 'user', None)
+        # Requests that never looked at the user (static files, for one)
+        # are not made to load the session just to decide this.
+        if user is None or getattr(user, '_wrapped', None) is empty:
+            return False
+        return user.is_staff
+
+
+class QueryCounter:
+    """connection.execute_wrapper() hook that only counts queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Record latency, status and query count per URL name for ``/metrics``.
+
+    Requests are labelled by the resolved URL name, such as
+    ``coachingsite:progress``, so each view gets one histogram whatever its
+    arguments. Requests that do not resolve share the ``<unresolved>`` label.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timer = current_timer()
+        if timer is not None:
+            # RequestTimingMiddleware already wraps every query; read its count.
+            before = timer.query_count
+            response = self.get_response(request)
+            query_count = timer.query_count - before
+        else:
+            counter = QueryCounter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(counter))
+                response = self.get_response(request)
+            query_count = counter.count
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else '<unresolved>'
+        REQUEST_LATENCY.observe(elapsed, view=view)
+        RESPONSES.inc(view=view, status=response.status_code)
+        DB_QUERIES.inc(query_count, view=view)
+        return response
+
+
+class ProfilingMiddleware:
+    """Sample the stacks of slow requests and save them for flame graphs.
+
+    Requests slower than PROFILING_THRESHOLD_MS are sampled from the moment
+    they cross it, and one in PROFILING_SAMPLE_RATE requests from the start.
+    Each sampled request is written to PROFILING_DIR, labelled by URL name;
+    see profiling.py. Opt in with PROFILING_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = sampler.start(from_start=should_sample_from_start())
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop(profile)
+
+        if profile.samples:
+            match = request.resolver_match
+            view = match.view_name if match is not None else '<unresolved>'
+            write_profile(view, profile.samples)
+        return response
@@ -0,0 +1,196 @@
+"""Sampling profiler for slow requests.
+
+One daemon thread per process samples the Python stacks of requests that
+ProfilingMiddleware has registered:
+
+- every request that has already run longer than PROFILING_THRESHOLD_MS,
+  from that point on, and
+- one in PROFILING_SAMPLE_RATE requests from their first millisecond.
+
+While no registered request qualifies, the thread sleeps until the next one
+would cross the threshold, so fast traffic costs a dictionary insert and
+delete per request. Sampling reads ``sys._current_frames()`` and never
+interrupts the request thread.
+
+A profiled request is written to PROFILING_DIR as a collapsed-stack file
+(``frame;frame;frame count`` lines, the input format of flamegraph.pl and
+speedscope), named after its URL name. Only the newest PROFILING_MAX_FILES
+files are kept. ``manage.py merge_profiles`` combines them per view.
+"""
+
+import itertools
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_SUFFIX = '.folded'
+# <view>.<UTC timestamp>.<pid>.<sequence>.folded
+PROFILE_NAME_RE = re.compile(r'^(?P<view>.+)\.(?P<stamp>\d{8}T\d{6})\.(?P<pid>\d+)\.(?P<sequence>\d+)\.folded$')
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}"
+
+
+def collapse_stack(frame):
+    """Return ``frame``'s stack, outermost call first, joined with ``;``."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class ProfiledRequest:
+    __slots__ = ('thread_id', 'started', 'from_start', 'samples')
+
+    def __init__(self, thread_id, from_start):
+        self.thread_id = thread_id
+        self.started = time.monotonic()
+        self.from_start = from_start
+        self.samples = Counter()
+
+
+class Sampler:
+    """Samples the stacks of registered requests from a background thread."""
+
+    def __init__(self):
+        self.active = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.pid = None
+        self.idle = False
+
+    def _ensure_thread(self):
+        # A forked worker inherits the object but not the thread.
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+            self.thread.start()
+
+    def start(self, from_start=False):
+        request = ProfiledRequest(threading.get_ident(), from_start)
+        with self.condition:
+            self._ensure_thread()
+            self.active[request.thread_id] = request
+            # An idle sampler has no deadline; give it one.
+            if from_start or self.idle:
+                self.condition.notify()
+        return request
+
+    def stop(self, request):
+        with self.condition:
+            self.active.pop(request.thread_id, None)
+
+    def _run(self):
+        while True:
+            interval = settings.PROFILING_INTERVAL_MS / 1000
+            threshold = settings.PROFILING_THRESHOLD_MS / 1000
+            with self.condition:
+                now = time.monotonic()
+                due = [r for r in self.active.values() if r.from_start or now - r.started >= threshold]
+                if not due:
+                    # Sleep until the oldest request would cross the threshold.
+                    wake = min((r.started + threshold for r in self.active.values()), default=None)
+                    self.idle = wake is None
+                    self.condition.wait(None if wake is None else max(wake - now, interval))
+                    self.idle = False
+                    continue
+            frames = sys._current_frames()
+            for request in due:
+                frame = frames.get(request.thread_id)
+                # Skip threads that have already moved on to another request.
+                if frame is not None and self.active.get(request.thread_id) is request:
+                    request.samples[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(interval)
+
+
+sampler = Sampler()
+
+
+def should_sample_from_start():
+    rate = settings.PROFILING_SAMPLE_RATE
+    return bool(rate) and random.randrange(rate) == 0
+
+
+_sequence = itertools.count()
+
+
+def profile_name(view):
+    safe_view = re.sub(r'[^\w:.-]', '_', view)
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%S')
+    return f'{safe_view}.{stamp}.{os.getpid()}.{next(_sequence)}{PROFILE_SUFFIX}'
+
+
+def write_profile(view, samples, directory=None):
+    """Write ``samples`` as a collapsed-stack file and drop the oldest files past the limit."""
+    directory = directory or settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile_name(view))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as handle:
+        for stack, count in samples.most_common():
+            handle.write(f'{stack} {count}\n')
+    os.replace(handle.name, path)
+    rotate(directory, settings.PROFILING_MAX_FILES)
+    return path
+
+
+def rotate(directory, keep):
+    """Delete all but the ``keep`` newest profiles in ``directory``."""
+    profiles = [entry for entry in os.scandir(directory) if entry.name.endswith(PROFILE_SUFFIX)]
+    if len(profiles) <= keep:
+        return
+    profiles.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:len(profiles) - keep]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def read_profile(path):
+    """Return the stack counts of a collapsed-stack file."""
+    samples = Counter()
+    with open(path) as handle:
+        for line in handle:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                samples[stack] += int(count)
+    return samples
+
+
+def merge_profiles(directory, views=None):
+    """Return ``{view: (file count, summed stack counts)}`` for the profiles in ``directory``."""
+    merged = {}
+    for name in sorted(os.listdir(directory)):
+        match = PROFILE_NAME_RE.match(name)
+        if match is None or (views and match['view'] not in views):
+            continue
+        try:
+            samples = read_profile(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Rotated away since the listing
+            continue
+        files, total = merged.get(match['view'], (0, Counter()))
+        total.update(samples)
+        merged[match['view']] = (files + 1, total)
+    return merged
+
+
+def leaf_counts(samples):
+    """Samples by innermost frame: where the time was spent, not what called it."""
+    leaves = Counter()
+    for stack, count in samples.items():
+        leaves[stack.rpartition(';')[2]] += count
+    return leaves
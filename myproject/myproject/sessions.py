@@ -0,0 +1,121 @@
+"""Session engine: a cache in front of the database, with coalesced writes.
+
+Sessions are read from SESSION_CACHE_ALIAS and only fall back to the
+django_session table on a miss, so authenticated requests usually make no
+session query. Entries are kept for at most SESSION_CACHE_TIMEOUT seconds.
+The cache must be shared by every worker process, so that a logout or a
+changed session is seen by all of them at once; a local-memory cache is
+refused with ImproperlyConfigured.
+
+Saves are coalesced. A save writes to the database only when the session
+data differs from what was last persisted, or when it would move the stored
+expiry forward by more than SESSION_DB_REFRESH_WINDOW seconds. The stored
+expiry can therefore trail the real one by up to that window, and an idle
+session may end that much earlier.
+
+Expired rows are removed in batches by ``manage.py prune_sessions``, or by
+``clearsessions``, which uses the same code.
+"""
+
+import copy
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+from .caches import shared_cache
+
+logger = logging.getLogger('django.contrib.sessions')
+
+PRUNE_BATCH_SIZE = 1000
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'myproject.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = shared_cache(settings.SESSION_CACHE_ALIAS)
+        # What the database holds for this session, once known
+        self._persisted_data = None
+        self._persisted_expiry = None
+
+    def _remember(self, data, expire_date):
+        self._persisted_data = copy.deepcopy(data)
+        self._persisted_expiry = expire_date
+
+    def _cache_entry(self, data, expire_date):
+        timeout = min(settings.SESSION_CACHE_TIMEOUT, (expire_date - timezone.now()).total_seconds())
+        if timeout <= 0:
+            return
+        try:
+            self._cache.set(self.cache_key, {'data': data, 'expire_date': expire_date}, timeout)
+        except Exception:
+            logger.exception('Error saving to cache (%s)', self._cache)
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys. If this happens, reset the session.
+            entry = None
+
+        if entry is None:
+            row = self._get_session_from_db()
+            if row is None:
+                return {}
+            entry = {'data': self.decode(row.session_data), 'expire_date': row.expire_date}
+            self._cache_entry(entry['data'], entry['expire_date'])
+        self._remember(entry['data'], entry['expire_date'])
+        return entry['data']
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        expire_date = self.get_expiry_date()
+        if (
+            not must_create
+            and self._persisted_data is not None
+            and data == self._persisted_data
+            and expire_date - self._persisted_expiry < timedelta(seconds=settings.SESSION_DB_REFRESH_WINDOW)
+        ):
+            return
+        DBStore.save(self, must_create)
+        self._remember(data, expire_date)
+        self._cache_entry(data, expire_date)
+
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+    @classmethod
+    def clear_expired(cls, batch_size=PRUNE_BATCH_SIZE, pause=0.0):
+        """Delete expired rows ``batch_size`` at a time, pausing between batches; return the count.
+
+        Short batches keep each delete's write lock brief, so requests
+        writing messages or rounds are not held up behind one big delete.
+        """
+        model = cls.get_model_class()
+        deleted = 0
+        while True:
+            keys = list(
+                model.objects
+                .filter(expire_date__lt=timezone.now())
+                .values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                return deleted
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
+            if len(keys) < batch_size:
+                return deleted
+            if pause:
+                time.sleep(pause)
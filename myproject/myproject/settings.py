@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its total covers every other middleware
+    'myproject.middleware.RequestTimingMiddleware',
+    'myproject.middleware.MetricsMiddleware',
+    'myproject.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,7 +62,8 @@ ROOT_URLCONF = 'myproject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to RequestTimingMiddleware
+        'BACKEND': 'myproject.timing.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'coachingsite.context_processors.unread_messages',
             ],
         },
     },
@@ -72,6 +79,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'myproject.wsgi.application'
 
+# Keeps test runs out of METRICS_DIR
+TEST_RUNNER = 'myproject.test_runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -80,10 +90,48 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # The web process and the run_jobs worker write concurrently: WAL lets
+        # readers proceed during writes, and IMMEDIATE transactions take the
+        # write lock up front instead of failing halfway with "database is locked".
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared by every worker process: cached users, sessions and unread totals
+# are invalidated here, and a per-process cache would leave the other
+# workers serving stale entries. Deployments set REDIS_URL (and install
+# redis-py). Without it a file cache is used, which suits the development
+# server only: every write lists the whole cache directory to decide whether
+# to cull, and expired files are only removed when read or culled, so
+# MAX_ENTRIES is kept small and a full cache evicts entries at random.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000,
+            },
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -111,13 +159,119 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Message and Response videos: deduplicated by content, see coachingsite/storage.py
+    'videos': {
+        'BACKEND': 'coachingsite.storage.DedupStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Seconds browsers may reuse a media file before revalidating it
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+# Let the fronting proxy send media bytes after the permission check:
+# None (Django sends them), 'x-accel-redirect' (nginx) or 'x-sendfile'
+MEDIA_OFFLOAD = None
+# Internal nginx location that maps to MEDIA_ROOT for X-Accel-Redirect
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Resumable uploads: partial files live outside MEDIA_ROOT until finalised
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'upload_sessions'
+CHUNKED_UPLOAD_MAX_CHUNK = 16 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 8 * 1024 * 1024 * 1024
+# Seconds without a new chunk before `manage.py prune_uploads` deletes a session
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+
 # Django Debug Toolbar 
 # INTERNAL_IPS = ['127.0.0.1']
 
 # Authentication settings
+# Loads the session's user and profile from the cache; see coachingsite/usercache.py
+AUTHENTICATION_BACKENDS = ['coachingsite.backends.CachedModelBackend']
+# Seconds a signed-in user may be served from the cache without a change
+AUTH_USER_CACHE_TIMEOUT = 300
+
+# Sessions are read from the cache and written to the database only when
+# they change; see myproject/sessions.py. Prune expired rows with
+# `manage.py prune_sessions`.
+SESSION_ENGINE = 'myproject.sessions'
+# Must be shared by every worker process, like the default cache above
+SESSION_CACHE_ALIAS = 'default'
+# Seconds a session is served from the cache before it is read again
+SESSION_CACHE_TIMEOUT = 60
+# An unchanged session is rewritten only to move its expiry this many seconds
+SESSION_DB_REFRESH_WINDOW = 24 * 60 * 60
+
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
-LOGIN_EXEMPT_URLNAMES = ['login', 'logout', 'register', 'admin:login', 'admin:logout']
+# URLs LoginRequiredMiddleware lets anonymous users reach, by URL name or
+# whole namespace. LOGIN_URL, STATIC_URL and MEDIA_URL are always exempt.
+LOGIN_EXEMPT_URLNAMES = [
+    'coachingsite:home',
+    'login',
+    'logout',
+    'register',
+    'password_reset',
+    'password_reset_done',
+    'password_reset_confirm',
+    'password_reset_complete',
+    # the admin sends anonymous users to its own login page
+    'admin',
+    'slow_requests',
+    # Prometheus scrapers do not log in; the view checks their address
+    'metrics',
+]
+
+# Seconds a user's unread message total may be served from the cache
+UNREAD_COUNT_CACHE_TIMEOUT = 60
+
+# Live conversation updates (Server-Sent Events)
+CONVERSATION_EVENTS_HEARTBEAT = 15
+CONVERSATION_EVENTS_RETRY_MS = 5000
+
+# Server-Timing headers (sent to staff and INTERNAL_IPS only) and a
+# per-process log of the slowest requests, with their SQL, shown to staff at
+# /admin/slow-requests/
+REQUEST_TIMING_ENABLED = True
+SLOW_REQUEST_LOG_SIZE = 50
+# SQL statements kept per logged request
+SLOW_REQUEST_MAX_QUERIES = 200
+
+# Prometheus metrics at /metrics (myproject/metrics.py). Every worker
+# process writes its own file in METRICS_DIR; /metrics adds them up and
+# folds in the files of exited processes, so the directory must be local to
+# one host. None keeps each process's metrics in memory, visible only to
+# itself.
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / 'metrics'
+# Scrapers allowed without logging in; staff can always read /metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Sampling profiler (myproject/profiling.py). Requests slower than the
+# threshold, and one in PROFILING_SAMPLE_RATE requests (0 for none), are
+# written to PROFILING_DIR as collapsed stacks; merge them per view with
+# `manage.py merge_profiles`.
+PROFILING_ENABLED = False
+PROFILING_THRESHOLD_MS = 500
+PROFILING_SAMPLE_RATE = 0
+PROFILING_INTERVAL_MS = 10
+PROFILING_DIR = BASE_DIR / 'profiles'
+# Older profiles are deleted past this many files
+PROFILING_MAX_FILES = 500
+
+# Background jobs (coachingsite/jobs.py), run by `manage.py run_jobs`
+JOBS_POLL_INTERVAL = 1.0
+# Seconds a claimed job stays leased to its worker without a renewal
+JOBS_VISIBILITY_TIMEOUT = 300
+JOBS_MAX_ATTEMPTS = 5
+# Retry backoff in seconds: base * 2 ** (attempt - 1), capped at max
+JOBS_RETRY_BASE = 10
+JOBS_RETRY_MAX = 60 * 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
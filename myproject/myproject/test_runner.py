@@ -0,0 +1,35 @@
+"""Test runner that keeps test runs out of the directories the site uses."""
+
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import metrics
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner with METRICS_DIR and the cache in a throwaway directory."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.scratch_dir = tempfile.mkdtemp(prefix='myproject-tests-')
+        self.scratch_settings = override_settings(
+            METRICS_DIR=os.path.join(self.scratch_dir, 'metrics'),
+            CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': os.path.join(self.scratch_dir, 'cache'),
+                },
+            },
+        )
+        self.scratch_settings.enable()
+        metrics.reset_store()
+
+    def teardown_test_environment(self, **kwargs):
+        metrics.reset_store()
+        self.scratch_settings.disable()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
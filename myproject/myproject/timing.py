@@ -0,0 +1,151 @@
+"""Per-request timing: total, database and template time.
+
+RequestTimingMiddleware starts a RequestTimer for each request. Database
+time is collected with a connection execute wrapper. Template time comes
+from TimedDjangoTemplates, the template backend configured in settings,
+which adds the time of every top-level render to the current request's
+timer. Renders outside a timed request cost one context variable lookup.
+
+The slowest requests of each process, with their SQL, are kept in
+``slow_requests`` and listed for staff at /admin/slow-requests/.
+"""
+
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.utils import timezone
+
+_current = contextvars.ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    """Accumulates the time one request spends in the database and in templates."""
+
+    def __init__(self, max_queries):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.query_count = 0
+        self.template_seconds = 0.0
+        self.queries = []
+        self.max_queries = max_queries
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_seconds += elapsed
+            self.query_count += 1
+            if len(self.queries) < self.max_queries:
+                # executemany() parameter lists can be huge, so they are not kept
+                self.queries.append((sql, None if many else params, elapsed * 1000))
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_timer():
+    """The RequestTimer of the request being handled, or None."""
+    return _current.get()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timer = _current.get()
+        if timer is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timer.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for RequestTimingMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+@dataclass
+class SlowRequest:
+    method: str
+    path: str
+    status: int
+    total_ms: float
+    db_ms: float
+    query_count: int
+    template_ms: float
+    queries: list = field(default_factory=list)
+    recorded_at: datetime = field(default_factory=timezone.now)
+
+
+class SlowRequestLog:
+    """The ``size`` slowest requests seen by this process.
+
+    Kept as a bounded min-heap, so recording a request that is faster than
+    every kept one is a single comparison.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def would_keep(self, total_ms):
+        heap = self._heap
+        if len(heap) < self.size:
+            return True
+        return bool(heap) and total_ms > heap[0][0]
+
+    def record(self, entry):
+        if self.size <= 0:
+            return
+        item = (entry.total_ms, next(self._order), entry)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif entry.total_ms > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def entries(self):
+        """Kept requests, slowest first."""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            self._heap = heapq.nlargest(size, self._heap) if size > 0 else []
+            heapq.heapify(self._heap)
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+slow_requests = SlowRequestLog(0)
@@ -14,23 +14,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
-from coachingsite.views import register
+from coachingsite.views import register, serve_media
 from django.contrib.auth import views as auth_views
+from coachingsite.admin import slow_requests_view
 from coachingsite.forms import CustomAuthenticationForm
+from myproject.metrics import metrics_view
 
 urlpatterns = [
+    path('admin/slow-requests/', admin.site.admin_view(slow_requests_view), name='slow_requests'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/login/', auth_views.LoginView.as_view(authentication_form=CustomAuthenticationForm), name='login'),
     path('accounts/', include('django.contrib.auth.urls')),  
     path('accounts/register/', register, name='register'),
     path('', include('coachingsite.urls', namespace='coachingsite')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Uploaded media goes through a permission-checked, Range-aware view.
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
 
 # if settings.DEBUG:
 # 	import debug_toolbar